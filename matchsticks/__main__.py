@@ -1,6 +1,5 @@
 # (c) Nikolaus Howe 2021
-from matchsticks.game_graphics.main_window import MainWindow
+from matchsticks.cli import main
 
 
-def main():
-  MainWindow()
+main()
@@ -1,11 +1,19 @@
 # (c) 2021 Nikolaus Howe
-import time
+from __future__ import annotations
 
 from overrides import overrides
+from typing import Optional, Union
 
+import typing
+if typing.TYPE_CHECKING:
+  from matchsticks.game_graphics.game_window import GameWindow
+
+from matchsticks.clock import Clock
 from matchsticks.game import Game
-from matchsticks.game_graphics.game_window import GameWindow
+from matchsticks.game_record import GameRecordWriter
 from matchsticks.player import HumanPlayer, MCPlayer, Player, PretrainedPlayer,  VisualHumanPlayer
+from matchsticks.trajectories import TrajectoryWriter
+from matchsticks.utils import BackButtonException, ClosedWindowException
 
 
 class Arena(object):
@@ -14,7 +22,9 @@ class Arena(object):
                player_1: Player,
                player_2: Player,
                verbose: bool = False,
-               silent: bool = False) -> None:
+               silent: bool = False,
+               recorder: Optional[Union[TrajectoryWriter, GameRecordWriter]] = None,
+               clock: Optional[Clock] = None) -> None:
     """
     An arena, which coordinates the players and game.
 
@@ -23,13 +33,19 @@ class Arena(object):
     :param player_2: the second player
     :param verbose: whether or not to print extra information
     :param training_mode: whether or not to print the game state
+    :param recorder: if given, the moves of the game are recorded with it (as a trajectory, or as a game record)
+    :param clock: if given, the players are timed with it, and lose if they run out of time
     """
     self.game = game
     self.p1 = player_1
     self.p2 = player_2
     self.next_player_to_move = self.p1
+    self.winner = None
     self.verbose = verbose
     self.silent = silent
+    self.recorder = recorder
+    self.clock = clock
+    self.lost_on_time = None  # the player who ran out of time, if any
 
   def switch_active_player(self) -> None:
     """
@@ -50,15 +66,35 @@ class Arena(object):
     """
     game_on = True
     move_counter = 0
+    if self.recorder:
+      self.recorder.start_game(self.game.get_state())
+    if self.clock:
+      self.clock.start_game()
     while game_on:
       if not self.silent:
         print("Game state:", self.game.get_state())
 
-      # Get the active player to choose a move
+      # Get the active player to choose a move (on the clock, if there is one)
+      if self.clock:
+        self.next_player_to_move.start_turn(self.clock.time_left(move_counter % 2))
+        self.clock.start_move()
       move = self.next_player_to_move.move(self.game)
+      if self.clock and self.clock.stop_move(move_counter % 2, self.next_player_to_move.name):
+        self.lost_on_time = self.next_player_to_move
+        if self.verbose:
+          print(f"{self.next_player_to_move.name} ran out of time")
+        # A learning player still learns from the move it chose too late
+        if isinstance(self.next_player_to_move, MCPlayer) and move_counter >= 2:
+          self.next_player_to_move.receive_reward(0.)
+        # The player who ran out of time loses, so let the other player be the one who moves next
+        self.switch_active_player()
+        break
       if self.verbose:
         print(f"{self.next_player_to_move.name} chose move {move}")
 
+      if self.recorder:
+        self.recorder.record(self.game.get_state(), move, move_counter % 2)
+
       # Tell game to do the move
       game_on = self.game.play_move(move)
 
@@ -75,7 +111,11 @@ class Arena(object):
     if self.verbose:
       print("Game over!")
 
+    if self.recorder:
+      self.recorder.end_game(last_mover_won=self.lost_on_time is not None)
+
     # Tell the players whether they won or lost
+    self.winner = self.next_player_to_move
     self.next_player_to_move.receive_reward(1.)
     self.next_player_to_move.update_and_end_episode()
     if self.verbose:
@@ -89,7 +129,13 @@ class Arena(object):
 
 class VisualArena(Arena):
   @overrides
-  def __init__(self, game: Game, player_1: Player, player_2: Player, gw: GameWindow) -> None:
+  def __init__(self,
+               game: Game,
+               player_1: Player,
+               player_2: Player,
+               gw: GameWindow,
+               min_move_delay: float = 0.5,
+               recorder: Optional[Union[TrajectoryWriter, GameRecordWriter]] = None) -> None:
     """
     A special arena which interfaces with a game window,
     allowing for the game to be watched and played with a GUI.
@@ -97,9 +143,12 @@ class VisualArena(Arena):
     :param player_1: the first player (moves first)
     :param player_2: the second player
     :param gw: the game window
+    :param min_move_delay: the minimum time (in seconds) a computer player's turn takes, so its moves can be seen
+    :param recorder: if given, the moves of the game are recorded with it (games which aren't finished aren't recorded)
     """
     self.gw = gw
-    super().__init__(game, player_1, player_2)
+    self.min_move_delay = min_move_delay
+    super().__init__(game, player_1, player_2, recorder=recorder)
 
   @overrides
   def play(self) -> None:
@@ -111,44 +160,60 @@ class VisualArena(Arena):
     """
     game_on = True
     move_counter = 0
-    while game_on:
-      time.sleep(0.5)
-
-      # print(self.gw.pyramid)
-      # print()
-
-      # print("the next player is", self.next_player_to_move.name)
-      # Tell the human player to move
-      # if isinstance(self.next_player_to_move, VisualHumanPlayer):
-      #   print("It's the human's turn!")
-
-      # Get the active player to choose a move
-      move = self.next_player_to_move.move(self.game)
-
-      # if move is None:
-      #   self.switch_active_player()
-      #   break  # Game over. Whoever clicked the 'x' loses.
-
-      # Tell game to do the move
-      game_on = self.game.play_move(move)
-
-      # If it's a learning player, give it a reward for this move (but not on its first move)
-      # if isinstance(self.next_player_to_move, MCPlayer) and move_counter >= 2:
-      #   self.next_player_to_move.receive_reward(0.)
-      # NOTE: no learning in the visual arena
-
-      # Draw the move (only draw line if not a visual human player)
-      if not self.next_player_to_move.is_visual_human():
-        self.gw.draw_move(move)
-
-      # Update the pyramid to reflect that the move has been played
-      self.gw.pyramid.adjust(move)
-
-      # Change the active player
-      self.switch_active_player()
-
-      # Increment the move counter
-      move_counter += 1
+    if self.recorder:
+      self.recorder.start_game(self.game.get_state())
+    try:
+      while game_on:
+        # print(self.gw.pyramid)
+        # print()
+
+        # print("the next player is", self.next_player_to_move.name)
+        # Tell the human player to move
+        # if isinstance(self.next_player_to_move, VisualHumanPlayer):
+        #   print("It's the human's turn!")
+
+        # Get the active player to choose a move (computer players think in the background,
+        # so that the window stays responsive)
+        if self.next_player_to_move.is_visual_human():
+          move = self.next_player_to_move.move(self.game)
+        else:
+          move = self.gw.get_computer_move(self.next_player_to_move, self.min_move_delay)
+
+        # if move is None:
+        #   self.switch_active_player()
+        #   break  # Game over. Whoever clicked the 'x' loses.
+
+        if self.recorder:
+          self.recorder.record(self.game.get_state(), move, move_counter % 2)
+
+        # Tell game to do the move
+        game_on = self.game.play_move(move)
+
+        # If it's a learning player, give it a reward for this move (but not on its first move)
+        # if isinstance(self.next_player_to_move, MCPlayer) and move_counter >= 2:
+        #   self.next_player_to_move.receive_reward(0.)
+        # NOTE: no learning in the visual arena
+
+        # Draw the move (only draw line if not a visual human player)
+        if not self.next_player_to_move.is_visual_human():
+          self.gw.draw_move(move)
+
+        # Update the pyramid to reflect that the move has been played
+        self.gw.pyramid.adjust(move)
+
+        # Change the active player
+        self.switch_active_player()
+
+        # Increment the move counter
+        move_counter += 1
+    except (BackButtonException, ClosedWindowException):
+      # The game was abandoned, so it isn't recorded
+      if self.recorder:
+        self.recorder.abort_game()
+      raise
+
+    if self.recorder:
+      self.recorder.end_game()
 
     # Tell the game window that the game is over
     self.gw.game_over(isinstance(self.next_player_to_move, VisualHumanPlayer))
@@ -199,6 +264,8 @@ if __name__ == "__main__":
   # p1.save_q(p1.name)
   # p2.save_q(p2.name)
 
+  from matchsticks.game_graphics.game_window import GameWindow
+
   g1 = Game(4)
   gw = GameWindow(game=g1)
 
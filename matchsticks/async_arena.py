@@ -0,0 +1,230 @@
+# (c) Nikolaus Howe 2021
+import asyncio
+
+from abc import ABC, abstractmethod
+from overrides import overrides
+from typing import Optional, Union
+
+from matchsticks.game import Game
+from matchsticks.game_types import Move
+from matchsticks.move_client import AsyncMoveClient
+from matchsticks.player import MCPlayer, Player
+
+
+class AsyncPlayer(ABC):
+  def __init__(self, name: str = "Alice") -> None:
+    """
+    An abstract class for players whose moves take a while to arrive (for example,
+    players on the other side of a network connection), so that many games can be
+    played at once on one event loop.
+
+    :param name: the name given to this player
+    """
+    self.name = name
+
+  @abstractmethod
+  async def move(self, game: Game) -> Move:
+    """
+    Get the player to choose a move.
+
+    :param game: the current game
+    :return: a move in the format of an int 3-tuple
+    """
+    pass
+
+  def receive_reward(self, reward: float) -> None:
+    """
+    Tell the player what reward they got for the turn.
+
+    :param reward: the instantaneous reward
+    :return:
+    """
+    pass
+
+  def update_and_end_episode(self) -> None:
+    """
+    Tell the player that the game is over.
+
+    :return:
+    """
+    pass
+
+
+class SyncPlayerAdapter(AsyncPlayer):
+  @overrides
+  def __init__(self, player: Player, in_thread: bool = False) -> None:
+    """
+    Lets an ordinary Player play in an AsyncArena.
+
+    :param player: the player
+    :param in_thread: whether to choose moves in a worker thread (for players which block,
+                      such as HumanPlayer), instead of directly on the event loop
+    """
+    super().__init__(player.name)
+    self.player = player
+    self.in_thread = in_thread
+
+  @overrides
+  async def move(self, game: Game) -> Move:
+    """
+    Get the wrapped player to choose a move.
+
+    :param game: the current game
+    :return: the move
+    """
+    if self.in_thread:
+      return await asyncio.to_thread(self.player.move, game)
+    return self.player.move(game)
+
+  @overrides
+  def receive_reward(self, reward: float) -> None:
+    self.player.receive_reward(reward)
+
+  @overrides
+  def update_and_end_episode(self) -> None:
+    self.player.update_and_end_episode()
+
+
+class RemotePlayer(AsyncPlayer):
+  @overrides
+  def __init__(self, client: AsyncMoveClient, player_type: Optional[str] = None, name: str = 'Remote') -> None:
+    """
+    A player whose moves come from a MoveServer.
+
+    :param client: a client connected to the server
+    :param player_type: which of the server's players to ask (the server's default if not given)
+    :param name: the name given to this player
+    """
+    super().__init__(name)
+    self.client = client
+    self.player_type = player_type
+
+  @overrides
+  async def move(self, game: Game) -> Move:
+    """
+    Ask the server for a move.
+
+    :param game: the current game
+    :return: the move
+    """
+    moves = await self.client.get_moves([game.get_state()], self.player_type)
+    return moves[0]
+
+
+class AsyncArena(object):
+  def __init__(self,
+               game: Game,
+               player_1: Union[Player, AsyncPlayer],
+               player_2: Union[Player, AsyncPlayer],
+               move_timeout: Optional[float] = None,
+               verbose: bool = False) -> None:
+    """
+    An arena for players whose moves take a while to arrive. A player who doesn't move within
+    the time limit, fails to give a move, or gives a move which isn't allowed forfeits the game.
+
+    :param game: the game
+    :param player_1: the first player (goes first). Ordinary Players are wrapped in a SyncPlayerAdapter
+    :param player_2: the second player
+    :param move_timeout: how long (in seconds) each player has for each move (no limit if None)
+    :param verbose: whether or not to print extra information
+    """
+    self.game = game
+    self.p1 = player_1 if isinstance(player_1, AsyncPlayer) else SyncPlayerAdapter(player_1)
+    self.p2 = player_2 if isinstance(player_2, AsyncPlayer) else SyncPlayerAdapter(player_2)
+    self.next_player_to_move = self.p1
+    self.move_timeout = move_timeout
+    self.verbose = verbose
+    self.winner = None
+    self.forfeit_reason = None  # Why the loser forfeited, if they did
+
+  def switch_active_player(self) -> None:
+    """
+    Change whose turn it is.
+
+    :return:
+    """
+    if self.next_player_to_move == self.p1:
+      self.next_player_to_move = self.p2
+    else:
+      self.next_player_to_move = self.p1
+
+  @staticmethod
+  def is_learning_player(player: AsyncPlayer) -> bool:
+    """
+    Check whether a player learns from its rewards (in the same way as Arena decides).
+
+    :param player: the player
+    :return: whether it's a learning player
+    """
+    return isinstance(player, SyncPlayerAdapter) and isinstance(player.player, MCPlayer)
+
+  async def play(self) -> AsyncPlayer:
+    """
+    Run an entire game between the two players.
+
+    :return: the winner
+    """
+    game_on = True
+    move_counter = 0
+    while game_on:
+      player = self.next_player_to_move
+      try:
+        move = await asyncio.wait_for(player.move(self.game), self.move_timeout)
+      except asyncio.TimeoutError:
+        self.forfeit_reason = f"{player.name} ran out of time"
+        break
+      except Exception as e:
+        self.forfeit_reason = f"{player.name} couldn't move ({type(e).__name__}: {e})"
+        break
+      if move is None or not self.game.is_allowed(move):
+        self.forfeit_reason = f"{player.name} played a move which isn't allowed ({move})"
+        break
+      if self.verbose:
+        print(f"{player.name} chose move {move}")
+
+      game_on = self.game.play_move(move)
+
+      # If it's a learning player, give it a reward for this move (but not on its first move)
+      if self.is_learning_player(player) and move_counter >= 2:
+        player.receive_reward(0.)
+
+      self.switch_active_player()
+      move_counter += 1
+
+    if self.forfeit_reason is not None:
+      # The player who forfeited loses, so let the other player be the one who moves next
+      self.switch_active_player()
+      if self.verbose:
+        print(self.forfeit_reason)
+
+    # Tell the players whether they won or lost
+    self.winner = self.next_player_to_move
+    self.next_player_to_move.receive_reward(1.)
+    self.next_player_to_move.update_and_end_episode()
+    self.switch_active_player()
+    self.next_player_to_move.receive_reward(-1.)
+    self.next_player_to_move.update_and_end_episode()
+    if self.verbose:
+      print(f"{self.winner.name} won!")
+
+    return self.winner
+
+
+async def play_games(arenas: list[AsyncArena], max_concurrent: Optional[int] = None) -> list[AsyncPlayer]:
+  """
+  Play many games at the same time on the current event loop.
+
+  :param arenas: the arenas of the games
+  :param max_concurrent: the most games to have in progress at once (no limit if None)
+  :return: the winner of each game
+  """
+  if max_concurrent is None:
+    return list(await asyncio.gather(*(arena.play() for arena in arenas)))
+
+  semaphore = asyncio.Semaphore(max_concurrent)
+
+  async def play_one(arena: AsyncArena) -> AsyncPlayer:
+    async with semaphore:
+      return await arena.play()
+
+  return list(await asyncio.gather(*(play_one(arena) for arena in arenas)))
@@ -0,0 +1,228 @@
+# (c) Nikolaus Howe 2021
+import numpy as np
+
+from tqdm import trange
+from typing import Optional
+
+from matchsticks.game import Game
+from matchsticks.player import AfterstateValuePlayer, MCPlayer, Player, RandomPlayer
+from matchsticks.state_space import StateIndex
+
+
+def batch_ema_update(q: np.ndarray, sums: np.ndarray, counts: np.ndarray, step: float = 0.1) -> None:
+  """
+  Update value estimates in place with a batch of returns. Applying the
+  exponential averaging step q <- (1 - step) * q + step * g once for each of the
+  `count` returns is approximated by moving q towards their mean with the
+  combined weight 1 - (1 - step) ** count, which stays stable however many
+  returns a single entry receives in one batch.
+
+  :param q: the value estimates
+  :param sums: the sum of the returns received by each entry
+  :param counts: the number of returns received by each entry
+  :param step: the step size of a single update
+  :return:
+  """
+  updated = counts > 0
+  weight = 1. - (1. - step) ** counts[updated]
+  q[updated] += weight * (sums[updated] / counts[updated] - q[updated])
+
+
+def scatter_ema_update(q: np.ndarray, entries: tuple[np.ndarray, ...], returns: np.ndarray, step: float = 0.1) -> None:
+  """
+  Like batch_ema_update, but for a batch of returns given entry by entry. Only the entries which
+  received returns are touched, so the cost depends on the size of the batch rather than the size of q.
+
+  :param q: the value estimates (which must be contiguous)
+  :param entries: the index of the entry of q which each return is for, one array per dimension of q
+  :param returns: the returns
+  :param step: the step size of a single update
+  :return:
+  """
+  flat_entries, inverse = np.unique(np.ravel_multi_index(entries, q.shape), return_inverse=True)
+  counts = np.bincount(inverse)
+  sums = np.bincount(inverse, weights=returns)
+  q_flat = q.reshape(-1)
+  weight = 1. - (1. - step) ** counts
+  q_flat[flat_entries] += weight * (sums / counts - q_flat[flat_entries])
+
+
+class BatchDojo(object):
+  def __init__(self,
+               p1: Optional[Player] = None,
+               p2: Optional[Player] = None,
+               batch_size: int = 1024,
+               seed: Optional[int] = None) -> None:
+    """
+    A dojo which trains tabular players by running many self-play games in lockstep,
+    using array lookups for the players' policies and scattered bulk updates for their Q-tables.
+    The learning rule is the same as MCPlayer's (a discount of 0.9, and a step of 0.1),
+    and the trained Q-tables are written back into the players' Q dicts.
+
+    :param p1: the first player (if any). Must be an MCPlayer or a RandomPlayer
+    :param p2: the second player (if any). Must be an MCPlayer or a RandomPlayer
+    :param batch_size: how many games to play in lockstep
+    :param seed: the seed for the random number generator
+    """
+    if not p1:
+      p1 = MCPlayer()
+    if not p2:
+      p2 = MCPlayer()
+
+    for p in (p1, p2):
+      is_mc_player = isinstance(p, MCPlayer) and not isinstance(p, AfterstateValuePlayer)
+      if not is_mc_player and not isinstance(p, RandomPlayer):
+        raise Exception(f'The batch dojo can only train MCPlayers (against MCPlayers or RandomPlayers), '
+                        f'not {type(p).__name__}')
+
+    if not isinstance(p1, MCPlayer) and not isinstance(p2, MCPlayer):
+      raise Exception('Neither of these players can be trained!')
+
+    self.p1 = p1
+    self.p2 = p2
+    self.batch_size = batch_size
+    self.rng = np.random.default_rng(seed)
+
+  def _load_q(self, index: StateIndex) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Copy the players' Q-tables into an array, indexed by (player, state id, move id).
+
+    :param index: the index of the states to train on
+    :return: the Q array, and which states each player has visited before
+    """
+    q = np.full((2, index.num_states, index.max_moves), 0.1)
+    visited = np.zeros((2, index.num_states), dtype=bool)
+    for p_i, p in enumerate((self.p1, self.p2)):
+      if not isinstance(p, MCPlayer):
+        continue
+      for state, q_row in p.Q.items():
+        try:
+          s = index.get_id(state)
+        except KeyError:  # Not reachable from this position
+          continue
+        visited[p_i, s] = True
+        q[p_i, s, :len(q_row)] = list(q_row.values())
+    return q, visited
+
+  def _save_q(self, index: StateIndex, q: np.ndarray, visited: np.ndarray) -> None:
+    """
+    Write the trained values back into the players' Q-tables.
+
+    :param index: the index of the states which were trained on
+    :param q: the Q array
+    :param visited: which states each player has visited
+    :return:
+    """
+    for p_i, p in enumerate((self.p1, self.p2)):
+      if not isinstance(p, MCPlayer):
+        continue
+      for s in np.flatnonzero(visited[p_i]):
+        moves = index.get_moves(s)
+        p.Q[index.get_state(s)] = dict(zip(moves, q[p_i, s, :len(moves)].tolist()))
+
+  def _play_batch(self, index: StateIndex, q: np.ndarray, first: np.ndarray) -> tuple[np.ndarray, ...]:
+    """
+    Play a batch of games in lockstep.
+
+    :param index: the index of the states to play on
+    :param q: the Q array
+    :param first: for each game, which player moves first (0 or 1)
+    :return: the states and moves of each game, the player who made each move, and the length of each game
+    """
+    num_games = len(first)
+    max_length = int(sum(index.get_state(index.start_id)))  # Every move crosses off at least one stick
+    eps = np.array([p.eps if isinstance(p, MCPlayer) else 1. for p in (self.p1, self.p2)])
+
+    states = np.full(num_games, index.start_id, dtype=np.int32)
+    history_states = np.zeros((num_games, max_length), dtype=np.int32)
+    history_moves = np.zeros((num_games, max_length), dtype=np.int32)
+    lengths = np.zeros(num_games, dtype=np.int32)
+    move_ids = np.arange(index.max_moves)
+
+    for ply in range(max_length):
+      playing = np.flatnonzero(states != index.end_id)
+      if not len(playing):
+        break
+      s = states[playing]
+      p = (first[playing] + ply) % 2
+      num_moves = index.move_counts[s]
+
+      # Epsilon-greedy choice of move, with ties broken towards the lowest move id (like MCPlayer.policy)
+      q_rows = np.where(move_ids < num_moves[:, None], q[p, s], -np.inf)
+      greedy_moves = q_rows.argmax(axis=1)
+      random_moves = (self.rng.random(len(playing)) * num_moves).astype(np.int32)
+      m = np.where(self.rng.random(len(playing)) < eps[p], random_moves, greedy_moves)
+
+      history_states[playing, ply] = s
+      history_moves[playing, ply] = m
+      lengths[playing] += 1
+      states[playing] = index.transitions[s, m]
+
+    movers = (first[:, None] + np.arange(max_length)) % 2
+    return history_states, history_moves, movers, lengths
+
+  def _train_loop(self, position: tuple[int, ...], num_games: int) -> None:
+    """
+    Run the training loop.
+
+    :param position: the position to start each game from
+    :param num_games: the number of games
+    :return:
+    """
+    index = StateIndex(position)
+    q, visited = self._load_q(index)
+    learning = np.array([isinstance(p, MCPlayer) for p in (self.p1, self.p2)])
+
+    num_batches = -(-num_games // self.batch_size)
+    for b in trange(num_batches):
+      # Make each player start half the time (in the same order as Dojo)
+      game_ids = np.arange(b * self.batch_size, min((b + 1) * self.batch_size, num_games))
+      first = (game_ids + 1) % 2
+      history_states, history_moves, movers, lengths = self._play_batch(index, q, first)
+
+      # The player who crosses off the last stick loses. Everyone else gets a
+      # discounted +/-1 reward, discounted once for each of their own later moves.
+      moves_until_end = lengths[:, None] - 1 - np.arange(history_states.shape[1])
+      played = (moves_until_end >= 0) & learning[movers]
+      rewards = np.where(moves_until_end % 2 == 0, -1., 1.)
+      returns = 0.9 ** (moves_until_end // 2) * rewards
+
+      p, s, m = movers[played], history_states[played], history_moves[played]
+      scatter_ema_update(q, (p, s, m), returns[played])
+      visited[p, s] = True
+
+    self._save_q(index, q, visited)
+
+  def train_players(self,
+                    num_games: int,
+                    num_layers: Optional[int] = 4) -> None:
+    """
+    Train the players in the dojo.
+
+    :param num_games: for how many games
+    :param num_layers: how many layers should the game have (default 4)
+    :return:
+    """
+    self._train_loop(Game(num_layers).get_state(), num_games)
+
+  def drill_position(self, num_games: int, position: list[int]) -> None:
+    """
+    Train the agents on a given position.
+
+    :param num_games: how many games to train for
+    :param position: the position to train on
+    :return:
+    """
+    self._train_loop(tuple(sorted(position)), num_games)
+
+  def get_player(self, second=False) -> Player:
+    """
+    Return the player.
+
+    :param second: if true, returns the second player instead of the first
+    :return: the player
+    """
+    if not second:
+      return self.p1
+    else:
+      return self.p2
@@ -0,0 +1,73 @@
+# (c) Nikolaus Howe 2021
+from typing import Optional
+
+from matchsticks.arena import Arena
+from matchsticks.clock import Clock
+from matchsticks.game import Game
+from matchsticks.player import CalibratedPlayer, Player, RandomPlayer
+
+
+def get_win_rate(player: Player,
+                 opponent: Player,
+                 num_layers: int = 4,
+                 num_games: int = 1_000,
+                 clock: Optional[Clock] = None) -> float:
+  """
+  Play a tournament between two players, with each of them starting half of the games.
+
+  :param player: the player whose win rate we want
+  :param opponent: the player they play against
+  :param num_layers: how many layers the games should have
+  :param num_games: how many games to play
+  :param clock: if given, every game is played with this time control (and the clock keeps all the move latencies)
+  :return: the fraction of the games won by player
+  """
+  num_wins = 0
+  for i in range(num_games):
+    if i % 2:
+      a1 = Arena(Game(num_layers), player, opponent, silent=True, clock=clock)
+    else:
+      a1 = Arena(Game(num_layers), opponent, player, silent=True, clock=clock)
+    a1.play()
+    num_wins += a1.winner is player
+  return num_wins / num_games
+
+
+def calibrate_blunder_rate(target_win_rate: float,
+                           opponent: Optional[Player] = None,
+                           num_layers: int = 4,
+                           num_games: int = 2_000,
+                           tolerance: float = 0.01,
+                           max_iterations: int = 12) -> float:
+  """
+  Find the blunder rate at which a CalibratedPlayer wins a target fraction of its games against an opponent.
+  The win rate goes down as the blunder rate goes up, so this uses a bisection search.
+
+  :param target_win_rate: the fraction of games the calibrated player should win
+  :param opponent: the reference opponent (a random player by default)
+  :param num_layers: how many layers the games should have
+  :param num_games: how many games to play at each blunder rate we try
+  :param tolerance: stop once the measured win rate is this close to the target
+  :param max_iterations: the maximum number of blunder rates to try
+  :return: the blunder rate
+  """
+  if opponent is None:
+    opponent = RandomPlayer('Reference')
+
+  low, high = 0., 1.
+  blunder_rate = 0.5
+  for _ in range(max_iterations):
+    blunder_rate = (low + high) / 2
+    win_rate = get_win_rate(CalibratedPlayer(blunder_rate, 'Calibrated'), opponent, num_layers, num_games)
+    if abs(win_rate - target_win_rate) <= tolerance:
+      break
+    if win_rate > target_win_rate:
+      low = blunder_rate
+    else:
+      high = blunder_rate
+  return blunder_rate
+
+
+if __name__ == "__main__":
+  for difficulty, target in [('Easy', 0.6), ('Medium', 0.75), ('Hard', 0.9)]:
+    print(difficulty, calibrate_blunder_rate(target))
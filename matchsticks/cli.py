@@ -0,0 +1,304 @@
+# (c) Nikolaus Howe 2021
+import argparse
+import json
+import random
+
+from typing import Optional
+
+
+# Commands which have their own command line (everything after the command's name is passed on to it)
+DELEGATED_COMMANDS = {
+  'serve': ('matchsticks.server', 'serve moves from players over TCP'),
+  'load': ('matchsticks.move_client', 'generate load on a move server'),
+  'selfplay': ('matchsticks.selfplay', 'play games and write them to sharded trajectory files'),
+  'verify': ('matchsticks.verify', 'check the nim sum rule on every position up to a number of sticks'),
+  'stress': ('matchsticks.game_graphics.input_stress', 'measure how fast the game window deals with mouse strokes'),
+}
+
+
+def get_position(args: argparse.Namespace) -> tuple[int, ...]:
+  """
+  The position given by the --layers and --position options.
+
+  :param args: the parsed command line arguments
+  :return: the position
+  """
+  from matchsticks.game import Game
+
+  return tuple(sorted(args.position)) if args.position else Game(args.layers).get_state()
+
+
+def check_args(args: argparse.Namespace) -> None:
+  """
+  Check the options which the commands share (the position the games start from, and the descriptions
+  of the players), reporting any problem the way argparse reports the others (and exiting).
+
+  :param args: the parsed command line arguments
+  :return:
+  """
+  from matchsticks.game import game_from_position
+  from matchsticks.player import create_player
+
+  parser = args.parser
+  if getattr(args, 'position', None):
+    try:
+      game_from_position(args.position)
+    except ValueError as e:
+      parser.error(str(e))
+  elif hasattr(args, 'layers') and not 1 <= args.layers <= 8:
+    parser.error(f'the number of layers should be between 1 and 8 (not {args.layers})')
+
+  players = getattr(args, 'players', None) or []
+  duplicates = sorted({player_type for player_type in players if players.count(player_type) > 1})
+  if duplicates:
+    parser.error(f"each player should only be given once (not {', '.join(duplicates)})")
+
+  player_types = list(players) + ([args.opponent] if getattr(args, 'opponent', None) else [])
+  for player_type in player_types:
+    try:
+      create_player(player_type)
+    except ValueError as e:
+      parser.error(f"'{player_type}' isn't a player ({e})")
+    except SystemExit:  # PretrainedPlayer exits (after saying why) if it can't load its Q-table
+      parser.error(f"couldn't load the player '{player_type}'")
+
+
+def seed(args: argparse.Namespace) -> None:
+  """
+  Seed the random number generators with the --seed option (if it was given).
+
+  :param args: the parsed command line arguments
+  :return:
+  """
+  if args.seed is not None:
+    import numpy as np
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+
+
+def play(args: argparse.Namespace) -> None:
+  """
+  Open the game's window.
+
+  :param args: the parsed command line arguments
+  :return:
+  """
+  from matchsticks.game_graphics.main_window import MainWindow
+
+  MainWindow()
+
+
+def train(args: argparse.Namespace) -> None:
+  """
+  Train a learning player in a Dojo, and save what it has learned.
+
+  :param args: the parsed command line arguments
+  :return:
+  """
+  from matchsticks.dojo import Dojo
+  from matchsticks.player import AfterstateValuePlayer, MCPlayer, create_player
+  from matchsticks.q_store import QStore
+
+  def make_learner(name: str, spill_filename: Optional[str]) -> MCPlayer:
+    if args.learner == 'afterstate':
+      return AfterstateValuePlayer(name)
+    q_store = QStore(args.max_states, spill_filename) if args.max_states is not None else None
+    return MCPlayer(name, q_store=q_store)
+
+  if args.learner == 'afterstate' and (args.max_states is not None or args.spill):
+    args.parser.error('--max-states and --spill only apply to the mc learner (the afterstate learner keeps a V table)')
+  if args.spill and args.max_states is None:
+    args.parser.error('--spill needs --max-states (the Q-table only spills to disk once it holds that many states)')
+
+  seed(args)
+  learner = make_learner('Learner', args.spill)
+  if args.opponent:
+    opponent = create_player(args.opponent, 'Opponent')
+  else:
+    # The learner's sparring partner is another learner, whose Q-table needs bounding too
+    opponent = make_learner('Opponent', args.spill + '.opponent' if args.spill else None)
+  dojo = Dojo(learner, opponent)
+  dojo.drill_position(args.games, list(get_position(args)))
+  learner.save_q(args.output)
+  results = {'games': args.games, 'position': list(get_position(args)), 'output': args.output}
+  for key, player in [('q_store', learner), ('opponent_q_store', opponent)]:
+    if isinstance(getattr(player, 'Q', None), QStore):
+      results[key] = player.Q.stats()
+      player.Q.close()
+  print(json.dumps(results))
+
+
+def evaluate(args: argparse.Namespace) -> None:
+  """
+  Play a round-robin tournament between players, and print the win rate of each one against each other one.
+
+  :param args: the parsed command line arguments
+  :return:
+  """
+  from matchsticks.calibration import get_win_rate
+  from matchsticks.player import create_player
+
+  seed(args)
+  players = [create_player(player_type, player_type) for player_type in args.players]
+  win_rates = {player_type: {} for player_type in args.players}
+  for i, player in enumerate(players):
+    for j in range(i + 1, len(players)):
+      win_rate = get_win_rate(player, players[j], args.layers, args.games)
+      win_rates[args.players[i]][args.players[j]] = win_rate
+      win_rates[args.players[j]][args.players[i]] = 1 - win_rate
+  scores = {player_type: sum(rates.values()) / len(rates) if rates else 0. for player_type, rates in win_rates.items()}
+  print(json.dumps({'layers': args.layers, 'games': args.games, 'win_rates': win_rates, 'scores': scores}, indent=2))
+
+
+def solve(args: argparse.Namespace) -> None:
+  """
+  Solve a position exactly, and print whether the player to move wins, and the moves which win.
+
+  :param args: the parsed command line arguments
+  :return:
+  """
+  from matchsticks.game import game_from_position
+  from matchsticks.solver import predicts_win, solve
+
+  misere = not args.normal
+  game = game_from_position(args.position)
+  table = {}
+  winning_moves = []
+  for move in game.get_allowed():
+    game.push(move)
+    if not solve(game.get_state(), misere, table):
+      winning_moves.append(list(move))
+    game.pop()
+  print(json.dumps({
+    'position': list(game.get_state()),
+    'ending': 'misere' if misere else 'normal',
+    'wins': bool(winning_moves),
+    'nim_rule_agrees': predicts_win(game.get_state(), misere) == bool(winning_moves),
+    'winning_moves': winning_moves,
+    'states_solved': len(table),
+  }, indent=2))
+
+
+def bench(args: argparse.Namespace) -> None:
+  """
+  Measure how long players take to choose their moves, in the positions of games between random players.
+
+  :param args: the parsed command line arguments
+  :return:
+  """
+  import time
+
+  from matchsticks.game import game_from_position
+  from matchsticks.player import create_player
+  from matchsticks.server import LatencyHistogram
+
+  seed(args)
+  position = get_position(args)
+
+  # Collect the positions first, so that every player is timed on the same ones
+  states = []
+  while len(states) < args.moves:
+    game = game_from_position(position)
+    while game.is_still_on() and len(states) < args.moves:
+      states.append(game.get_state())
+      game.play_move(random.choice(game.get_allowed()))
+
+  results = {}
+  for player_type in args.players:
+    player = create_player(player_type)
+    latency = LatencyHistogram()
+    start_time = time.perf_counter()
+    for state in states:
+      game = game_from_position(state)
+      move_start_time = time.perf_counter()
+      player.move(game)
+      latency.record(time.perf_counter() - move_start_time)
+    seconds = time.perf_counter() - start_time
+    results[player_type] = {'moves_per_second': len(states) / seconds if seconds else 0., 'latency': latency.summary()}
+  print(json.dumps({'position': list(position), 'moves': len(states), 'players': results}, indent=2))
+
+
+def make_parser() -> argparse.ArgumentParser:
+  """
+  Make the parser for the command line.
+
+  :return: the parser
+  """
+  parser = argparse.ArgumentParser(prog='python -m matchsticks',
+                                   description='Play matchsticks, or train, evaluate, solve and benchmark players. '
+                                               'Without a command, the game window is opened.')
+  commands = parser.add_subparsers(dest='command', metavar='command')
+
+  # Options shared between the commands
+  game_options = argparse.ArgumentParser(add_help=False)
+  game_options.add_argument('--layers', type=int, default=4, help='how many layers the games start with')
+  game_options.add_argument('--position', type=int, nargs='+', default=None,
+                            help='the rows the games start from (instead of a standard game)')
+  seed_options = argparse.ArgumentParser(add_help=False)
+  seed_options.add_argument('--seed', type=int, default=None, help='the seed for the random number generators')
+  player_help = ("players, such as 'random', 'perfect', 'cached:perfect', 'calibrated:0.2', 'pretrained:<file>' "
+                 "or 'afterstate:<file>'")
+
+  command = commands.add_parser('play', help='open the game window')
+  command.set_defaults(function=play, parser=command)
+
+  command = commands.add_parser('train', parents=[game_options, seed_options], help='train a learning player')
+  command.add_argument('--games', type=int, default=10_000, help='how many games to train for')
+  command.add_argument('--learner', choices=['mc', 'afterstate'], default='mc', help='the kind of learning player')
+  command.add_argument('--opponent', default=None, help=f'who to train against (another learner if not given): one of the {player_help}')
+  command.add_argument('--output', default='trained.player',
+                       help="where to save the learner's values (load them as 'pretrained:<file>', "
+                            "or as 'afterstate:<file>' for the afterstate learner)")
+  command.add_argument('--max-states', type=int, default=None,
+                       help='the most states to keep in memory (no limit if not given; only for the mc learner)')
+  command.add_argument('--spill', default=None,
+                       help='a file to keep the states evicted from memory in (with --max-states); '
+                            'the learner trained against, if any, uses the same name with .opponent added')
+  command.set_defaults(function=train, parser=command)
+
+  command = commands.add_parser('eval', parents=[seed_options], help='play a tournament between players')
+  command.add_argument('players', nargs='+', help=f'the {player_help}')
+  command.add_argument('--games', type=int, default=1_000, help='how many games each pair of players plays')
+  command.add_argument('--layers', type=int, default=4, help='how many layers the games start with')
+  command.set_defaults(function=evaluate, parser=command)
+
+  command = commands.add_parser('solve', help='solve a position exactly')
+  command.add_argument('position', type=int, nargs='+', help='the rows of the position')
+  command.add_argument('--normal', action='store_true', help='whoever crosses off the last stick wins (instead of losing)')
+  command.set_defaults(function=solve, parser=command)
+
+  command = commands.add_parser('bench', parents=[game_options, seed_options], help='time how fast players move')
+  command.add_argument('players', nargs='+', help=f'the {player_help}')
+  command.add_argument('--moves', type=int, default=1_000, help='how many moves to time each player on')
+  command.set_defaults(function=bench, parser=command)
+
+  for name, (_, help_text) in DELEGATED_COMMANDS.items():
+    commands.add_parser(name, add_help=False, help=f'{help_text} (see {name} --help)')
+
+  return parser
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+  """
+  Run a command from the command line. Only the modules each command needs are imported,
+  so the commands which don't open a window start quickly, and work without a display.
+
+  :param argv: the command line arguments (without the program name)
+  :return:
+  """
+  import sys
+
+  argv = sys.argv[1:] if argv is None else argv
+  if argv and argv[0] in DELEGATED_COMMANDS:
+    import importlib
+
+    importlib.import_module(DELEGATED_COMMANDS[argv[0]][0]).main(argv[1:])
+    return
+
+  args = make_parser().parse_args(argv)
+  if args.command is None:
+    play(args)
+  else:
+    check_args(args)
+    args.function(args)
@@ -0,0 +1,79 @@
+# (c) Nikolaus Howe 2021
+import time
+
+from typing import Optional
+
+
+class Clock(object):
+  def __init__(self,
+               move_time: Optional[float] = None,
+               game_time: Optional[float] = None,
+               increment: float = 0.) -> None:
+    """
+    A chess-style clock for the two players in an Arena. A player who goes over their
+    time budget for a move, or runs out of time for the game, loses on time.
+    The same clock can be used for many games, and keeps the latency of every move.
+
+    :param move_time: the most time (in seconds) a player can take for a single move (no limit if None)
+    :param game_time: the total time (in seconds) each player has for the whole game (no limit if None)
+    :param increment: time (in seconds) added to a player's game time after each of their moves
+    """
+    self.move_time = move_time
+    self.game_time = game_time
+    self.increment = increment
+    self.remaining = [game_time, game_time]
+    self.latencies = []  # (player name, seconds) for every move timed with this clock
+    self._move_start = None
+
+  def start_game(self) -> None:
+    """
+    Reset both players' game time.
+
+    :return:
+    """
+    self.remaining = [self.game_time, self.game_time]
+
+  def time_left(self, player_i: int) -> Optional[float]:
+    """
+    How long a player has for their next move.
+
+    :param player_i: which player (0 for the player who went first)
+    :return: the time (in seconds), or None if there is no limit
+    """
+    budgets = [budget for budget in (self.move_time, self.remaining[player_i]) if budget is not None]
+    return min(budgets) if budgets else None
+
+  def start_move(self) -> None:
+    """
+    Start timing a move.
+
+    :return:
+    """
+    self._move_start = time.monotonic()
+
+  def stop_move(self, player_i: int, name: str) -> bool:
+    """
+    Stop timing a move, record how long it took, and charge it to the player.
+
+    :param player_i: which player moved (0 for the player who went first)
+    :param name: the name of the player, for the latency record
+    :return: whether the player went over their time
+    """
+    elapsed = time.monotonic() - self._move_start
+    self.latencies.append((name, elapsed))
+    time_left = self.time_left(player_i)
+    if self.remaining[player_i] is not None:
+      self.remaining[player_i] += self.increment - elapsed
+    return time_left is not None and elapsed > time_left
+
+  def summary(self) -> dict[str, dict[str, float]]:
+    """
+    Summarise the recorded latencies of each player.
+
+    :return: for each player name, their number of moves, and mean and maximum latency (in seconds)
+    """
+    by_player = {}
+    for name, elapsed in self.latencies:
+      by_player.setdefault(name, []).append(elapsed)
+    return {name: {'moves': len(times), 'mean': sum(times) / len(times), 'max': max(times)}
+            for name, times in by_player.items()}
@@ -1,32 +1,40 @@
 # (c) Nikolaus Howe 2021
 from tqdm import trange
-from typing import Optional
+from typing import Optional, Union
 
 from matchsticks.arena import Arena
-from matchsticks.game import Game
+from matchsticks.game import Game, game_from_position
+from matchsticks.game_record import GameRecordWriter
 from matchsticks.player import MCPlayer, Player
+from matchsticks.trajectories import TrajectoryWriter
 
 
 class Dojo(object):
   def __init__(self,
                p1: Optional[Player] = None,
-               p2: Optional[Player] = None) -> None:
+               p2: Optional[Player] = None,
+               player_class: type[MCPlayer] = MCPlayer,
+               recorder: Optional[Union[TrajectoryWriter, GameRecordWriter]] = None) -> None:
     """
     A dojo for automated player training.
 
     :param p1: the first player (if any)
     :param p2: the second player (if any)
+    :param player_class: the kind of learning player to create when a player isn't given
+                         (MCPlayer or AfterstateValuePlayer)
+    :param recorder: if given, the training games are recorded with it
     """
     if not p1:
-      p1 = MCPlayer()
+      p1 = player_class()
     if not p2:
-      p2 = MCPlayer()
+      p2 = player_class()
 
     if not isinstance(p1, MCPlayer) and not isinstance(p2, MCPlayer):
       raise Exception('Neither of these players can be trained!')
 
     self.p1 = p1
     self.p2 = p2
+    self.recorder = recorder
 
   def _train_loop(self, g1: Game, num_games: int) -> None:
     """
@@ -46,7 +54,7 @@ class Dojo(object):
       else:
         p1 = self.p2
         p2 = self.p1
-      a1 = Arena(g1, p1, p2, silent=True)
+      a1 = Arena(g1, p1, p2, silent=True, recorder=self.recorder)
       a1.play()
       p1.update_and_end_episode()
       p2.update_and_end_episode()
@@ -75,8 +83,7 @@ class Dojo(object):
     """
     # Make a game that's big enough to store all possible states
     # which come from this position
-    g1 = Game(int((max(position)+2) // 2))
-    g1.reset(position)
+    g1 = game_from_position(position)
     self._train_loop(g1, num_games)
 
   def get_player(self, second=False) -> Player:
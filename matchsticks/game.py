@@ -1,10 +1,59 @@
 # (c) Nikolaus Howe 2021
-from typing import Optional, Union
+import random
+
+from bisect import bisect_left, insort
+from typing import Iterable, Optional, Union
 
 from matchsticks.game_types import Move
 from matchsticks.utils import generate_allowed
 
 
+# The largest rows and the most rows a position can have (in a game with 8 layers)
+MAX_ROW_LENGTH = 15
+MAX_ROWS = 64
+
+# Random keys for hashing positions: ZOBRIST_KEYS[n][k] stands for "there are at least k rows of length n".
+# A position's hash is the XOR of the keys for all of its rows, so it doesn't depend on the order of the rows,
+# and it can be updated in constant time as rows are removed and added
+_zobrist_rng = random.Random(2021)
+ZOBRIST_KEYS = [[0] + [_zobrist_rng.getrandbits(64) for _ in range(MAX_ROWS)] for _ in range(MAX_ROW_LENGTH + 1)]
+
+# Set to True to check every incrementally-updated hash against the position it came from,
+# and against every other position seen with the same hash (slow, so only for debugging)
+CHECK_HASHES = False
+_positions_by_hash = {}
+
+
+def state_hash(state: Iterable[int]) -> int:
+  """
+  Calculate the 64-bit hash of a position from scratch (Game.get_hash keeps it up to date instead).
+
+  :param state: the lengths of the rows
+  :return: the hash
+  """
+  counts = [0] * (MAX_ROW_LENGTH + 1)
+  h = 0
+  for layer_n in state:
+    counts[layer_n] += 1
+    h ^= ZOBRIST_KEYS[layer_n][counts[layer_n]]
+  return h
+
+
+def check_hash(h: int, state: tuple[int, ...]) -> None:
+  """
+  Check that a hash is correct for a position, and that no other position seen so far has the same hash.
+
+  :param h: the hash
+  :param state: the (sorted) position
+  :return:
+  """
+  if h != state_hash(state):
+    raise Exception(f"The hash of {state} is {h}, but it should be {state_hash(state)}")
+  other_state = _positions_by_hash.setdefault(h, state)
+  if other_state != state:
+    raise Exception(f"Hash collision: {state} and {other_state} both have the hash {h}")
+
+
 class Game(object):
   def __init__(self, num_layers: int = 4) -> None:
     """
@@ -23,6 +72,7 @@ class Game(object):
 
     # Create the starting layers
     self._state = list(map(lambda x: int(x * 2 + 1), range(num_layers)))
+    self._recalculate()
 
     # Generate allowed moves reference (to be used by get_allowed)
     self._allowed_reference = generate_allowed(num_layers * 2 - 1)
@@ -56,6 +106,47 @@ class Game(object):
     """
     return tuple(self._state)
 
+  def get_largest_row(self) -> int:
+    """
+    Getter method for the length of the largest row.
+
+    :return: the length of the largest row (0 if the game is over)
+    """
+    return self._state[-1] if self._state else 0
+
+  def get_hash(self) -> int:
+    """
+    Getter method for the hash of the game state, which is the same for equal states
+    (however they were reached), and is kept up to date as moves are played.
+
+    :return: 64-bit hash of the game state
+    """
+    return self._hash
+
+  def get_nim_sum(self) -> int:
+    """
+    Getter method for the nim sum of the game state, which is kept up to date as moves are played.
+
+    :return: the nim sum of the current position
+    """
+    return self._nim_sum
+
+  def _recalculate(self) -> None:
+    """
+    Calculate the hash and nim sum of the game state from scratch, and forget the moves played so far.
+
+    :return:
+    """
+    self._counts = [0] * (MAX_ROW_LENGTH + 1)
+    self._nim_sum = 0
+    for layer_n in self._state:
+      self._counts[layer_n] += 1
+      self._nim_sum ^= layer_n
+    self._hash = state_hash(self._state)
+    self._undo_stack = []  # (removed row, left fragment, right fragment) for each move played
+    if CHECK_HASHES:
+      check_hash(self._hash, self.get_state())
+
   def is_allowed(self, move: Move) -> bool:
     """
     Check if a given move is valid.
@@ -83,28 +174,82 @@ class Game(object):
                   - high_idx is the index of the highest matchstick to cross off (1-indexed.
     :return: whether or not the game is still going
     """
+    return self.push(move)
+
+  def push(self, move: Move) -> bool:
+    """
+    Play a move in place, so that it can be taken back again with pop.
+    The rows stay sorted, and the hash and nim sum are kept up to date.
+
+    :param move: the move, in the same format as for play_move
+    :return: whether or not the game is still going
+    """
     if not self.is_allowed(move):
       raise Exception(f"The move ({move}) is not a valid move.")
 
     layer_i, low_idx, high_idx = move
 
-    # Make the layer 0-indexed
-    layer_i -= 1
-
     # Perform move  # TODO: make this use the same code as imagine_move (no code duplication ideally)
-    active_layer = self._state.pop(layer_i)
+    active_layer = self._state.pop(layer_i - 1)
+    self._remove_row(active_layer)
     left_result = low_idx - 1
     right_result = active_layer - high_idx
     if left_result > 0:
-      self._state.append(left_result)
+      insort(self._state, left_result)
+      self._add_row(left_result)
     if right_result > 0:
-      self._state.append(right_result)
-    self._state.sort()
+      insort(self._state, right_result)
+      self._add_row(right_result)
+    self._nim_sum ^= active_layer ^ left_result ^ right_result
+    self._undo_stack.append((active_layer, left_result, right_result))
+    if CHECK_HASHES:
+      check_hash(self._hash, self.get_state())
 
     # Return False if the game is over,
     # and True if the game is still going
     return self.is_still_on()
 
+  def pop(self) -> Move:
+    """
+    Take back the last move played, exactly undoing it.
+
+    :return: the move which was taken back (on the lowest-numbered of any equal rows)
+    """
+    if not self._undo_stack:
+      raise Exception("There are no moves to take back.")
+
+    active_layer, left_result, right_result = self._undo_stack.pop()
+    if right_result > 0:
+      del self._state[bisect_left(self._state, right_result)]
+      self._remove_row(right_result)
+    if left_result > 0:
+      del self._state[bisect_left(self._state, left_result)]
+      self._remove_row(left_result)
+    layer_i = bisect_left(self._state, active_layer)
+    self._state.insert(layer_i, active_layer)
+    self._add_row(active_layer)
+    self._nim_sum ^= active_layer ^ left_result ^ right_result
+    if CHECK_HASHES:
+      check_hash(self._hash, self.get_state())
+
+    return layer_i + 1, left_result + 1, active_layer - right_result
+
+  def get_num_moves_played(self) -> int:
+    """
+    How many moves have been played since the game was (re)started, which is how many can be taken back.
+
+    :return: the number of moves
+    """
+    return len(self._undo_stack)
+
+  def _add_row(self, layer_n: int) -> None:
+    self._counts[layer_n] += 1
+    self._hash ^= ZOBRIST_KEYS[layer_n][self._counts[layer_n]]
+
+  def _remove_row(self, layer_n: int) -> None:
+    self._hash ^= ZOBRIST_KEYS[layer_n][self._counts[layer_n]]
+    self._counts[layer_n] -= 1
+
   def reset(self, position: Optional[Union[list[int], tuple[int]]] = None) -> None:
     """
     Reset the game to the original configuration.
@@ -112,10 +257,11 @@ class Game(object):
     :return:
     """
     if position:
-      self._state = list(position)
+      self._state = sorted(position)
     else:
       self._state = list(map(lambda x: int(x * 2 + 1),
                              range(self._num_layers)))
+    self._recalculate()
 
   def end(self) -> None:  # TODO: make this work with clicking on the 'x'
     """
@@ -124,3 +270,22 @@ class Game(object):
     :return:
     """
     self._state = None
+    self._hash = None
+    self._undo_stack = []
+
+
+def game_from_position(position: Union[list[int], tuple[int, ...]]) -> Game:
+  """
+  Make a game which starts from a given position, big enough to allow all the moves from there.
+
+  :param position: the lengths of the rows
+  :return: the game
+  """
+  if not position or any(not isinstance(n, int) or n < 1 for n in position):
+    raise ValueError(f"{position} isn't a valid position (it should be a non-empty list of positive row lengths)")
+  if max(position) > MAX_ROW_LENGTH or len(position) > MAX_ROWS:
+    raise ValueError(f"{position} is too big (it can have at most {MAX_ROWS} rows, "
+                     f"each at most {MAX_ROW_LENGTH} sticks long)")
+  game = Game(int((max(position) + 2) // 2))
+  game.reset(sorted(position))
+  return game
@@ -0,0 +1,141 @@
+# (c) Nikolaus Howe 2021
+import json
+import PySimpleGUI as sg
+import queue
+
+from abc import ABC, abstractmethod
+from overrides import overrides
+from typing import Any, Iterable, Optional
+
+from matchsticks.game_types import Point
+
+
+Event = tuple[Any, Optional[dict]]
+
+
+class EventSource(ABC):
+  """
+  An abstract class for the things a GameWindow gets its events (mouse drags, button clicks,
+  and the moves posted by computer players) from. A PySimpleGUI window is already one of these.
+  """
+
+  @abstractmethod
+  def read(self, timeout: Optional[int] = None) -> Event:
+    """
+    Wait for the next event.
+
+    :param timeout: the longest to wait (in milliseconds) before returning sg.TIMEOUT_KEY (no limit if None)
+    :return: the event, and its values
+    """
+    pass
+
+  @abstractmethod
+  def write_event_value(self, key: Any, value: Any) -> None:
+    """
+    Post an event (which may be done from another thread).
+
+    :param key: the event
+    :param value: its value
+    :return:
+    """
+    pass
+
+
+class ReplayEventSource(EventSource):
+  @overrides
+  def __init__(self, events: Iterable[Event] = (), exhausted_wait: float = 5.) -> None:
+    """
+    Plays back a stream of events (recorded with RecordingEventSource, made with drag_events,
+    or generated as they're needed), so that a GameWindow can be driven without anyone at the mouse.
+    Events posted with write_event_value are returned once the stream has run out. After that,
+    the window is reported as closed, so that whatever was waiting for input stops.
+
+    :param events: the stream of events
+    :param exhausted_wait: how long (in seconds) to wait for posted events once the stream has run out
+    """
+    self.events = iter(events)
+    self.posted = queue.Queue()
+    self.exhausted_wait = exhausted_wait
+
+  @overrides
+  def read(self, timeout: Optional[int] = None) -> Event:
+    event = next(self.events, None)
+    if event is not None:
+      return event
+    try:
+      return self.posted.get(timeout=self.exhausted_wait if timeout is None else timeout / 1000)
+    except queue.Empty:
+      return (sg.WIN_CLOSED, None) if timeout is None else (sg.TIMEOUT_KEY, {})
+
+  @overrides
+  def write_event_value(self, key: Any, value: Any) -> None:
+    self.posted.put((key, {key: value}))
+
+
+class RecordingEventSource(EventSource):
+  @overrides
+  def __init__(self, source: EventSource) -> None:
+    """
+    Passes on the events from another source (such as a window), and records them
+    so that they can be saved and replayed later.
+
+    :param source: where the events come from
+    """
+    self.source = source
+    self.events = []
+
+  @overrides
+  def read(self, timeout: Optional[int] = None) -> Event:
+    event = self.source.read(timeout)
+    if event[0] != sg.TIMEOUT_KEY:
+      self.events.append(event)
+    return event
+
+  @overrides
+  def write_event_value(self, key: Any, value: Any) -> None:
+    self.source.write_event_value(key, value)
+
+  def save(self, filename: str) -> None:
+    """
+    Save the recorded mouse and button events as JSON lines (posted events, such as
+    computer moves, aren't saved, since they'll be posted again when the game is replayed).
+
+    :param filename: where to save them
+    :return:
+    """
+    with open(filename, 'w') as f:
+      for event, values in self.events:
+        if isinstance(event, str) and not event.startswith('-'):
+          f.write(json.dumps([event, values]) + '\n')
+
+
+def load_events(filename: str) -> list[Event]:
+  """
+  Load events saved by RecordingEventSource.save.
+
+  :param filename: the saved events
+  :return: the events
+  """
+  events = []
+  with open(filename) as f:
+    for line in f:
+      event, values = json.loads(line)
+      if values and 'graph' in values:
+        values['graph'] = tuple(values['graph'])
+      events.append((event, values))
+  return events
+
+
+def drag_events(start: Point, end: Point, steps: int = 4) -> list[Event]:
+  """
+  Make the events of dragging the mouse across the graph in a straight line.
+
+  :param start: where the drag starts
+  :param end: where it ends
+  :param steps: how many mouse movement events there are after the first click
+  :return: the events
+  """
+  (x1, y1), (x2, y2) = start, end
+  events = [('graph', {'graph': (x1 + (x2 - x1) * i / steps, y1 + (y2 - y1) * i / steps)}) for i in range(steps + 1)]
+  events.append(('graph+UP', {'graph': end}))
+  return events
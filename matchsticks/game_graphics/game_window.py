@@ -1,40 +1,66 @@
 # (c) Nikolaus Howe 2021
+from __future__ import annotations
+
 import PySimpleGUI as sg
+import threading
+import time
+
+import typing
+if typing.TYPE_CHECKING:
+  from matchsticks.game_record import GameRecord
+  from matchsticks.player import Player
+
+from typing import Optional
 
 from matchsticks.game import Game
+from matchsticks.game_graphics.events import EventSource
 from matchsticks.game_graphics.matchstick import Matchstick
 from matchsticks.game_graphics.pyramid import Pyramid
-from matchsticks.game_graphics.row import Row
+from matchsticks.game_graphics.surface import GraphSurface, Surface
 from matchsticks.game_types import Move
 from matchsticks.utils import BackButtonException, ClosedWindowException, shorten_line
 
 
+COMPUTER_MOVE_EVENT = '-computer-move-'
+
+
 class GameWindow(object):
   def __init__(self,
                game: Game,
-               window: sg.Window,
+               window: Optional[sg.Window] = None,
                v_spacing: int = 40,
                h_spacing: int = 25,
                stick_length: int = 30,
-               stick_width: int = 3) -> None:
+               stick_width: int = 3,
+               surface: Optional[Surface] = None,
+               events: Optional[EventSource] = None) -> None:
     """
     A window in which a game of matchsticks can be drawn and played.
 
     :param game: the game to be drawn and played
+    :param window: the window, which the moves of the players come from (not needed just for drawing)
     :param v_spacing: vertical space between rows of matchsticks
     :param h_spacing: horizontal space between matchsticks in the same row
     :param stick_length: how long to draw matchsticks
     :param stick_width: how wide to draw matchsticks
+    :param surface: what to draw on (the window's graph if not given, or a RecordingSurface to draw without a display)
+    :param events: where the moves of the players come from (the window if not given, or a ReplayEventSource to
+                   replay a recorded or generated stream of mouse events)
     """
     self.game = game
     self.window = window
-    self.width, self.height = window['graph'].CanvasSize
+    self.events = events if events is not None else window
+    if surface is None:
+      surface = GraphSurface(window['graph'], window)
+    self.surface = surface
+    self.width, self.height = surface.size
     self.center = (self.width/2, self.height/2)  # Because we set the coordinates to be a unit square
     self.v_spacing = v_spacing
     self.h_spacing = h_spacing
     self.stick_length = stick_length
     self.stick_width = stick_width
     self.pyramid = self.make_pyramid()
+    self.crossing_lines = []  # ids of the lines drawn through crossed-off sticks
     self.gave_warning = False  # Only print the helper message once
 
   def game_over(self, human_won: bool) -> None:
@@ -62,15 +88,7 @@ class GameWindow(object):
 
     :return:
     """
-    state = self.game.get_state()
-    pyramid_list = []
-    for i, sticks_in_layer in enumerate(state):
-      row_list = []
-      for idx in range(sticks_in_layer):
-        row_list.append(Matchstick(i+1, idx+1, self))
-      row = Row(row_list, self)
-      pyramid_list.append(row)
-    return Pyramid(pyramid_list, self)
+    return Pyramid(self.game.get_state(), self)
 
   def draw_move(self, move: Move) -> None:
     """
@@ -92,16 +110,16 @@ class GameWindow(object):
 
     crossing_line = ((left_stick.h_pos - self.h_spacing/4, left_stick.v_pos),
                      (right_stick.h_pos + self.h_spacing/4, right_stick.v_pos))
-    self.window['graph'].draw_line(*crossing_line, color='red', width=2)
+    self.crossing_lines.append(self.surface.draw_line(*crossing_line, color='red', width=2))
 
-    # Make the crossed off sticks red and remove them from the game
+    # Make the crossed off sticks red (in place) and remove them from the game
     for stick_idx in range(low_idx, high_idx + 1):
       stick = self.pyramid.rows[layer].matchsticks[stick_idx]
       stick.set_inactive()
-      stick.draw(stick.v_pos, stick.h_pos)
+      stick.draw()
 
-    # Update the window immediately afterwards
-    self.window.refresh()
+    # Update the window once, after all the changes for this move
+    self.surface.refresh()
 
   def get_human_move(self) -> list[Matchstick]:
     """
@@ -111,11 +129,11 @@ class GameWindow(object):
 
     :return: line segment start point, line segment end point, list of sticks with which the segment intersects
     """
-    graph = self.window['graph']
+    surface = self.surface
     dragging = False
     start_point = end_point = current_line = None
     while True:
-      event, values = self.window.read()
+      event, values = self.events.read()
       # print("the event was", event, values)
       if event == "graph":
         x, y = values["graph"]
@@ -125,9 +143,9 @@ class GameWindow(object):
         else:
           end_point = (x, y)
         if current_line:
-          graph.delete_figure(current_line)
+          surface.delete_figure(current_line)
         if None not in (start_point, end_point):
-          current_line = graph.draw_line(start_point, end_point, color='red', width=2)
+          current_line = surface.draw_line(start_point, end_point, color='red', width=2)
       elif event == "graph+UP":
         # Check the intersections. If they are good, play the move.
         # Otherwise, fall through and keep trying to get a move.
@@ -139,14 +157,15 @@ class GameWindow(object):
         if intersections and all([s.is_active for s in intersections]):
           # Shorten the line to make it more visually pleasing
           start_point, end_point = shorten_line((start_point, end_point), intersections, self)
-          graph.delete_figure(current_line)
-          current_line = graph.draw_line(start_point, end_point, color='red', width=2)
+          surface.delete_figure(current_line)
+          current_line = surface.draw_line(start_point, end_point, color='red', width=2)
+          self.crossing_lines.append(current_line)
 
           # Return the intersections of this line
           return intersections
         else:
-          graph.delete_figure(current_line)
-          start_point, end_point = None, None
+          surface.delete_figure(current_line)
+          start_point, end_point, current_line = None, None, None
           dragging = False
           if not self.gave_warning:
             print("Please draw a line which satisfies the following:\n"
@@ -155,9 +174,68 @@ class GameWindow(object):
                   "- doesn't cross any already crossed-off matches")
             self.gave_warning = True
       elif event == 'back':
+        print("clicked back button, going back")
+        if current_line:
+          surface.delete_figure(current_line)
+        raise BackButtonException
+      elif event == sg.WIN_CLOSED or event == 'Exit':
+        print("clicked on the x, closing the window")
+        raise ClosedWindowException
+
+  def get_computer_move(self, player: Player, min_delay: float = 0.5) -> Move:
+    """
+    Get a move from a computer player. The move is computed in a worker thread, which posts
+    it back to the window as an event, so that the window stays responsive however long the
+    player takes. The move is shown no sooner than min_delay seconds after the turn started,
+    so that fast players don't move instantly. If the user quits while the player is still
+    thinking, the player's move is thrown away when it arrives. Each move is posted with a token
+    for the turn it was computed in, so a move which was already on its way when the user quit
+    is thrown away too, rather than being taken for the move of a later turn.
+
+    :param player: the computer player
+    :param min_delay: the minimum time (in seconds) before the move is returned
+    :return: the move
+    """
+    cancelled = threading.Event()
+    turn = object()
+
+    def compute_move() -> None:
+      try:
+        move = player.move(self.game)
+      except Exception as e:  # Hand the error over to the GUI thread
+        move = e
+      if not cancelled.is_set():
+        self.events.write_event_value(COMPUTER_MOVE_EVENT, (turn, move))
+
+    start_time = time.monotonic()
+    threading.Thread(target=compute_move, daemon=True).start()
+
+    have_move = False
+    move = None
+    while True:
+      # Wait for any event until the move arrives, and after that only until the delay is over
+      if have_move:
+        time_left = min_delay - (time.monotonic() - start_time)
+        if time_left <= 0:
+          return move
+        event, values = self.events.read(timeout=int(time_left * 1000))
+      else:
+        event, values = self.events.read()
+
+      if event == COMPUTER_MOVE_EVENT:
+        move_turn, posted_move = values[COMPUTER_MOVE_EVENT]
+        if move_turn is not turn:  # A move from a turn which was abandoned
+          continue
+        if isinstance(posted_move, Exception):
+          raise posted_move
+        move = posted_move
+        have_move = True
+      elif event == 'back':
+        cancelled.set()
         print("clicked back button, going back")
         raise BackButtonException
       elif event == sg.WIN_CLOSED or event == 'Exit':
+        cancelled.set()
         print("clicked on the x, closing the window")
         raise ClosedWindowException
 
@@ -179,7 +257,7 @@ class GameWindow(object):
       stick.draw()
 
     # Update the window for faster animation
-    self.window.refresh()
+    self.surface.refresh()
 
     # Send the move to the game
     row = intersections[0].layer
@@ -189,9 +267,81 @@ class GameWindow(object):
     # print("move was", move)
     return move
 
+  def wait(self, seconds: float) -> None:
+    """
+    Wait for a while, keeping the window responsive (if there is one).
+
+    :param seconds: how long to wait
+    :return:
+    """
+    if self.events is None:
+      time.sleep(seconds)
+      return
+    end_time = time.monotonic() + seconds
+    while True:
+      time_left = end_time - time.monotonic()
+      if time_left <= 0:
+        return
+      event, values = self.events.read(timeout=int(time_left * 1000))
+      if event == 'back':
+        print("clicked back button, going back")
+        raise BackButtonException
+      elif event == sg.WIN_CLOSED or event == 'Exit':
+        print("clicked on the x, closing the window")
+        raise ClosedWindowException
+
+  def replay(self, record: GameRecord, move_delay: float = 0.5) -> None:
+    """
+    Animate a recorded game, starting again from its position and drawing its moves one at a time.
+
+    :param record: the record of the game
+    :param move_delay: how long (in seconds) to wait before each move
+    :return:
+    """
+    self.clear()
+    self.game.reset(record.position)
+    self.pyramid = self.make_pyramid()
+    self.draw()
+    self.surface.refresh()
+    for move in record.moves:
+      self.wait(move_delay)
+      self.draw_move(move)
+      self.game.play_move(move)
+      self.pyramid.adjust(move)
+
+  def recolour_figure(self, figure: int, colour: str) -> None:
+    """
+    Change the colour of a line which has already been drawn, without adding anything to the canvas.
+
+    :param figure: the id of the drawn line
+    :param colour: the new colour
+    :return:
+    """
+    self.surface.recolour_figure(figure, colour)
+
   def draw(self) -> None:
+    """
+    Draw the pyramid (sticks which are already on the canvas are updated in place).
+
+    :return:
+    """
     self.pyramid.draw()
 
+  def clear(self) -> None:
+    """
+    Remove everything this game window has drawn from the canvas.
+
+    :return:
+    """
+    surface = self.surface
+    for figure in self.crossing_lines:
+      surface.delete_figure(figure)
+    self.crossing_lines = []
+    for stick in self.pyramid.sticks:
+      if stick.figure is not None:
+        surface.delete_figure(stick.figure)
+        stick.figure = None
+
 
 # if __name__ == '__main__':
 #   layout = [
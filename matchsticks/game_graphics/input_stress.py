@@ -0,0 +1,124 @@
+# (c) Nikolaus Howe 2021
+import argparse
+import contextlib
+import json
+import os
+import random
+import time
+
+from typing import Iterator, Optional
+
+from matchsticks.game import Game
+from matchsticks.game_graphics.events import Event, ReplayEventSource, drag_events
+from matchsticks.game_graphics.game_window import GameWindow
+from matchsticks.game_graphics.surface import RecordingSurface
+from matchsticks.server import LatencyHistogram
+from matchsticks.utils import ClosedWindowException
+
+
+def random_stroke(gw: GameWindow, rng: random.Random, steps: int = 4) -> list[Event]:
+  """
+  Make the events of a random mouse stroke across a drawn game window. Most strokes go roughly
+  along a row, through a random stick, and reach a random number of sticks either side of it
+  (so some are moves, and some cross sticks which were already crossed off, or reach into another row).
+  The rest go anywhere in the window (so most miss every stick).
+
+  :param gw: the game window (which must have been drawn)
+  :param rng: the random number generator
+  :param steps: how many mouse movement events there are after the first click
+  :return: the events
+  """
+  if rng.random() < 0.1:
+    return drag_events((rng.uniform(0, gw.width), rng.uniform(0, gw.height)),
+                       (rng.uniform(0, gw.width), rng.uniform(0, gw.height)), steps)
+  stick = rng.choice(gw.pyramid.sticks)
+  v_pos = stick.v_pos + rng.uniform(-0.4, 0.4) * gw.stick_length
+  start = (stick.h_pos - rng.uniform(0.1, 3) * gw.h_spacing, v_pos + rng.uniform(-0.2, 0.2) * gw.stick_length)
+  end = (stick.h_pos + rng.uniform(0.1, 3) * gw.h_spacing, v_pos + rng.uniform(-0.2, 0.2) * gw.stick_length)
+  if rng.random() < 0.5:
+    start, end = end, start
+  return drag_events(start, end, steps)
+
+
+def run_stress(num_strokes: int = 10_000, num_layers: int = 6, steps: int = 4, seed: int = 0) -> dict:
+  """
+  Fire random mouse strokes (see random_stroke) into GameWindow.get_human_move, drawing on a
+  RecordingSurface, and measure how long the window takes to deal with them. The strokes which
+  are moves are played, and a new game is started whenever one finishes.
+
+  The drag latency is how long it takes to redraw the line being dragged after the mouse moves,
+  and the stroke latency is how long it takes after the mouse is let go to check which sticks the
+  line crosses, and either throw the line away, or play the move (redrawing the crossed-off sticks
+  and adjusting the pyramid).
+
+  :param num_strokes: how many strokes to fire
+  :param num_layers: how many layers the games start with
+  :param steps: how many mouse movement events there are in each stroke after the first click
+  :param seed: the seed for the random strokes
+  :return: the number of strokes, moves and games, the rate of strokes, and the latencies
+  """
+  rng = random.Random(seed)
+  drag_latency = LatencyHistogram()
+  stroke_latency = LatencyHistogram()
+  gw = None
+
+  def strokes() -> Iterator[Event]:
+    for _ in range(num_strokes):
+      for event in random_stroke(gw, rng, steps):
+        start_time = time.perf_counter()
+        yield event  # The window handles the event before asking for the next one
+        latency = stroke_latency if event[0] == 'graph+UP' else drag_latency
+        latency.record(time.perf_counter() - start_time)
+
+  events = ReplayEventSource(strokes(), exhausted_wait=0)
+  num_moves = 0
+  num_games = 0
+  start_time = time.perf_counter()
+  with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):  # The window prints every stroke
+    try:
+      while True:
+        game = Game(num_layers)
+        gw = GameWindow(game, surface=RecordingSurface(), events=events)
+        gw.draw()
+        num_games += 1
+        game_on = True
+        while game_on:
+          move = gw.get_and_play_human_move()
+          game_on = game.play_move(move)
+          gw.pyramid.adjust(move)
+          num_moves += 1
+    except ClosedWindowException:  # We've run out of strokes
+      pass
+  seconds = time.perf_counter() - start_time
+
+  return {
+    'strokes': num_strokes,
+    'moves': num_moves,
+    'games': num_games,
+    'seconds': seconds,
+    'strokes_per_second': num_strokes / seconds if seconds else 0.,
+    'drag_latency': drag_latency.summary(),
+    'stroke_latency': stroke_latency.summary(),
+  }
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+  """
+  Run the stress test from the command line.
+
+  :param argv: the command line arguments (without the program name)
+  :return:
+  """
+  parser = argparse.ArgumentParser(prog='matchsticks stress',
+                                   description='Measure how fast the game window deals with random mouse strokes.')
+  parser.add_argument('--strokes', type=int, default=10_000, help='how many strokes to fire')
+  parser.add_argument('--layers', type=int, default=6, help='how many layers the games start with')
+  parser.add_argument('--steps', type=int, default=4, help='how many mouse movement events each stroke has')
+  parser.add_argument('--seed', type=int, default=0, help='the seed for the random strokes')
+  args = parser.parse_args(argv)
+
+  print(json.dumps(run_stress(args.strokes, args.layers, args.steps, args.seed), indent=2))
+
+
+if __name__ == '__main__':
+  main()
@@ -1,48 +1,29 @@
 # (c) Nikolaus Howe 2021
 import PySimpleGUI as sg
 
-from typing import Optional
-
 from matchsticks.arena import VisualArena
 from matchsticks.game import Game
 from matchsticks.game_graphics.game_window import GameWindow
-from matchsticks.player import PerfectPlayer, PretrainedPlayer, RandomPlayer, VisualHumanPlayer
+from matchsticks.game_graphics.opponent_pool import OpponentPool
+from matchsticks.player import VisualHumanPlayer
 from matchsticks.utils import BackButtonException, ClosedWindowException
 
 
-def make_intro_window(last_settings: Optional[dict] = None):
-  if last_settings is None:
-    intro_layout = [[sg.Text("How big a game (# rows) would you like to play?", font=("Helvetica", 22)),
-                     sg.Slider(key='num_layers', range=(3, 6), default_value=4, orientation='h',
-                               font=('Helvetica', 16), size=(14, 22))],
-                    [sg.Text("Who plays first?", font=('Helvetica', 22)),
-                     sg.Radio(key='human_first', text='Human', group_id="RADIO1", default=True, font=('Helvetica', 16)),
-                     sg.Radio(text='Computer', group_id="RADIO1", default=False, font=('Helvetica', 16))],
-                    [sg.Text("How hard an opponent would you like to play against?", font=('Helvetica', 22)),
-                     sg.InputCombo(key='computer_player',
-                                   values=('Plays randomly', 'Easy', 'Medium', 'Hard', 'Perfect'),
-                                   default_value='Easy',
-                                   font=('Helvetica', 16), size=(14, 22))],
-                    # [sg.Text(f'Your win count against this difficulty: {5}', font=('Helvetica', 16),
-                    #          justification='right')],  # NOTE: this hasn't been set up yet
-                    [sg.Button('Start game!', font=('Helvetica', 22))]]
-  else:
-    intro_layout = [[sg.Text("How big a game (# rows) would you like to play?", font=("Helvetica", 22)),
-                     sg.Slider(key='num_layers', range=(3, 6), default_value=last_settings['num_layers'],
-                               orientation='h', font=('Helvetica', 16), size=(14, 22))],
-                    [sg.Text("Who plays first?", font=('Helvetica', 22)),
-                     sg.Radio(key='human_first', text='Human', group_id="RADIO1", default=last_settings['human_first'],
-                              font=('Helvetica', 16)),
-                     sg.Radio(text='Computer', group_id="RADIO1", default=(not last_settings['human_first']),
-                              font=('Helvetica', 16))],
-                    [sg.Text("How hard an opponent would you like to play against?", font=('Helvetica', 22)),
-                     sg.InputCombo(key='computer_player',
-                                   values=('Plays randomly', 'Easy', 'Medium', 'Hard', 'Perfect'),
-                                   default_value=last_settings['computer_player'],
-                                   font=('Helvetica', 16), size=(14, 22))],
-                    # [sg.Text(f'Your win count against this difficulty: {5}', font=('Helvetica', 16),
-                    #          justification='right')],  # NOTE: this hasn't been set up yet
-                    [sg.Button('Start game!', font=('Helvetica', 22))]]
+def make_intro_window():
+  intro_layout = [[sg.Text("How big a game (# rows) would you like to play?", font=("Helvetica", 22)),
+                   sg.Slider(key='num_layers', range=(3, 6), default_value=4, orientation='h',
+                             font=('Helvetica', 16), size=(14, 22))],
+                  [sg.Text("Who plays first?", font=('Helvetica', 22)),
+                   sg.Radio(key='human_first', text='Human', group_id="RADIO1", default=True, font=('Helvetica', 16)),
+                   sg.Radio(text='Computer', group_id="RADIO1", default=False, font=('Helvetica', 16))],
+                  [sg.Text("How hard an opponent would you like to play against?", font=('Helvetica', 22)),
+                   sg.InputCombo(key='computer_player',
+                                 values=('Plays randomly', 'Easy', 'Medium', 'Hard', 'Perfect'),
+                                 default_value='Easy',
+                                 font=('Helvetica', 16), size=(14, 22))],
+                  # [sg.Text(f'Your win count against this difficulty: {5}', font=('Helvetica', 16),
+                  #          justification='right')],  # NOTE: this hasn't been set up yet
+                  [sg.Button('Start game!', font=('Helvetica', 22))]]
 
   return sg.Window('Game Setup', intro_layout, finalize=True)
 
@@ -70,62 +51,53 @@ class MainWindow(object):
 
     """
     self.gw = None
-    self.last_settings = None
-    self.intro_window = None
-    self.playing_window = None
+
+    # Make each opponent once, in the background while the user picks their settings
+    self.opponents = OpponentPool()
+    self.opponents.preload(background=True)
+
+    # The windows are made once, and hidden when they aren't in use
+    self.intro_window = make_intro_window()
+    self.playing_window = make_playing_window()
+    self.playing_window.hide()
     self.run_intro()
 
   def run_intro(self) -> None:
     """
     Display the intro window, and record the user's inputs to set up a game.
+    Keep going back to the intro window after each game, until the user closes it.
 
     :return:
     """
-    self.intro_window = make_intro_window(last_settings=self.last_settings)
-    self.playing_window = make_playing_window()
-    self.playing_window.hide()
+    while True:
+      self.intro_window.un_hide()
+      event, values = self.intro_window.read()
+      print("event", event, values)
 
-    event, values = self.intro_window.read()
-    print("event", event, values)
+      if event == sg.WIN_CLOSED or event == 'Exit':
+        print("closing the window!")
+        self.intro_window.close()
+        self.playing_window.close()
+        return
 
-    if event == sg.WIN_CLOSED or event == 'Exit':
-      print("closing the window!")
-      self.intro_window.close()
-      return
-
-    # Save the settings so that they are the default for next time
-    self.last_settings = values
-
-    g1 = Game(int(values['num_layers']))
-    self.gw = GameWindow(game=g1, window=self.playing_window)
-
-    human_player = VisualHumanPlayer(self.gw, "human")
+      # The intro window is reused, so it keeps showing these settings for next time
+      g1 = Game(int(values['num_layers']))
+      self.gw = GameWindow(game=g1, window=self.playing_window)
 
-    computer_player_type = values['computer_player']
-    if computer_player_type == 'Plays randomly':
-      computer_player = RandomPlayer()
-    elif computer_player_type == "Easy":
-      computer_player = PretrainedPlayer("matchsticks/trained_agents/easy.player")
-    elif computer_player_type == "Medium":
-      computer_player = PretrainedPlayer("matchsticks/trained_agents/medium.player")
-    elif computer_player_type == "Hard":
-      computer_player = PretrainedPlayer("matchsticks/trained_agents/hard.player")
-    elif computer_player_type == 'Perfect':
-      computer_player = PerfectPlayer()
-    else:
-      raise ValueError("that kind of player isn't ready yet")
+      human_player = VisualHumanPlayer(self.gw, "human")
+      computer_player = self.opponents.get(values['computer_player'])
 
-    if values['human_first']:
-      p1 = human_player
-      p2 = computer_player
-    else:
-      p1 = computer_player
-      p2 = human_player
+      if values['human_first']:
+        p1 = human_player
+        p2 = computer_player
+      else:
+        p1 = computer_player
+        p2 = human_player
 
-    self.intro_window.hide()
+      self.intro_window.hide()
 
-    a1 = VisualArena(g1, p1, p2, self.gw)
-    self.run_play(a1)
+      a1 = VisualArena(g1, p1, p2, self.gw)
+      self.run_play(a1)
 
   def run_play(self, a1: VisualArena):
     """
@@ -134,20 +106,23 @@ class MainWindow(object):
     :param a1: the VisualArena of the active game
     :return:
     """
-    self.playing_window['graph'].erase()
     self.playing_window.un_hide()
     self.gw.draw()
+    self.playing_window.refresh()
 
     try:
       a1.play()
     except BackButtonException as _:
-      print("We caught a CWCError, so we're closing the window and returning to main menu")
+      print("We caught a CWCError, so we're hiding the window and returning to main menu")
     except ClosedWindowException as _:
-      print("the window was closed, so we don't need to close the window")
-      print("but we will anyway")
+      print("the window was closed, so we need to make a new one for the next game")
+      self.playing_window = make_playing_window()
+      self.playing_window.hide()
+      return
 
-    self.playing_window.close()
-    self.run_intro()
+    # Remove this game's drawing, so the window can be reused for the next game
+    self.gw.clear()
+    self.playing_window.hide()
 
     # g1 = Game(int(values['num_layers']))
     # gw = GameWindow(game=g1)
@@ -1,27 +1,30 @@
 # (c) Nikolaus Howe 2021
 from __future__ import annotations
 
+import math
+
 import typing
 if typing.TYPE_CHECKING:
-  from matchsticks.game_graphics.game_window import GameWindow
+  from matchsticks.game_graphics.pyramid import Pyramid
+
+from typing import Optional
+
+from matchsticks.game_types import Line
 
 
 class Matchstick(object):
-  def __init__(self, layer: int, idx: int, gw: GameWindow) -> None:
+  __slots__ = ('pyramid', 'i')
+
+  def __init__(self, pyramid: Pyramid, i: int) -> None:
     """
-    A matchstick object to draw in the game window.
+    A matchstick to draw in the game window. Everything about the stick is stored in
+    the pyramid's arrays, so this is just a view of its entry in them.
 
-    :param layer: which layer is the matchstick in (1-indexed)
-    :param idx: where in the layer is the matchstick (1-indexed)
-    :param gw: the game window
+    :param pyramid: the pyramid the matchstick belongs to
+    :param i: the number of the matchstick in the pyramid's arrays
     """
-    self.layer = layer
-    self.idx = idx
-    self.line = None  # hasn't been drawn yet
-    self.v_pos = None
-    self.h_pos = None
-    self.is_active = True
-    self.gw = gw
+    self.pyramid = pyramid
+    self.i = i
 
   def __repr__(self) -> str:
     """
@@ -31,18 +34,68 @@ class Matchstick(object):
     """
     return f'M({self.layer}, {self.idx})'
 
+  @property
+  def layer(self) -> int:
+    """
+    Which layer the matchstick is in (1-indexed). Crossed-off sticks keep the layer they were last in.
+    """
+    return self.pyramid.row_layers[self.pyramid.row_of[self.i]] + 1
+
+  @property
+  def idx(self) -> int:
+    """
+    Where in its layer the matchstick is (1-indexed).
+    """
+    return self.i - self.pyramid.row_starts[self.pyramid.row_of[self.i]] + 1
+
+  @property
+  def is_active(self) -> bool:
+    return bool(self.pyramid.active[self.i])
+
+  @property
+  def v_pos(self) -> Optional[float]:
+    v_pos = float(self.pyramid.v_pos[self.i])
+    return None if math.isnan(v_pos) else v_pos
+
+  @property
+  def h_pos(self) -> Optional[float]:
+    h_pos = float(self.pyramid.h_pos[self.i])
+    return None if math.isnan(h_pos) else h_pos
+
+  @property
+  def line(self) -> Optional[Line]:
+    """
+    The line segment of the drawn matchstick (None if it hasn't been drawn yet).
+    """
+    v_pos, h_pos = self.v_pos, self.h_pos
+    if v_pos is None or h_pos is None:
+      return None
+    half_length = self.pyramid.gw.stick_length / 2
+    return (h_pos, v_pos - half_length), (h_pos, v_pos + half_length)
+
+  @property
+  def figure(self) -> Optional[int]:
+    """
+    The id of the drawn line on the canvas (None if it hasn't been drawn).
+    """
+    figure = int(self.pyramid.figures[self.i])
+    return None if figure < 0 else figure
+
+  @figure.setter
+  def figure(self, figure: Optional[int]) -> None:
+    self.pyramid.figures[self.i] = -1 if figure is None else figure
+
   def set_inactive(self) -> None:
     """
     Make this matchstick inactive (when it's been crossed off).
 
     :return:
     """
-    self.is_active = False
-    self.gw.pyramid.inactive_sticks.append(self)
+    self.pyramid.active[self.i] = False
 
   def draw(self, v_pos: float = None, h_pos: float = None) -> None:  # only uses v_pos and h_pos if not drawn before
     """
-    Draw this matchstick.
+    Draw this matchstick. If it has been drawn before, its colour is updated in place instead.
 
     :param v_pos: the vertical position of the center of the stick
     :param h_pos: the horizontal position of the center of the stick
@@ -51,16 +104,18 @@ class Matchstick(object):
     if not self.v_pos:
       if not v_pos:
         raise Exception('At first drawing, you need to provide v_pos and h_pos')
-      self.v_pos = v_pos
+      self.pyramid.v_pos[self.i] = v_pos
     if not self.h_pos:
       if not h_pos:
         raise Exception('At first drawing, you need to provide v_pos and h_pos')
-      self.h_pos = h_pos
-    self.line = ((self.h_pos, self.v_pos - self.gw.stick_length / 2),
-                 (self.h_pos, self.v_pos + self.gw.stick_length / 2))
+      self.pyramid.h_pos[self.i] = h_pos
     if self.is_active:
       stick_colour = 'black'
     else:
       stick_colour = 'red'
 
-    self.gw.window['graph'].draw_line(*self.line, color=stick_colour, width=2)
+    gw = self.pyramid.gw
+    if self.figure is None:
+      self.figure = gw.surface.draw_line(*self.line, color=stick_colour, width=2)
+    else:
+      gw.recolour_figure(self.figure, stick_colour)
@@ -0,0 +1,77 @@
+# (c) Nikolaus Howe 2021
+import threading
+
+from typing import Callable, Optional
+
+from matchsticks.player import BookPlayer, CalibratedPlayer, PerfectPlayer, Player, RandomPlayer
+
+
+# How often the computer player blunders at each difficulty. These were fitted with
+# calibration.py, so that they win 60%, 75% and 90% of 4-layer games against a random player.
+DIFFICULTY_BLUNDER_RATES = {
+  'Easy': 0.8,
+  'Medium': 0.5,
+  'Hard': 0.2,
+}
+
+
+def default_opponents() -> dict[str, Callable[[], Player]]:
+  """
+  The opponents offered in the intro window, and how to make each of them. The perfect opponent
+  plays its openings from the opening book (the others don't, since it would change how strong they are).
+
+  :return: a dict from difficulty name to a function which makes that opponent
+  """
+  opponents = {'Plays randomly': lambda: RandomPlayer('Computer')}
+  for difficulty, blunder_rate in DIFFICULTY_BLUNDER_RATES.items():
+    opponents[difficulty] = lambda blunder_rate=blunder_rate: CalibratedPlayer(blunder_rate, 'Computer')
+  opponents['Perfect'] = lambda: BookPlayer(PerfectPlayer('Computer'))
+  return opponents
+
+
+class OpponentPool(object):
+  def __init__(self, factories: Optional[dict[str, Callable[[], Player]]] = None) -> None:
+    """
+    A registry of computer opponents. Each opponent is made (which may mean loading a Q-table
+    from disk) the first time it's needed, and is then reused for every later game. Opponents
+    are shared between games, so they shouldn't learn or keep any per-game state.
+
+    :param factories: a dict from difficulty name to a function which makes that opponent
+    """
+    self.factories = factories if factories is not None else default_opponents()
+    self._opponents = {}
+    self._lock = threading.Lock()
+
+  def get(self, difficulty: str) -> Player:
+    """
+    Get the opponent for a difficulty, making it if this is the first time it's been asked for.
+
+    :param difficulty: the name of the difficulty
+    :return: the opponent
+    """
+    if difficulty not in self.factories:
+      raise ValueError("that kind of player isn't ready yet")
+
+    with self._lock:
+      if difficulty not in self._opponents:
+        self._opponents[difficulty] = self.factories[difficulty]()
+      return self._opponents[difficulty]
+
+  def preload(self, background: bool = True) -> Optional[threading.Thread]:
+    """
+    Make all the opponents ahead of time.
+
+    :param background: whether to make them in a background thread (and return straight away)
+    :return: the background thread, if there is one
+    """
+    def load_all() -> None:
+      for difficulty in self.factories:
+        self.get(difficulty)
+
+    if not background:
+      load_all()
+      return None
+
+    thread = threading.Thread(target=load_all, daemon=True)
+    thread.start()
+    return thread
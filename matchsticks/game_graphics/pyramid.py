@@ -1,27 +1,73 @@
 # (c) Nikolaus Howe 2021
 from __future__ import annotations
 
+import numpy as np
+
 import typing
 if typing.TYPE_CHECKING:
   from matchsticks.game_graphics.game_window import GameWindow
 
+from bisect import bisect_right
+
 from matchsticks.game_graphics.matchstick import Matchstick
 from matchsticks.game_graphics.row import Row
+from matchsticks.game_graphics.stick_index import StickIndex
 from matchsticks.game_types import Line, Move
-from matchsticks.utils import check_intersection
 
 
 class Pyramid(object):
-  def __init__(self, rows: list[Row], gw: GameWindow) -> None:
+  def __init__(self, state: tuple[int, ...], gw: GameWindow) -> None:
     """
-    A pyramid of rows of matchsticks.
+    A pyramid of rows of matchsticks. The geometry of the sticks is kept in parallel arrays
+    (indexed by stick number), and the Matchstick and Row objects are views of them.
+    The sticks of each row are numbered consecutively, so rows are ranges of stick numbers.
 
-    :param rows: the rows of matchsticks
+    :param state: the lengths of the rows
     :param gw: the game window
     """
-    self.rows = rows
     self.gw = gw
-    self.inactive_sticks = []
+    num_sticks = sum(state)
+    self.v_pos = np.full(num_sticks, np.nan)  # NaN until drawn
+    self.h_pos = np.full(num_sticks, np.nan)
+    self.active = np.ones(num_sticks, dtype=bool)
+    self.figures = np.full(num_sticks, -1, dtype=np.int64)  # ids of the drawn lines on the canvas (-1 if not drawn)
+    self.row_of = np.repeat(np.arange(len(state), dtype=np.int32), state)  # the row each stick is (or was last) in
+
+    # For each row which has ever existed: its range of stick numbers, and its (last) position in the pyramid
+    self.row_starts = []
+    self.row_stops = []
+    self.row_layers = []
+
+    self.sticks = [Matchstick(self, i) for i in range(num_sticks)]
+    self.rows = []
+    start = 0
+    for layer_n in state:
+      self.rows.append(self._make_row(start, start + layer_n))
+      start += layer_n
+    self.row_layers = list(range(len(self.rows)))
+    self.index = None  # built once the sticks have been drawn
+
+  def _make_row(self, start: int, stop: int) -> Row:
+    """
+    Make a new row from a range of sticks.
+
+    :param start: the number of the first stick in the row
+    :param stop: one more than the number of the last stick in the row
+    :return: the row
+    """
+    row_id = len(self.row_starts)
+    self.row_starts.append(start)
+    self.row_stops.append(stop)
+    self.row_layers.append(-1)
+    self.row_of[start:stop] = row_id
+    return Row(self, row_id)
+
+  @property
+  def inactive_sticks(self) -> list[Matchstick]:
+    """
+    The sticks which have been crossed off.
+    """
+    return [self.sticks[i] for i in np.flatnonzero(~self.active)]
 
   def draw(self) -> None:
     """
@@ -33,31 +79,32 @@ class Pyramid(object):
     for i, row in enumerate(self.rows):
       row.draw(v_pos=self.gw.center[0] + (i - (num_rows - 1) / 2) * self.gw.v_spacing)
 
+    # Index the positions of the sticks for hit-testing
+    self.index = StickIndex(self.sticks, self.gw.stick_length)
+
   def adjust(self, move: Move) -> None:
     """
     Adjust the rows, and the matchsticks in the rows, to correspond to
-    the adjustment that happens to the state when a move is played.
+    the adjustment that happens to the state when a move is played. Only the sticks
+    of the row which the move is played on are touched; the rows are kept sorted by
+    length (with new rows after any of the same length), like the game state.
 
     :param move: the move which is played
     :return:
     """
     layer, low_idx, high_idx = move
-    row = self.rows.pop(layer-1)
-    left_row_list = row.matchsticks[:low_idx-1]
-    if left_row_list:
-      left_row = Row(left_row_list, self.gw)
-      self.rows.append(left_row)
-    right_row_list = row.matchsticks[high_idx:]
-    if right_row_list:
-      right_row = Row(right_row_list, self.gw)
-      self.rows.append(right_row)
-    self.rows.sort(key=lambda x: len(x.matchsticks))
-
-    # Now adjust all the sticks
-    for layer, row in enumerate(self.rows):
-      for i, stick in enumerate(row.matchsticks):
-        stick.layer = layer + 1
-        stick.idx = i + 1
+    row = self.rows.pop(layer - 1)
+    start, stop = self.row_starts[row.row_id], self.row_stops[row.row_id]
+    first_moved_layer = layer - 1
+    for piece_start, piece_stop in ((start, start + low_idx - 1), (start + high_idx, stop)):
+      if piece_stop > piece_start:
+        new_layer = bisect_right([len(r) for r in self.rows], piece_stop - piece_start)
+        self.rows.insert(new_layer, self._make_row(piece_start, piece_stop))
+        first_moved_layer = min(first_moved_layer, new_layer)
+
+    # Renumber the rows which have moved
+    for layer_i in range(first_moved_layer, len(self.rows)):
+      self.row_layers[self.rows[layer_i].row_id] = layer_i
 
   def check_intersections(self, line: Line) -> list[Matchstick]:
     """
@@ -70,24 +117,20 @@ class Pyramid(object):
     :param line: the line segment
     :return: a list of matchsticks which intersect with the line segment
     """
-    the_intersections = None
+    if self.index is None:
+      raise Exception('The pyramid needs to be drawn before checking for intersections')
 
-    # First, check intersections with the inactive sticks
-    for stick in self.inactive_sticks:
-      if check_intersection(stick.line, line):
-        return []
+    crossed_sticks = self.index.query(line)
+    if not crossed_sticks:
+      return None
 
-    # If there are none, then we're ok to check intersections with the active sticks
-    for row in self.rows:
-      row_intersections = row.check_intersections(line)
-      if row_intersections:  # if it's not an empty list
-        # Only save if there are no intersections with other rows.
-        # Otherwise, ask for the human to give a new line.
-        if not the_intersections:
-          the_intersections = row_intersections
-        else:
-          return []
-    return the_intersections
+    # Crossing any already crossed-off sticks, or sticks from more than one row, isn't allowed
+    layer = crossed_sticks[0].layer
+    if any(not stick.is_active or stick.layer != layer for stick in crossed_sticks):
+      return []
+
+    crossed_sticks.sort(key=lambda stick: stick.idx)
+    return crossed_sticks
 
   def __repr__(self) -> str:
     """
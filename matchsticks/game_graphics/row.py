@@ -3,23 +3,34 @@ from __future__ import annotations
 
 import typing
 if typing.TYPE_CHECKING:
-  from matchsticks.game_graphics.game_window import GameWindow
+  from matchsticks.game_graphics.pyramid import Pyramid
 
-from matchsticks.utils import check_intersection
 from matchsticks.game_graphics.matchstick import Matchstick
-from matchsticks.game_types import Line
 
 
 class Row(object):
-  def __init__(self, matchsticks: list[Matchstick], gw: GameWindow) -> None:
+  __slots__ = ('pyramid', 'row_id')
+
+  def __init__(self, pyramid: Pyramid, row_id: int) -> None:
+    """
+    A row of matchsticks. The sticks of a row are always numbered consecutively in the
+    pyramid's arrays, so a row is just a view of a range of them.
+
+    :param pyramid: the pyramid the row belongs to
+    :param row_id: the number of the row in the pyramid's arrays
     """
-    A row of matchsticks.
+    self.pyramid = pyramid
+    self.row_id = row_id
 
-    :param matchsticks: a list of matchsticks
-    :param gw: the game window
+  def __len__(self) -> int:
+    return self.pyramid.row_stops[self.row_id] - self.pyramid.row_starts[self.row_id]
+
+  @property
+  def matchsticks(self) -> list[Matchstick]:
+    """
+    The matchsticks in the row, from left to right.
     """
-    self.matchsticks = matchsticks
-    self.gw = gw
+    return self.pyramid.sticks[self.pyramid.row_starts[self.row_id]:self.pyramid.row_stops[self.row_id]]
 
   def draw(self, v_pos: float) -> None:
     """
@@ -28,20 +39,9 @@ class Row(object):
     :param v_pos: vertical position of the center of all matchsticks in the row.
     :return:
     """
-    num_sticks = len(self.matchsticks)
-    for i, stick in enumerate(self.matchsticks):
+    gw = self.pyramid.gw
+    matchsticks = self.matchsticks
+    num_sticks = len(matchsticks)
+    for i, stick in enumerate(matchsticks):
       stick.draw(v_pos=v_pos,
-                 h_pos=self.gw.center[1] + (i - (num_sticks - 1) / 2) * self.gw.h_spacing)
-
-  def check_intersections(self, line: Line) -> list[Matchstick]:
-    """
-    Check for intersections of a given line segment with the matchsticks in this row.
-
-    :param line: the line segment
-    :return: a list of matchsticks which the line segment intersects with
-    """
-    intersections = []
-    for stick in self.matchsticks:
-      if check_intersection(stick.line, line):
-        intersections.append(stick)
-    return intersections
+                 h_pos=gw.center[1] + (i - (num_sticks - 1) / 2) * gw.h_spacing)
@@ -0,0 +1,194 @@
+# (c) Nikolaus Howe 2021
+import numpy as np
+import struct
+import zlib
+
+from abc import ABC, abstractmethod
+from overrides import overrides
+
+from matchsticks.game_types import Point
+
+
+# The colours the game draws with, for rasterising
+COLOURS = {
+  'black': (0, 0, 0),
+  'red': (255, 0, 0),
+  'lightblue': (173, 216, 230),
+  'white': (255, 255, 255),
+}
+
+
+class Surface(ABC):
+  """
+  An abstract class for the things a GameWindow can draw on. Coordinates are in pixels,
+  with (0, 0) at the top left.
+  """
+
+  @property
+  @abstractmethod
+  def size(self) -> tuple[int, int]:
+    """
+    The width and height of the surface.
+    """
+    pass
+
+  @abstractmethod
+  def draw_line(self, point_from: Point, point_to: Point, color: str, width: int) -> int:
+    """
+    Draw a line segment.
+
+    :param point_from: one end of the line
+    :param point_to: the other end of the line
+    :param color: the name of the colour to draw it in
+    :param width: the width of the line
+    :return: the id of the drawn line
+    """
+    pass
+
+  @abstractmethod
+  def delete_figure(self, figure: int) -> None:
+    """
+    Remove a line which has been drawn.
+
+    :param figure: the id of the drawn line
+    :return:
+    """
+    pass
+
+  @abstractmethod
+  def recolour_figure(self, figure: int, colour: str) -> None:
+    """
+    Change the colour of a line which has already been drawn.
+
+    :param figure: the id of the drawn line
+    :param colour: the name of the new colour
+    :return:
+    """
+    pass
+
+  def refresh(self) -> None:
+    """
+    Show any changes (for surfaces which are on the screen).
+
+    :return:
+    """
+    pass
+
+
+class GraphSurface(Surface):
+  def __init__(self, graph, window=None) -> None:
+    """
+    Draws on a PySimpleGUI graph.
+
+    :param graph: the graph element (with graph_bottom_left=(0, height) and graph_top_right=(width, 0))
+    :param window: the window the graph is in, which is refreshed to show changes (if given)
+    """
+    self.graph = graph
+    self.window = window
+
+  @property
+  @overrides
+  def size(self) -> tuple[int, int]:
+    return self.graph.CanvasSize
+
+  @overrides
+  def draw_line(self, point_from: Point, point_to: Point, color: str, width: int) -> int:
+    return self.graph.draw_line(point_from, point_to, color=color, width=width)
+
+  @overrides
+  def delete_figure(self, figure: int) -> None:
+    self.graph.delete_figure(figure)
+
+  @overrides
+  def recolour_figure(self, figure: int, colour: str) -> None:
+    self.graph.TKCanvas.itemconfig(figure, fill=colour)
+
+  @overrides
+  def refresh(self) -> None:
+    if self.window is not None:
+      self.window.refresh()
+
+
+class RecordingSurface(Surface):
+  def __init__(self, size: tuple[int, int] = (500, 500), background: str = 'lightblue') -> None:
+    """
+    Draws in memory, without needing a display. It records every call made to it,
+    keeps the lines which are currently drawn, and can rasterise them into a PNG.
+
+    :param size: the width and height of the surface
+    :param background: the name of the background colour (for rasterising)
+    """
+    self._size = size
+    self.background = background
+    self.calls = []  # (method name, arguments) for every call
+    self.figures = {}  # id -> [point_from, point_to, colour, width] for the lines currently drawn
+    self._next_figure = 1
+
+  @property
+  @overrides
+  def size(self) -> tuple[int, int]:
+    return self._size
+
+  @overrides
+  def draw_line(self, point_from: Point, point_to: Point, color: str, width: int) -> int:
+    figure = self._next_figure
+    self._next_figure += 1
+    self.calls.append(('draw_line', (point_from, point_to, color, width)))
+    self.figures[figure] = [point_from, point_to, color, width]
+    return figure
+
+  @overrides
+  def delete_figure(self, figure: int) -> None:
+    self.calls.append(('delete_figure', (figure,)))
+    del self.figures[figure]
+
+  @overrides
+  def recolour_figure(self, figure: int, colour: str) -> None:
+    self.calls.append(('recolour_figure', (figure, colour)))
+    self.figures[figure][2] = colour
+
+  @overrides
+  def refresh(self) -> None:
+    self.calls.append(('refresh', ()))
+
+  def rasterise(self) -> np.ndarray:
+    """
+    Draw the current lines into an image, in the order they were first drawn.
+
+    :return: the image, as a (height, width, 3) array of 8-bit RGB values
+    """
+    width, height = self._size
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[:, :] = COLOURS.get(self.background, COLOURS['white'])
+    for figure in sorted(self.figures):
+      (x1, y1), (x2, y2), colour, line_width = self.figures[figure]
+      num_points = int(max(abs(x2 - x1), abs(y2 - y1))) + 1
+      xs = np.rint(np.linspace(x1, x2, num_points)).astype(int)
+      ys = np.rint(np.linspace(y1, y2, num_points)).astype(int)
+      low = -(line_width // 2)
+      for dx in range(low, low + line_width):
+        for dy in range(low, low + line_width):
+          px, py = xs + dx, ys + dy
+          inside = (0 <= px) & (px < width) & (0 <= py) & (py < height)
+          image[py[inside], px[inside]] = COLOURS.get(colour, COLOURS['black'])
+    return image
+
+  def save_png(self, filename: str) -> None:
+    """
+    Rasterise the current lines, and save them as a PNG.
+
+    :param filename: where to save the image
+    :return:
+    """
+    image = self.rasterise()
+    height, width, _ = image.shape
+    raw = b''.join(b'\x00' + row.tobytes() for row in image)  # Each row starts with its filter type (none)
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+      return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    with open(filename, 'wb') as f:
+      f.write(b'\x89PNG\r\n\x1a\n')
+      f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+      f.write(chunk(b'IDAT', zlib.compress(raw)))
+      f.write(chunk(b'IEND', b''))
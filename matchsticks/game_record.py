@@ -0,0 +1,292 @@
+# (c) Nikolaus Howe 2021
+import struct
+import zlib
+
+from typing import BinaryIO, Iterator, Optional, TextIO, Union
+
+from matchsticks.game import game_from_position
+from matchsticks.game_types import Move
+
+
+# A binary game record file starts with MAGIC and a version byte. After that come chunks, each of which
+# is a (num_records, num_bytes) pair of uint32s followed by the zlib-compressed packed records (see GameRecord.pack).
+# A text game record file has one record per line (see GameRecord.to_text), and may have blank lines and # comments.
+MAGIC = b'MSGAME'
+VERSION = 1
+_RECORD_HEADER = struct.Struct('<BBH')  # number of rows, winner (NO_WINNER if unknown), number of moves
+_CHUNK_HEADER = struct.Struct('<II')
+NO_WINNER = 255
+
+
+class GameRecord(object):
+  def __init__(self,
+               position: Union[list[int], tuple[int, ...]],
+               moves: Optional[list[Move]] = None,
+               winner: Optional[int] = None) -> None:
+    """
+    A record of a game of matchsticks: the position it started from, and the moves played.
+
+    :param position: the lengths of the rows at the start of the game
+    :param moves: the moves played, in order
+    :param winner: who won (0 for the player who went first, 1 for the other one, or None if unknown)
+    """
+    self.position = tuple(sorted(position))
+    self.moves = list(moves) if moves is not None else []
+    self.winner = winner
+
+  def __eq__(self, other: object) -> bool:
+    if not isinstance(other, GameRecord):
+      return NotImplemented
+    return (self.position, self.moves, self.winner) == (other.position, other.moves, other.winner)
+
+  def __repr__(self) -> str:
+    """
+    String representation for printing.
+
+    :return: the string representation
+    """
+    return f'GameRecord({self.to_text()})'
+
+  def states(self) -> Iterator[tuple[int, ...]]:
+    """
+    Play the game through, checking that the moves are allowed.
+
+    :return: an iterator over the state before each move, and then the final state
+    """
+    game = game_from_position(self.position)
+    yield game.get_state()
+    for move in self.moves:
+      if not game.is_allowed(move):
+        raise ValueError(f'{move} is not an allowed move in state {game.get_state()}')
+      game.play_move(move)
+      yield game.get_state()
+
+  def to_text(self) -> str:
+    """
+    Write the record as a line of text, like '1 3 5 7 | 4:2-4 3:1-5 | 0'
+    (the rows, the moves as layer:low-high, and the winner, or - if unknown).
+
+    :return: the text
+    """
+    moves = ' '.join(f'{layer}:{low}-{high}' for layer, low, high in self.moves)
+    winner = '-' if self.winner is None else str(self.winner)
+    return f"{' '.join(map(str, self.position))} | {moves} | {winner}"
+
+  @staticmethod
+  def from_text(text: str) -> 'GameRecord':
+    """
+    Read a record written by to_text.
+
+    :param text: the text
+    :return: the record
+    """
+    try:
+      position, moves, winner = text.split('|')
+      parsed_moves = []
+      for move in moves.split():
+        layer, idxs = move.split(':')
+        low, high = idxs.split('-')
+        parsed_moves.append((int(layer), int(low), int(high)))
+      return GameRecord([int(n) for n in position.split()], parsed_moves,
+                        None if winner.strip() == '-' else int(winner))
+    except ValueError:
+      raise ValueError(f"'{text.strip()}' isn't a game record")
+
+  def pack(self) -> bytes:
+    """
+    Pack the record into bytes: a header, a byte for each row, and two bytes for each move
+    ((layer - 1) in the high byte, and (low - 1) and (high - 1) in the two halves of the low byte).
+
+    :return: the packed record
+    """
+    if len(self.position) > 255 or any(n > 255 for n in self.position) or len(self.moves) > 65_535:
+      raise ValueError(f'{self.to_text()} is too big to pack')
+    packed_moves = []
+    for layer, low, high in self.moves:
+      if not (1 <= layer <= 256 and 1 <= low <= high <= 16):
+        raise ValueError(f'The move {(layer, low, high)} is too big to pack')
+      packed_moves.append((layer - 1) << 8 | (low - 1) << 4 | (high - 1))
+    winner = NO_WINNER if self.winner is None else self.winner
+    return (_RECORD_HEADER.pack(len(self.position), winner, len(self.moves))
+            + bytes(self.position)
+            + struct.pack(f'<{len(packed_moves)}H', *packed_moves))
+
+  @staticmethod
+  def unpack(data: bytes, offset: int = 0) -> tuple['GameRecord', int]:
+    """
+    Read a record packed by pack.
+
+    :param data: the bytes the record is in
+    :param offset: where in the bytes the record starts
+    :return: the record, and where in the bytes it ends
+    """
+    num_rows, winner, num_moves = _RECORD_HEADER.unpack_from(data, offset)
+    offset += _RECORD_HEADER.size
+    position = data[offset:offset + num_rows]
+    offset += num_rows
+    packed_moves = struct.unpack_from(f'<{num_moves}H', data, offset)
+    offset += 2 * num_moves
+    moves = [((m >> 8) + 1, (m >> 4 & 15) + 1, (m & 15) + 1) for m in packed_moves]
+    return GameRecord(list(position), moves, None if winner == NO_WINNER else winner), offset
+
+
+class GameRecordWriter(object):
+  def __init__(self,
+               file: Union[str, BinaryIO, TextIO],
+               binary: bool = True,
+               chunk_size: int = 4096,
+               compression_level: int = 6) -> None:
+    """
+    Streams game records to a file, in the packed binary form (compressed in chunks) or as text.
+    It can also be passed to an Arena (or a Dojo) as the recorder, to record the games played there.
+
+    :param file: the filename (or file object, opened in binary or text mode to match) to write to
+    :param binary: whether to write the packed binary form (otherwise, text)
+    :param chunk_size: how many records to collect before compressing and writing them (for the binary form)
+    :param compression_level: the zlib compression level
+    """
+    self.binary = binary
+    self.chunk_size = chunk_size
+    self.compression_level = compression_level
+    self.num_games = 0
+    self._packed = []
+    self._current = None  # the record of the game being played, when used as a recorder
+
+    self._owns_file = isinstance(file, str)
+    self._file = open(file, 'wb' if binary else 'w') if self._owns_file else file
+    if binary:
+      self._file.write(MAGIC + bytes([VERSION]))
+
+  def write(self, record: GameRecord) -> None:
+    """
+    Write a record.
+
+    :param record: the record
+    :return:
+    """
+    if self.binary:
+      self._packed.append(record.pack())
+      if len(self._packed) >= self.chunk_size:
+        self.flush()
+    else:
+      self._file.write(record.to_text() + '\n')
+    self.num_games += 1
+
+  def start_game(self, position: Optional[tuple[int, ...]] = None) -> None:
+    """
+    Start recording a new game (throwing away the moves of any game which wasn't finished).
+
+    :param position: the position the game starts from (if not given, it's taken from the state of the first move,
+                     so a game which ends before its first move isn't recorded)
+    :return:
+    """
+    self.abort_game()
+    if position is not None:
+      self._current = GameRecord(position)
+
+  def abort_game(self) -> None:
+    """
+    Throw away the moves of the game being played, without writing its record (because it was abandoned).
+
+    :return:
+    """
+    self._current = None
+
+  def record(self, state: tuple[int, ...], move: Move, player: int) -> None:
+    """
+    Record a move of the game being played (the state of the first move is taken as the starting position).
+
+    :param state: the state in which the move was played
+    :param move: the move
+    :param player: who played the move (0 for the player who went first, 1 for the other one)
+    :return:
+    """
+    if self._current is None:
+      self._current = GameRecord(state)
+    self._current.moves.append(move)
+
+  def end_game(self, last_mover_won: bool = False) -> None:
+    """
+    Finish recording the game being played, and write its record. The player who crossed off
+    the last stick loses.
+
+    :param last_mover_won: whether the player who moved last won instead (because the other player lost on time)
+    :return:
+    """
+    record = self._current
+    self._current = None
+    if record is None:
+      return
+    last_mover = (len(record.moves) - 1) % 2
+    record.winner = last_mover if last_mover_won else 1 - last_mover
+    self.write(record)
+
+  def flush(self) -> None:
+    """
+    Compress and write the records which haven't been written yet.
+
+    :return:
+    """
+    if self.binary and self._packed:
+      compressed = zlib.compress(b''.join(self._packed), self.compression_level)
+      self._file.write(_CHUNK_HEADER.pack(len(self._packed), len(compressed)) + compressed)
+      self._packed = []
+    self._file.flush()
+
+  def close(self) -> None:
+    """
+    Write any remaining records and close the file.
+
+    :return:
+    """
+    self.flush()
+    if self._owns_file:
+      self._file.close()
+
+  def __enter__(self) -> 'GameRecordWriter':
+    return self
+
+  def __exit__(self, *args) -> None:
+    self.close()
+
+
+class GameRecordReader(object):
+  def __init__(self, filename: str) -> None:
+    """
+    Reads a file of game records written by a GameRecordWriter (in either form).
+
+    :param filename: the file to read
+    """
+    self.filename = filename
+    with open(filename, 'rb') as f:
+      magic = f.read(len(MAGIC) + 1)
+    self.binary = magic[:len(MAGIC)] == MAGIC
+    if self.binary and magic[len(MAGIC)] != VERSION:
+      raise ValueError(f"'{filename}' has unsupported game record format version {magic[len(MAGIC)]}")
+
+  def __iter__(self) -> Iterator[GameRecord]:
+    """
+    Read the records one at a time (the binary form is decompressed one chunk at a time).
+
+    :return: an iterator over the records
+    """
+    if not self.binary:
+      with open(self.filename) as f:
+        for line in f:
+          line = line.split('#')[0]
+          if line.strip():
+            yield GameRecord.from_text(line)
+      return
+
+    with open(self.filename, 'rb') as f:
+      f.read(len(MAGIC) + 1)
+      while True:
+        chunk_header = f.read(_CHUNK_HEADER.size)
+        if len(chunk_header) < _CHUNK_HEADER.size:
+          return
+        num_records, num_bytes = _CHUNK_HEADER.unpack(chunk_header)
+        data = zlib.decompress(f.read(num_bytes))
+        offset = 0
+        for _ in range(num_records):
+          record, offset = GameRecord.unpack(data, offset)
+          yield record
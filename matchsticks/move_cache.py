@@ -0,0 +1,115 @@
+# (c) Nikolaus Howe 2021
+import os
+import pickle as pkl
+import threading
+
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+
+class MoveCache(object):
+  def __init__(self, max_size: int = 100_000, filename: Optional[str] = None) -> None:
+    """
+    A bounded cache of move choices, keyed on (player key, game hash). When it's full,
+    the entry which was used least recently is thrown away. It keeps count of its hits
+    and misses, and can be saved to disk so that the next run starts with it full.
+    It can be shared between threads.
+
+    :param max_size: the most entries to keep
+    :param filename: if given, the cache is loaded from this file (if it exists), and save writes to it
+    """
+    if max_size < 1:
+      raise ValueError(f"The cache must be able to hold at least one entry (not {max_size})")
+    self.max_size = max_size
+    self.filename = filename
+    self.hits = 0
+    self.misses = 0
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+    if filename is not None and os.path.exists(filename):
+      self.load(filename)
+
+  def __len__(self) -> int:
+    return len(self._entries)
+
+  def get(self, key: Hashable) -> Optional[tuple]:
+    """
+    Look up an entry, and mark it as the most recently used.
+
+    :param key: the key
+    :return: the cached value, or None if it isn't in the cache
+    """
+    with self._lock:
+      value = self._entries.get(key)
+      if value is None:
+        self.misses += 1
+        return None
+      self.hits += 1
+      self._entries.move_to_end(key)
+      return value
+
+  def put(self, key: Hashable, value: tuple) -> None:
+    """
+    Add an entry, throwing away the least recently used entry if the cache is full.
+
+    :param key: the key
+    :param value: the value to cache (not None)
+    :return:
+    """
+    with self._lock:
+      self._entries[key] = value
+      self._entries.move_to_end(key)
+      if len(self._entries) > self.max_size:
+        self._entries.popitem(last=False)
+
+  def clear(self) -> None:
+    """
+    Empty the cache, and reset its counts.
+
+    :return:
+    """
+    with self._lock:
+      self._entries.clear()
+      self.hits = 0
+      self.misses = 0
+
+  def stats(self) -> dict[str, float]:
+    """
+    Summarise how well the cache is doing.
+
+    :return: the number of entries, hits and misses, and the fraction of lookups which were hits
+    """
+    lookups = self.hits + self.misses
+    return {
+      'size': len(self._entries),
+      'hits': self.hits,
+      'misses': self.misses,
+      'hit_rate': self.hits / lookups if lookups else 0.,
+    }
+
+  def save(self, filename: Optional[str] = None) -> None:
+    """
+    Pickle the entries (from least to most recently used).
+
+    :param filename: where to save them (the cache's own filename if not given)
+    :return:
+    """
+    filename = filename if filename is not None else self.filename
+    if filename is None:
+      raise ValueError("No filename to save the cache to")
+    with self._lock:
+      entries = list(self._entries.items())
+    with open(filename, 'wb') as f:
+      pkl.dump(entries, f)
+
+  def load(self, filename: str) -> None:
+    """
+    Add the entries from a saved cache (keeping only the most recently used, if there are too many).
+
+    :param filename: the saved cache
+    :return:
+    """
+    with open(filename, 'rb') as f:
+      entries = pkl.load(f)
+    for key, value in entries:
+      self.put(key, value)
@@ -0,0 +1,216 @@
+# (c) Nikolaus Howe 2021
+import argparse
+import asyncio
+import json
+import random
+import socket
+import time
+
+from typing import Optional
+
+from matchsticks.game import Game
+from matchsticks.game_types import Move
+from matchsticks.server import LatencyHistogram, MoveServer
+
+
+class MoveClient(object):
+  def __init__(self, host: str = '127.0.0.1', port: int = 8765) -> None:
+    """
+    A client for a MoveServer, which keeps a single connection open for all its requests.
+
+    :param host: the server's address
+    :param port: the server's port
+    """
+    self.socket = socket.create_connection((host, port))
+    self.file = self.socket.makefile('rwb')
+    self.next_id = 0
+
+  def request(self, request: dict) -> dict:
+    """
+    Send a request and wait for its response.
+
+    :param request: the request
+    :return: the response
+    """
+    request = dict(request, id=self.next_id)
+    self.next_id += 1
+    self.file.write(json.dumps(request).encode() + b'\n')
+    self.file.flush()
+    response = json.loads(self.file.readline())
+    if 'error' in response:
+      raise ValueError(response['error'])
+    return response
+
+  def get_moves(self, states: list[tuple[int, ...]], player: Optional[str] = None) -> list[Move]:
+    """
+    Ask the server for a move in each of a batch of states.
+
+    :param states: the states
+    :param player: which player should choose the moves (the server's default if not given)
+    :return: the moves
+    """
+    request = {'states': [list(state) for state in states]}
+    if player is not None:
+      request['player'] = player
+    return [tuple(move) for move in self.request(request)['moves']]
+
+  def get_stats(self) -> dict:
+    """
+    Get the server's latency statistics.
+
+    :return: the latency histogram summary
+    """
+    return self.request({'op': 'stats'})['latency']
+
+  def close(self) -> None:
+    self.file.close()
+    self.socket.close()
+
+
+class AsyncMoveClient(object):
+  def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """
+    An asyncio client for a MoveServer, which keeps a single connection open for all its requests.
+    Make one with AsyncMoveClient.connect.
+
+    :param reader: the connection's reader
+    :param writer: the connection's writer
+    """
+    self.reader = reader
+    self.writer = writer
+    self.lock = asyncio.Lock()  # Only one request at a time on a connection, so responses stay in order
+    self.next_id = 0
+
+  @staticmethod
+  async def connect(host: str = '127.0.0.1', port: int = 8765) -> 'AsyncMoveClient':
+    """
+    Connect to a MoveServer.
+
+    :param host: the server's address
+    :param port: the server's port
+    :return: the client
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    return AsyncMoveClient(reader, writer)
+
+  async def get_moves(self, states: list[tuple[int, ...]], player: Optional[str] = None) -> list[Move]:
+    """
+    Ask the server for a move in each of a batch of states.
+
+    :param states: the states
+    :param player: which player should choose the moves (the server's default if not given)
+    :return: the moves
+    """
+    request = {'id': self.next_id, 'states': [list(state) for state in states]}
+    self.next_id += 1
+    if player is not None:
+      request['player'] = player
+    async with self.lock:
+      self.writer.write(json.dumps(request).encode() + b'\n')
+      await self.writer.drain()
+      response = json.loads(await self.reader.readline())
+    if 'error' in response:
+      raise ValueError(response['error'])
+    return [tuple(move) for move in response['moves']]
+
+  async def close(self) -> None:
+    self.writer.close()
+    await self.writer.wait_closed()
+
+
+def random_states(num_states: int, num_layers: int = 4) -> list[tuple[int, ...]]:
+  """
+  Make some random states, by playing random moves from the start of a game.
+
+  :param num_states: how many states to make
+  :param num_layers: the number of layers of the games to play
+  :return: the states
+  """
+  states = []
+  while len(states) < num_states:
+    game = Game(num_layers)
+    while game.is_still_on() and len(states) < num_states:
+      states.append(game.get_state())
+      game.play_move(random.choice(game.get_allowed()))
+  return states
+
+
+async def run_load(host: str = '127.0.0.1',
+                   port: int = 8765,
+                   num_requests: int = 1_000,
+                   batch_size: int = 16,
+                   num_connections: int = 8,
+                   player: Optional[str] = None,
+                   num_layers: int = 4) -> dict:
+  """
+  Generate load on a MoveServer, and measure its throughput and latency from the client side.
+
+  :param host: the server's address
+  :param port: the server's port
+  :param num_requests: how many requests to send in total
+  :param batch_size: how many states to send in each request
+  :param num_connections: how many connections to send requests on at the same time
+  :param player: which player should choose the moves (the server's default if not given)
+  :param num_layers: the number of layers of the games the states come from
+  :return: the number of requests and states per second, and a summary of the request latencies
+  """
+  states = random_states(batch_size * 16, num_layers)
+  latencies = LatencyHistogram()
+
+  async def send_requests(num_to_send: int) -> None:
+    client = await AsyncMoveClient.connect(host, port)
+    for _ in range(num_to_send):
+      batch = random.sample(states, batch_size)
+      start_time = time.perf_counter()
+      await client.get_moves(batch, player)
+      latencies.record(time.perf_counter() - start_time)
+    await client.close()
+
+  start_time = time.perf_counter()
+  shares = [num_requests // num_connections + (i < num_requests % num_connections) for i in range(num_connections)]
+  await asyncio.gather(*(send_requests(share) for share in shares))
+  elapsed = time.perf_counter() - start_time
+
+  return {
+    'requests_per_second': num_requests / elapsed,
+    'states_per_second': num_requests * batch_size / elapsed,
+    'latency': latencies.summary(),
+  }
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+  """
+  Run the load generator from the command line. Without --port, a server is started in this
+  process, so that throughput can be measured on one machine without any setup.
+
+  :param argv: the command line arguments (without the program name)
+  :return:
+  """
+  parser = argparse.ArgumentParser(prog='matchsticks load', description='Generate load on a move server.')
+  parser.add_argument('--host', default='127.0.0.1', help="the server's address")
+  parser.add_argument('--port', type=int, default=None, help="the server's port (starts a local server if not given)")
+  parser.add_argument('--player', default=None, help='which player should choose the moves')
+  parser.add_argument('--requests', type=int, default=1_000, help='how many requests to send')
+  parser.add_argument('--batch-size', type=int, default=16, help='how many states to send in each request')
+  parser.add_argument('--connections', type=int, default=8, help='how many connections to use')
+  parser.add_argument('--layers', type=int, default=4, help='the number of layers of the games the states come from')
+  args = parser.parse_args(argv)
+
+  async def run() -> dict:
+    port = args.port
+    server = None
+    if port is None:
+      server = MoveServer(args.host, 0)
+      await server.start()
+      port = server.port
+    results = await run_load(args.host, port, args.requests, args.batch_size, args.connections,
+                             args.player, args.layers)
+    if server is not None:
+      server.server.close()
+    return results
+
+  print(json.dumps(asyncio.run(run()), indent=2))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,116 @@
+# (c) Nikolaus Howe 2021
+import numpy as np
+
+from multiprocessing import Pool
+from typing import Optional
+
+from matchsticks.batch_dojo import batch_ema_update
+from matchsticks.player import MCPlayer
+from matchsticks.state_space import StateIndex
+from matchsticks.trajectories import TrajectoryReader
+
+
+def get_returns(chunk: np.ndarray) -> np.ndarray:
+  """
+  Calculate the discounted return of every move in a chunk of recorded games, the same way
+  MCPlayer.update_and_end_episode does: each move's return is the reward of its player's
+  last move, discounted by 0.9 once for each of that player's later moves.
+
+  :param chunk: the records of some whole games (with dtype RECORD_DTYPE)
+  :return: the return of each move
+  """
+  # Records of a game are stored together and in order, so find where each game starts
+  _, game_starts, game_lengths = np.unique(chunk['game'], return_index=True, return_counts=True)
+  game_of_record = np.repeat(np.arange(len(game_starts)), game_lengths)
+  ply = np.arange(len(chunk)) - game_starts[game_of_record]
+  moves_until_end = game_lengths[game_of_record] - 1 - ply
+
+  # Players alternate, so a player's last move is either the last move of the game, or the one before it
+  last_move_of_player = game_starts[game_of_record] + game_lengths[game_of_record] - 1 - moves_until_end % 2
+  rewards = chunk['reward'][last_move_of_player].astype(float)
+  return 0.9 ** (moves_until_end // 2) * rewards
+
+
+def shard_statistics(filename: str, player: Optional[int] = None) -> tuple[tuple[int, ...], np.ndarray, np.ndarray]:
+  """
+  Stream through a trajectory file, adding up the returns of each state-move pair.
+
+  :param filename: the trajectory file
+  :param player: if given, only learn from the moves of this player (0 for the player who went first)
+  :return: the starting position of the games, and the sum and number of returns for each (state id, move id)
+  """
+  reader = TrajectoryReader(filename)
+  index = reader.index
+  size = index.num_states * index.max_moves
+  sums = np.zeros(size)
+  counts = np.zeros(size)
+  for chunk in reader:
+    returns = get_returns(chunk)
+    if player is not None:
+      returns = returns[chunk['player'] == player]
+      chunk = chunk[chunk['player'] == player]
+    keys = chunk['state'].astype(np.int64) * index.max_moves + chunk['move']
+    sums += np.bincount(keys, weights=returns, minlength=size)
+    counts += np.bincount(keys, minlength=size)
+
+  return reader.position, sums.reshape(index.num_states, -1), counts.reshape(index.num_states, -1)
+
+
+def _shard_statistics(args: tuple[str, Optional[int]]) -> tuple[tuple[int, ...], np.ndarray, np.ndarray]:
+  return shard_statistics(*args)
+
+
+def fit_q_table(filenames: list[str],
+                num_workers: int = 1,
+                player: Optional[int] = None) -> dict:
+  """
+  Fit an MCPlayer-compatible Q-table from recorded games. The shards are read in parallel,
+  and their statistics are then added together. Starting from MCPlayer's initial value of 0.1,
+  each state-move pair gets one step of 0.1 (compounded) towards the mean of its returns for
+  every time it was played.
+
+  :param filenames: the trajectory files (all recorded from the same starting position)
+  :param num_workers: how many processes to read the shards with
+  :param player: if given, only learn from the moves of this player (0 for the player who went first)
+  :return: the Q-table, in the same format as MCPlayer.Q
+  """
+  jobs = [(filename, player) for filename in filenames]
+  if num_workers > 1:
+    with Pool(num_workers) as pool:
+      shards = pool.map(_shard_statistics, jobs)
+  else:
+    shards = list(map(_shard_statistics, jobs))
+
+  # Reduce
+  position, sums, counts = shards[0]
+  for other_position, other_sums, other_counts in shards[1:]:
+    if other_position != position:
+      raise ValueError(f"Can't combine games starting from {position} with games starting from {other_position}")
+    sums += other_sums
+    counts += other_counts
+
+  q = np.full(sums.shape, 0.1)
+  batch_ema_update(q, sums, counts)
+
+  index = StateIndex(position, build_transitions=False)
+  q_table = {}
+  for s in np.flatnonzero(counts.any(axis=1)):
+    moves = index.get_moves(s)
+    q_table[index.get_state(s)] = dict(zip(moves, q[s, :len(moves)].tolist()))
+  return q_table
+
+
+def train_player(player: MCPlayer,
+                 filenames: list[str],
+                 num_workers: int = 1,
+                 recorded_player: Optional[int] = None) -> None:
+  """
+  Train a player from recorded games, replacing its Q-table entries for the positions which appear in them.
+
+  :param player: the player to train
+  :param filenames: the trajectory files (all recorded from the same starting position)
+  :param num_workers: how many processes to read the shards with
+  :param recorded_player: if given, only learn from the moves of this player (0 for the player who went first)
+  :return:
+  """
+  player.Q.update(fit_q_table(filenames, num_workers=num_workers, player=recorded_player))
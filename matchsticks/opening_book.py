@@ -0,0 +1,170 @@
+# (c) Nikolaus Howe 2021
+import argparse
+import json
+import os
+
+from typing import Optional
+
+from matchsticks.game import Game, game_from_position
+from matchsticks.game_types import Move
+from matchsticks.solver import get_children, predicts_win
+
+
+BOOK_FILENAME = os.path.join(os.path.dirname(__file__), 'data', 'opening_book.json')
+
+
+def evaluate_position(state: tuple[int, ...]) -> tuple[int, list[Move]]:
+  """
+  Work out the value of a position, and its best moves. In a winning position, the best moves
+  are the ones which leave the other player in a losing position. In a losing position, every
+  move loses against perfect play, so the best moves are the ones which leave the other player
+  the fewest winning replies (so that they're the hardest to refute).
+
+  :param state: the (sorted, non-empty) position
+  :return: the value for the player to move (1 for a win, -1 for a loss), and the best moves
+  """
+  game = game_from_position(state)
+  if predicts_win(state):
+    best = []
+    for move in game.get_allowed():
+      game.push(move)
+      if not predicts_win(game.get_state()):
+        best.append(move)
+      game.pop()
+    return 1, best
+
+  best = []
+  fewest_replies = None
+  for move in game.get_allowed():
+    game.push(move)
+    replies = sum(not predicts_win(child) for child in get_children(game.get_state()))
+    game.pop()
+    if fewest_replies is None or replies < fewest_replies:
+      best, fewest_replies = [move], replies
+    elif replies == fewest_replies:
+      best.append(move)
+  return -1, best
+
+
+class OpeningBook(object):
+  def __init__(self, positions: Optional[dict[tuple[int, ...], tuple[int, list[Move]]]] = None) -> None:
+    """
+    A book of the best moves (and the values) of the positions at the start of standard games,
+    so that players don't need to work them out during the game.
+
+    :param positions: the value and best moves of each position in the book
+    """
+    self.positions = positions if positions is not None else {}
+
+  def __len__(self) -> int:
+    return len(self.positions)
+
+  def __contains__(self, state: tuple[int, ...]) -> bool:
+    return tuple(state) in self.positions
+
+  def lookup(self, state: tuple[int, ...]) -> Optional[list[Move]]:
+    """
+    Look up the best moves of a position.
+
+    :param state: the position
+    :return: the best moves, or None if the position isn't in the book
+    """
+    entry = self.positions.get(tuple(state))
+    return None if entry is None else entry[1]
+
+  def value(self, state: tuple[int, ...]) -> Optional[int]:
+    """
+    Look up the value of a position.
+
+    :param state: the position
+    :return: the value for the player to move (1 for a win, -1 for a loss), or None if the position isn't in the book
+    """
+    entry = self.positions.get(tuple(state))
+    return None if entry is None else entry[0]
+
+  @staticmethod
+  def build(max_layers: int = 8, plies: int = 2) -> 'OpeningBook':
+    """
+    Build a book of the positions which can come up in the first few moves of a standard game
+    (of Game(n) for each n up to max_layers).
+
+    :param max_layers: the largest number of layers of standard game to cover
+    :param plies: how many moves to cover (1 for just the first move, 2 for the first move and the reply, ...)
+    :return: the book
+    """
+    positions = {}
+    for num_layers in range(1, max_layers + 1):
+      frontier = {Game(num_layers).get_state()}
+      for ply in range(plies):
+        next_frontier = set()
+        for state in frontier:
+          if not state or state in positions:
+            continue
+          positions[state] = evaluate_position(state)
+          if ply < plies - 1:
+            next_frontier.update(get_children(state))
+        frontier = next_frontier
+    return OpeningBook(positions)
+
+  def save(self, filename: str) -> None:
+    """
+    Save the book as JSON.
+
+    :param filename: where to save it
+    :return:
+    """
+    positions = {' '.join(map(str, state)): {'value': value, 'moves': [list(move) for move in moves]}
+                 for state, (value, moves) in sorted(self.positions.items(), key=lambda item: (len(item[0]), item[0]))}
+    with open(filename, 'w') as f:
+      json.dump({'positions': positions}, f, separators=(',', ':'))
+
+  @staticmethod
+  def load(filename: str = BOOK_FILENAME) -> 'OpeningBook':
+    """
+    Load a book saved with save.
+
+    :param filename: the saved book (the one which comes with the game, if not given)
+    :return: the book
+    """
+    with open(filename) as f:
+      saved = json.load(f)
+    return OpeningBook({tuple(int(n) for n in state.split()): (entry['value'], [tuple(move) for move in entry['moves']])
+                        for state, entry in saved['positions'].items()})
+
+
+_default_book = None
+
+
+def get_default_book() -> OpeningBook:
+  """
+  Get the book which comes with the game (loading it the first time it's needed).
+
+  :return: the book
+  """
+  global _default_book
+  if _default_book is None:
+    _default_book = OpeningBook.load()
+  return _default_book
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+  """
+  Build the opening book from the command line.
+
+  :param argv: the command line arguments (without the program name)
+  :return:
+  """
+  parser = argparse.ArgumentParser(prog='python -m matchsticks.opening_book',
+                                   description='Build the opening book for the standard games.')
+  parser.add_argument('--max-layers', type=int, default=8, help='the largest standard game to cover')
+  parser.add_argument('--plies', type=int, default=2, help='how many moves from the start to cover')
+  parser.add_argument('--output', default=BOOK_FILENAME, help='where to save the book')
+  args = parser.parse_args(argv)
+
+  book = OpeningBook.build(args.max_layers, args.plies)
+  book.save(args.output)
+  print(f'Saved {len(book)} positions to {args.output}')
+
+
+if __name__ == '__main__':
+  main()
@@ -1,14 +1,25 @@
 # (c) Nikolaus Howe 2021
+from __future__ import annotations
+
 import numpy as np
+import os
 import pickle as pkl
 import random
+import time
 
 from abc import ABC, abstractmethod
 from overrides import overrides
+from typing import Iterator, Optional
+
+import typing
+if typing.TYPE_CHECKING:
+  from matchsticks.game_graphics.game_window import GameWindow
 
 from matchsticks.game import Game
-from matchsticks.game_graphics.game_window import GameWindow
 from matchsticks.game_types import Move
+from matchsticks.move_cache import MoveCache
+from matchsticks.opening_book import OpeningBook, get_default_book
+from matchsticks.q_store import QStore, dump_q_table
 from matchsticks.utils import get_nim_sum, imagine_move
 
 
@@ -20,6 +31,24 @@ class Player(ABC):
     :param name: the name given to this player
     """
     self.name = name
+    self.deadline = None  # When the current move must be played by (on the time.monotonic clock), if ever
+
+  def start_turn(self, time_left: Optional[float]) -> None:
+    """
+    Tell the player how long they have for their next move (when playing with a clock).
+
+    :param time_left: the time (in seconds), or None if there is no limit
+    :return:
+    """
+    self.deadline = None if time_left is None else time.monotonic() + time_left
+
+  def get_time_left(self) -> Optional[float]:
+    """
+    How long the player has left for the current move.
+
+    :return: the time (in seconds), or None if there is no limit
+    """
+    return None if self.deadline is None else self.deadline - time.monotonic()
 
   @abstractmethod
   def move(self, game: Game) -> Move:
@@ -66,6 +95,26 @@ class Player(ABC):
     """
     return isinstance(self, VisualHumanPlayer)
 
+  def cache_key(self) -> Optional[str]:
+    """
+    A key for the player's moves in a MoveCache (see CachedPlayer). Players which return
+    the same key choose from the same best moves in every state, so they can share cache entries.
+    Players which learn, or which choose at random, can't be cached, and return None.
+
+    :return: the key, or None if the player's moves can't be cached
+    """
+    return None
+
+  def best_moves(self, game: Game) -> list[Move]:
+    """
+    The moves which the player thinks are equally best. Players which don't rank their moves
+    think that every allowed move is as good as any other.
+
+    :param game: the game (which must still be on)
+    :return: the best moves (never empty: every allowed move, if none is better than any other)
+    """
+    return game.get_allowed()
+
 
 class TrivialPlayer(Player):
   """
@@ -101,14 +150,15 @@ class RandomPlayer(Player):
 
 class MCPlayer(Player):
   @overrides
-  def __init__(self, name='Alice') -> None:
+  def __init__(self, name='Alice', q_store: Optional[QStore] = None) -> None:
     """
     An on-policy first-visit MC control player.
 
     :param name: name to give the player
+    :param q_store: if given, the Q-table is kept in it (to bound how much memory it uses), instead of in a dict
     """
     super().__init__(name=name)
-    self.Q = {}
+    self.Q = q_store if q_store is not None else {}
     self.rewards = []
     self.eps = 0.05
     self.history = []
@@ -185,8 +235,10 @@ class MCPlayer(Player):
       # if (word, move) in self.history[:i]:
       #   continue
 
-      # Running average, sort of
-      self.Q[word][move] = self.Q[word][move] * 0.9 + 0.1 * current_return
+      # Running average, sort of (a bounded Q-table may have forgotten the state since it was visited)
+      q_row = self.Q.get(word)
+      if q_row is not None:
+        q_row[move] = q_row[move] * 0.9 + 0.1 * current_return
 
     # End the episode by clearing histories
     self.history = []
@@ -203,41 +255,183 @@ class MCPlayer(Player):
       filename = self.name
 
     with open(filename, 'wb') as f:
-      pkl.dump(self.Q, f)
+      dump_q_table(self.Q, f)
 
     print(f"Saved Q table as '{filename}'")
 
 
+class AfterstateValuePlayer(MCPlayer):
+  @overrides
+  def __init__(self, name='Alice') -> None:
+    """
+    An on-policy first-visit MC control player which learns the value of afterstates
+    (the states resulting from its moves) instead of the value of state-move pairs.
+    Since imagine_move maps each (state, move) pair to a single resulting state,
+    this needs one entry per position rather than one per position and move.
+
+    :param name: name to give the player
+    """
+    super().__init__(name=name)
+    self.V = {}
+
+  def evaluate_moves(self, game: Game) -> tuple[list[Move], list[float]]:
+    """
+    Imagine every allowed move, and look up the value of each resulting state.
+
+    :param game: the game
+    :return: the allowed moves, and the value of the afterstate of each of them
+    """
+    game_state = game.get_state()
+    allowed_moves = game.get_allowed()
+    afterstates = [tuple(sorted(imagine_move(game_state, move))) for move in allowed_moves]
+    values = [self.V.get(afterstate, 0.1) for afterstate in afterstates]
+    return allowed_moves, values
+
+  @overrides
+  def policy(self, game: Game) -> Move:
+    """
+    An epsilon-greedy policy using a V table over afterstates for move evaluation.
+
+    :param game: the game
+    :return: the chosen move
+    """
+    allowed_moves, values = self.evaluate_moves(game)
+
+    # Choose randomly self.eps of the time
+    if np.random.uniform() < self.eps:
+      return random.choice(allowed_moves)
+    else:
+      return allowed_moves[int(np.argmax(values))]  # return the move with the highest afterstate value
+
+  @overrides
+  def move(self, game: Game) -> Move:
+    """
+    Chose a move according to an epsilon-greedy policy,
+    record the resulting afterstate in the episode history, and then play it.
+
+    :param game: the game
+    :return: the move
+    """
+    move = self.policy(game)
+
+    # Record the afterstate in history, initializing it into the V table if it's new
+    afterstate = tuple(sorted(imagine_move(game.get_state(), move)))
+    if afterstate not in self.V:
+      self.V[afterstate] = 0.1
+    self.history.append(afterstate)
+
+    return move
+
+  @overrides
+  def update_and_end_episode(self) -> None:
+    """
+    Use the stored afterstate history, and reward history, to
+    update the V-table according to an exponential averaging approach.
+    Then, clear the afterstate history and reward history.
+
+    :return:
+    """
+    discount = 0.9
+    current_return = 0.
+    for i, afterstate in reversed(list(enumerate(self.history))):
+      current_return = discount * current_return + self.rewards[i]
+      self.V[afterstate] = self.V[afterstate] * 0.9 + 0.1 * current_return
+
+    # End the episode by clearing histories
+    self.history = []
+    self.rewards = []
+
+  @overrides
+  def save_q(self, filename: str = None) -> None:
+    """
+    Save the V-table to disk, for future loading.
+
+    :param filename: what to save it as
+    :return:
+    """
+    if not filename:
+      filename = self.name
+
+    with open(filename, 'wb') as f:
+      pkl.dump(self.V, f)
+
+    print(f"Saved V table as '{filename}'")
+
+
+# The move cache shared by the players made by create_player
+shared_move_cache = MoveCache()
+
+# Q-tables which have already been loaded, keyed by filename (see load_q_table)
+_q_table_cache = {}
+
+
+def load_q_table(q_filename: str) -> dict:
+  """
+  Load a pickled Q-table. Each file is only unpickled once (or again if it changes on disk),
+  and the same Q-table is returned to everyone who loads it, so it must be treated as read-only.
+
+  :param q_filename: filename of the pickled Q-table
+  :return: the Q-table
+  """
+  file_stat = os.stat(q_filename)
+  version = (file_stat.st_mtime_ns, file_stat.st_size)
+  cached = _q_table_cache.get(q_filename)
+  if cached is None or cached[0] != version:
+    with open(q_filename, 'rb') as f:
+      cached = version, pkl.load(f)
+    _q_table_cache[q_filename] = cached
+  return cached[1]
+
+
 class PretrainedPlayer(Player):
   @overrides
   def __init__(self, q_filename: str, name: str = None) -> None:
     """
     Like the MCPlayer, but loads in a Q-table instead, and doesn't explore or learn.
+    The Q-table is shared with other players loaded from the same file, so it is never modified.
 
     :param q_filename: filename of the piclked Q-table
     :param name: name to give the player
     """
     super().__init__(name=q_filename if not name else name)
+    self.q_filename = q_filename
     try:
-      with open(q_filename, 'rb') as f:
-        self.Q = pkl.load(f)
+      self.Q = load_q_table(q_filename)
     except Exception as e:
       print(f"Couldn't load file {q_filename}.")
       print("The exception was", e)
       raise SystemExit
+    if self.Q and not isinstance(next(iter(self.Q.values())), dict):
+      print(f"{q_filename} holds the V table of an AfterstateValuePlayer, not a Q-table "
+            f"(load it with PretrainedAfterstatePlayer, or as 'afterstate:{q_filename}').")
+      raise SystemExit
+
+  @overrides
+  def cache_key(self) -> str:
+    return f'pretrained:{self.q_filename}'
+
+  @overrides
+  def best_moves(self, game: Game) -> list[Move]:
+    """
+    Find the moves with the highest Q value.
+
+    :param game: the game
+    :return: the best moves, according to the Q-table (every allowed move if we've never seen this position)
+    """
+    q_row = self.Q.get(game.get_state())
+    if not q_row:
+      return game.get_allowed()
+    best_value = max(q_row.values())
+    return [move for move, value in q_row.items() if value == best_value]
 
   def policy(self, game: Game) -> Move:
     """
-    Choose a move greedily according to the Q-table.
+    Choose a move greedily according to the Q-table (breaking ties at random).
 
     :param game: the game
     :return: the best move, according to the Q-table
     """
-    q_row = list(self.Q[game.get_state()].items())  # Turn the dict into a list
-    random.shuffle(q_row)
-    q_row.sort(key=lambda x: x[1], reverse=True)  # Sort in descending order
-    # print("sorted row is", q_row)
-    return q_row[0][0]  # return the move with the highest Q value
+    return random.choice(self.best_moves(game))
 
   @overrides
   def move(self, game: Game) -> Move:
@@ -247,13 +441,9 @@ class PretrainedPlayer(Player):
     :param game: the game
     :return: the move
     """
-    # If we've never seen this position, initialize it into the Q table
-    game_state = game.get_state()
-    if game_state not in self.Q:
-      possible_moves = game.get_allowed()
-      moves_and_values = list(map((lambda x: (x, 0.)), possible_moves))
-      # print("setting moves and values", moves_and_values)
-      self.Q[game_state] = dict(moves_and_values)
+    # If we've never seen this position, all the moves are equally good as far as we know
+    if game.get_state() not in self.Q:
+      return random.choice(game.get_allowed())
 
     # Choose a move according to the policy
     move = self.policy(game)
@@ -261,6 +451,95 @@ class PretrainedPlayer(Player):
     return move
 
 
+class PretrainedAfterstatePlayer(Player):
+  @overrides
+  def __init__(self, v_filename: str, name: str = None) -> None:
+    """
+    Like the AfterstateValuePlayer, but loads in a V table instead, and doesn't explore or learn.
+    The V table is shared with other players loaded from the same file, so it is never modified.
+
+    :param v_filename: filename of the pickled V table
+    :param name: name to give the player
+    """
+    super().__init__(name=v_filename if not name else name)
+    self.v_filename = v_filename
+    try:
+      self.V = load_q_table(v_filename)
+    except Exception as e:
+      print(f"Couldn't load file {v_filename}.")
+      print("The exception was", e)
+      raise SystemExit
+    if self.V and isinstance(next(iter(self.V.values())), dict):
+      print(f"{v_filename} holds a Q-table, not the V table of an AfterstateValuePlayer "
+            f"(load it with PretrainedPlayer, or as 'pretrained:{v_filename}').")
+      raise SystemExit
+
+  @overrides
+  def cache_key(self) -> str:
+    return f'afterstate:{self.v_filename}'
+
+  @overrides
+  def best_moves(self, game: Game) -> list[Move]:
+    """
+    Find the moves whose afterstates have the highest value.
+
+    :param game: the game
+    :return: the best moves, according to the V table (every allowed move if we've never seen any of the afterstates)
+    """
+    game_state = game.get_state()
+    allowed_moves = game.get_allowed()
+    afterstates = [tuple(sorted(imagine_move(game_state, move))) for move in allowed_moves]
+    if not any(afterstate in self.V for afterstate in afterstates):
+      return allowed_moves
+    values = [self.V.get(afterstate, 0.1) for afterstate in afterstates]
+    best_value = max(values)
+    return [move for move, value in zip(allowed_moves, values) if value == best_value]
+
+  @overrides
+  def move(self, game: Game) -> Move:
+    """
+    Play one of the moves whose afterstates have the highest value (breaking ties at random).
+
+    :param game: the game
+    :return: the move
+    """
+    return random.choice(self.best_moves(game))
+
+
+class AnytimePlayer(Player):
+  """
+  An abstract class for players which can keep improving their choice of move,
+  and return the best move they've found so far when their time runs out.
+  """
+  safety_margin = 0.005  # How long before the deadline (in seconds) to stop searching, to leave time to return
+
+  @abstractmethod
+  def improve_move(self, game: Game) -> Iterator[Move]:
+    """
+    Search for a move, yielding each new best move as it's found.
+
+    :param game: the game
+    :return: an iterator over better and better moves
+    """
+    pass
+
+  @overrides
+  def move(self, game: Game) -> Move:
+    """
+    Keep improving the move until the search finishes or the deadline (less a safety margin) arrives.
+
+    :param game: the game
+    :return: the best move found
+    """
+    best_move = None
+    for move in self.improve_move(game):
+      best_move = move
+      time_left = self.get_time_left()
+      if time_left is not None and time_left < self.safety_margin:
+        break
+    return best_move
+
+
 class HumanPlayer(Player):
   @overrides
   def __init__(self, name: str = 'Human') -> None:
@@ -279,6 +558,9 @@ class HumanPlayer(Player):
     :param game:
     :return:
     """
+    time_left = self.get_time_left()
+    if time_left is not None:
+      print(f"You have {time_left:.1f} seconds to move.")
     move_str = input("Input your move in the form (layer, low, high).\n")
     try:
       move = Move(map(int, move_str[1:-1].split(', ')))
@@ -319,37 +601,244 @@ class VisualHumanPlayer(HumanPlayer):
     return the_move
 
 
-class PerfectPlayer(Player):  # TODO: add tests for this player
+class PerfectPlayer(Player):
+  @overrides
+  def cache_key(self) -> Optional[str]:
+    return 'perfect'
+
+  def winning_moves(self, game: Game) -> list[Move]:
+    """
+    Find all the moves which win with perfect play, using the nim sum of the position.
+    Each move is tried out on the game itself, and then taken back.
+
+    :param game: the game
+    :return: the winning moves (none if every move loses against perfect play)
+    """
+    if game.get_largest_row() <= 1:
+      # Every move crosses off a single stick, so whoever faces an odd number of them crosses off the last one
+      return game.get_allowed() if game.get_nim_sum() == 0 else []
+    if game.get_nim_sum() == 0:  # There is no good move to play
+      return []
+
+    game_ending_moves = []
+    zero_nim_sum_moves = []
+    for move in game.get_allowed():
+      game.push(move)
+      move_nim_sum = game.get_nim_sum()
+      # Check for game-ending moves (leaving an odd number of single sticks), which are played in preference to anything else
+      if move_nim_sum == 1 and game.get_largest_row() == 1:
+        game_ending_moves.append(move)
+      elif move_nim_sum == 0:
+        zero_nim_sum_moves.append(move)
+      game.pop()
+
+    return game_ending_moves if game_ending_moves else zero_nim_sum_moves
+
+  @overrides
+  def best_moves(self, game: Game) -> list[Move]:
+    """
+    The winning moves, or every allowed move if every move loses against perfect play.
+
+    :param game: the game
+    :return: the best moves
+    """
+    return self.winning_moves(game) or game.get_allowed()
+
+  def optimal_move(self, game: Game) -> Move:
+    """
+    Find a move which wins with perfect play (a different one each time, if there are several).
+
+    :param game: the game
+    :return: a winning move, or None if every move loses against perfect play
+    """
+    moves = self.winning_moves(game)
+    return random.choice(moves) if moves else None
+
   @overrides
   def move(self, game: Game) -> Move:
-    # TODO: docstring
-    cur_nim_sum = get_nim_sum(game.get_state())
-    allowed_moves = game.get_allowed()
-    random.shuffle(allowed_moves)  # So it doesn't always play the same thing
-    if cur_nim_sum == 0:  # There is no good move to play, so choose one at random
-      return random.choice(allowed_moves)
-    else:
-      zero_nim_sum_move = None
-      for move in allowed_moves:
-        resulting_state = imagine_move(game.get_state(), move)
-        move_nim_sum = get_nim_sum(resulting_state)
-        # Check for game-ending move, and play immediately
-        if move_nim_sum == 1 and all(num == 1 for num in resulting_state):
-          return move
-        # Store zero move, but don't play, in case there is a game-ending move
-        elif move_nim_sum == 0 and zero_nim_sum_move is None:
-          zero_nim_sum_move = move
-
-      # Play the zero-preserving move, if present
-      if zero_nim_sum_move is not None:
-        return zero_nim_sum_move
+    """
+    Play a winning move if there is one, and a random move otherwise.
+
+    :param game: the game
+    :return: the move
+    """
+    move = self.optimal_move(game)
+    if move is not None:
+      return move
 
+    cur_nim_sum = game.get_nim_sum()
+    if cur_nim_sum != 0 and game.get_largest_row() > 1:
       # If we get here, it means that we didn't find an appropriate move,
       # so play at random
       print("I think we should never get here?")
       print("state:", game.get_state())
       print("nim sum:", cur_nim_sum)
-      return random.choice(allowed_moves)
+    return random.choice(game.get_allowed())
+
+
+class CalibratedPlayer(PerfectPlayer):
+  @overrides
+  def __init__(self, blunder_rate: float = 0.1, name: str = 'Alice') -> None:
+    """
+    A player which plays perfectly, except that some of the time it plays a random move instead.
+    Its strength is set by how often it blunders (see calibration.py for choosing the rate).
+
+    :param blunder_rate: the probability of playing a random move instead of the best move
+    :param name: name to give the player
+    """
+    super().__init__(name=name)
+    self.blunder_rate = blunder_rate
+
+  @overrides
+  def move(self, game: Game) -> Move:
+    """
+    Play a random move with probability blunder_rate, and play perfectly otherwise.
+
+    :param game: the game
+    :return: the move
+    """
+    if random.random() < self.blunder_rate:
+      return random.choice(game.get_allowed())
+    return super().move(game)
+
+  @overrides
+  def cache_key(self) -> Optional[str]:
+    return None  # Its blunders are chosen afresh each move
+
+
+class CachedPlayer(Player):
+  @overrides
+  def __init__(self, player: Player, cache: Optional[MoveCache] = None, name: Optional[str] = None) -> None:
+    """
+    Wraps a player, so that its best moves in each state are only worked out once, and then
+    looked up in a MoveCache. It then plays one of them at random, like the wrapped player would.
+    Players with the same cache_key can share a cache (for example, all the PerfectPlayers in a tournament).
+
+    :param player: the player to wrap (which must have a cache_key)
+    :param cache: the cache to use (a new one if not given)
+    :param name: name to give the player (the wrapped player's name if not given)
+    """
+    if player.cache_key() is None:
+      raise ValueError(f"{type(player).__name__}'s moves can't be cached")
+    super().__init__(name=player.name if name is None else name)
+    self.player = player
+    self.cache = cache if cache is not None else MoveCache()
+
+  @overrides
+  def cache_key(self) -> str:
+    return self.player.cache_key()
+
+  @overrides
+  def best_moves(self, game: Game) -> list[Move]:
+    """
+    Look up the wrapped player's best moves, working them out if they aren't in the cache.
+
+    :param game: the game
+    :return: the best moves
+    """
+    key = (self.player.cache_key(), game.get_hash())
+    moves = self.cache.get(key)
+    if moves is None:
+      moves = tuple(self.player.best_moves(game))
+      self.cache.put(key, moves)
+    return list(moves)
+
+  @overrides
+  def move(self, game: Game) -> Move:
+    """
+    Play one of the wrapped player's best moves.
+
+    :param game: the game
+    :return: the move
+    """
+    return random.choice(self.best_moves(game))
+
+
+class BookPlayer(Player):
+  @overrides
+  def __init__(self, player: Player, book: Optional[OpeningBook] = None, name: Optional[str] = None) -> None:
+    """
+    Wraps a player, so that it plays from an opening book while the game is in the book,
+    and only works out its own moves after that. The wrapped player should be one which
+    doesn't learn, since it isn't told about the moves played from the book.
+
+    :param player: the player to wrap
+    :param book: the opening book (the one which comes with the game if not given)
+    :param name: name to give the player (the wrapped player's name if not given)
+    """
+    super().__init__(name=player.name if name is None else name)
+    self.player = player
+    self.book = book if book is not None else get_default_book()
+
+  @overrides
+  def start_turn(self, time_left: Optional[float]) -> None:
+    super().start_turn(time_left)
+    self.player.start_turn(time_left)
+
+  @overrides
+  def cache_key(self) -> Optional[str]:
+    key = self.player.cache_key()
+    return None if key is None else f'book+{key}'
+
+  @overrides
+  def best_moves(self, game: Game) -> list[Move]:
+    """
+    Look up the best moves in the book, or get them from the wrapped player if the game isn't in the book.
+
+    :param game: the game
+    :return: the best moves
+    """
+    moves = self.book.lookup(game.get_state())
+    return list(moves) if moves is not None else self.player.best_moves(game)
+
+  @overrides
+  def move(self, game: Game) -> Move:
+    """
+    Play one of the book's best moves, or the wrapped player's move if the game isn't in the book.
+
+    :param game: the game
+    :return: the move
+    """
+    moves = self.book.lookup(game.get_state())
+    return random.choice(moves) if moves else self.player.move(game)
+
+
+def create_player(player_type: str, name: str = 'Computer') -> Player:
+  """
+  Make a non-interactive player from a short description, such as
+  'trivial', 'random', 'perfect', 'calibrated:0.2' (with a blunder rate)
+  'pretrained:trained_agents/hard.player' (with a Q-table filename)
+  or 'afterstate:afterstate.player' (with the filename of an AfterstateValuePlayer's V table).
+  Putting 'cached:' in front (as in 'cached:perfect') wraps the player in a CachedPlayer
+  which uses the shared move cache, and putting 'book:' in front wraps it in a BookPlayer
+  which uses the opening book which comes with the game.
+
+  :param player_type: the description of the player
+  :param name: the name to give the player
+  :return: the player
+  """
+  kind, _, argument = player_type.partition(':')
+  kind = kind.lower()
+  if kind == 'cached' and argument:
+    return CachedPlayer(create_player(argument, name), shared_move_cache)
+  elif kind == 'book' and argument:
+    return BookPlayer(create_player(argument, name))
+  elif kind == 'trivial':
+    return TrivialPlayer(name)
+  elif kind == 'random':
+    return RandomPlayer(name)
+  elif kind == 'perfect':
+    return PerfectPlayer(name)
+  elif kind == 'calibrated':
+    return CalibratedPlayer(float(argument) if argument else 0.1, name)
+  elif kind == 'pretrained' and argument:
+    return PretrainedPlayer(argument, name)
+  elif kind == 'afterstate' and argument:
+    return PretrainedAfterstatePlayer(argument, name)
+  elif kind == 'mc':
+    return MCPlayer(name)
+  else:
+    raise ValueError(f"Unknown player type '{player_type}'")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,243 @@
+# (c) Nikolaus Howe 2021
+import heapq
+import os
+import pickle as pkl
+import sqlite3
+
+from collections.abc import Iterable, Mapping, MutableMapping
+from typing import BinaryIO, Iterator, Optional
+
+from matchsticks.game_types import Move
+
+
+QRow = dict[Move, float]
+
+
+class _PickledAsDict(object):
+  def __init__(self, items: Iterable[tuple[tuple[int, ...], QRow]]) -> None:
+    """
+    Something which pickles as a dict of the given items, taking them one batch at a time as it's pickled.
+
+    :param items: the (key, value) pairs of the dict
+    """
+    self.items = items
+
+  def __reduce__(self) -> tuple:
+    return dict, (), None, None, iter(self.items)
+
+
+def dump_q_table(q: Mapping[tuple[int, ...], QRow], file: BinaryIO) -> None:
+  """
+  Pickle a Q-table as a plain dict (which load_q_table can read), writing it as it goes,
+  so a QStore's spilled states never all have to be in memory at once.
+
+  :param q: the Q-table (a dict or a QStore)
+  :param file: the file to write to, opened in binary mode
+  :return:
+  """
+  pickler = pkl.Pickler(file, pkl.HIGHEST_PROTOCOL)
+  pickler.fast = True  # Don't memoise the rows, which would keep every one of them in memory until the end
+  pickler.dump(_PickledAsDict(q.items()))
+
+
+class QStore(MutableMapping):
+  def __init__(self,
+               max_states: int = 1_000_000,
+               spill_filename: Optional[str] = None,
+               policy: str = 'lfu',
+               evict_fraction: float = 0.1) -> None:
+    """
+    A Q-table (a mapping from states to the values of their moves, like MCPlayer.Q) which keeps
+    at most max_states states in memory. When it's full, a batch of states is evicted: the ones
+    visited least often ('lfu', with the least recently used going first among equals), or the
+    ones used least recently ('lru'). Evicted states are spilled to a file on disk if one is given
+    (and brought back into memory the next time they're used), and are otherwise forgotten.
+    Looking up a state counts as a visit, and the state which was added last is never evicted.
+
+    :param max_states: the most states to keep in memory
+    :param spill_filename: where to keep the evicted states (they're forgotten if not given); the file is overwritten
+    :param policy: which states to evict first ('lfu' or 'lru')
+    :param evict_fraction: what fraction of max_states to evict at once when the store is full
+    """
+    if max_states < 1:
+      raise ValueError(f"The store must be able to hold at least one state (not {max_states})")
+    if policy not in ('lfu', 'lru'):
+      raise ValueError(f"Unknown eviction policy '{policy}' (it should be 'lfu' or 'lru')")
+    self.max_states = max_states
+    self.policy = policy
+    self.evict_batch = max(1, int(max_states * evict_fraction))
+    self._rows = {}
+    self._usage = {}  # state -> [number of visits, when it was last used]
+    self._clock = 0
+    self._spill = None
+    if spill_filename is not None:
+      if os.path.exists(spill_filename):
+        os.remove(spill_filename)
+      # The spill file is only scratch space, so it doesn't need to survive crashes
+      self._spill = sqlite3.connect(spill_filename, isolation_level=None)
+      self._spill.execute('PRAGMA journal_mode = OFF')
+      self._spill.execute('PRAGMA synchronous = OFF')
+      self._spill.execute('CREATE TABLE states (state TEXT PRIMARY KEY, row BLOB, visits INTEGER)')
+    self._num_spilled = 0
+    self.hits = 0
+    self.disk_hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.spills = 0
+
+  @staticmethod
+  def _spill_key(state: tuple[int, ...]) -> str:
+    return ' '.join(map(str, state))
+
+  def _unspill(self, state: tuple[int, ...]) -> Optional[tuple[QRow, int]]:
+    """
+    Take a state out of the spill file.
+
+    :param state: the state
+    :return: the values of its moves and its number of visits, or None if it isn't in the spill file
+    """
+    if self._spill is None or not self._num_spilled:
+      return None
+    key = self._spill_key(state)
+    found = self._spill.execute('SELECT row, visits FROM states WHERE state = ?', (key,)).fetchone()
+    if found is None:
+      return None
+    self._spill.execute('DELETE FROM states WHERE state = ?', (key,))
+    self._num_spilled -= 1
+    return pkl.loads(found[0]), found[1]
+
+  def _insert(self, state: tuple[int, ...], row: QRow, visits: int) -> None:
+    """
+    Put a state into memory, evicting others if the store is full.
+
+    :param state: the state
+    :param row: the values of its moves
+    :param visits: how many times it has been visited
+    :return:
+    """
+    self._clock += 1
+    self._rows[state] = row
+    self._usage[state] = [visits, self._clock]
+    if len(self._rows) > self.max_states:
+      self._evict(keep=state)
+
+  def _evict(self, keep: tuple[int, ...]) -> None:
+    """
+    Evict a batch of states from memory (spilling them to disk, if there is a spill file).
+
+    :param keep: a state not to evict
+    :return:
+    """
+    if self.policy == 'lfu':
+      victims = heapq.nsmallest(self.evict_batch + 1, self._usage.items(), key=lambda item: item[1])
+    else:
+      victims = heapq.nsmallest(self.evict_batch + 1, self._usage.items(), key=lambda item: item[1][1])
+    victims = [(state, usage) for state, usage in victims if state != keep][:self.evict_batch]
+    spilled = []
+    for state, (visits, _) in victims:
+      row = self._rows.pop(state)
+      del self._usage[state]
+      if self._spill is not None:
+        spilled.append((self._spill_key(state), pkl.dumps(row), visits))
+    self.evictions += len(victims)
+    if spilled:
+      self._spill.execute('BEGIN')
+      self._spill.executemany('INSERT INTO states VALUES (?, ?, ?)', spilled)
+      self._spill.execute('COMMIT')
+      self._num_spilled += len(spilled)
+      self.spills += len(spilled)
+
+  def __getitem__(self, state: tuple[int, ...]) -> QRow:
+    row = self._rows.get(state)
+    if row is not None:
+      self.hits += 1
+      self._clock += 1
+      usage = self._usage[state]
+      usage[0] += 1
+      usage[1] = self._clock
+      return row
+
+    spilled = self._unspill(state)
+    if spilled is not None:
+      self.disk_hits += 1
+      row, visits = spilled
+      self._insert(state, row, visits + 1)
+      return row
+
+    self.misses += 1
+    raise KeyError(state)
+
+  def __setitem__(self, state: tuple[int, ...], row: QRow) -> None:
+    usage = self._usage.get(state)
+    if usage is not None:
+      self._rows[state] = row
+      return
+    spilled = self._unspill(state)
+    self._insert(state, row, 0 if spilled is None else spilled[1])
+
+  def __delitem__(self, state: tuple[int, ...]) -> None:
+    if state in self._rows:
+      del self._rows[state]
+      del self._usage[state]
+      return
+    if self._unspill(state) is None:
+      raise KeyError(state)
+
+  def __contains__(self, state: object) -> bool:
+    if state in self._rows:
+      return True
+    if self._spill is None or not self._num_spilled or not isinstance(state, tuple):
+      return False
+    return self._spill.execute('SELECT 1 FROM states WHERE state = ?', (self._spill_key(state),)).fetchone() is not None
+
+  def __len__(self) -> int:
+    return len(self._rows) + self._num_spilled
+
+  def __iter__(self) -> Iterator[tuple[int, ...]]:
+    yield from list(self._rows)
+    if self._spill is not None:
+      for key, in self._spill.execute('SELECT state FROM states').fetchall():
+        yield tuple(int(n) for n in key.split())
+
+  def items(self) -> Iterator[tuple[tuple[int, ...], QRow]]:
+    """
+    Go through every state and the values of its moves, without counting visits or bringing spilled states back into memory.
+    The spilled states are read as they're needed, so the store shouldn't be changed while going through them.
+
+    :return: an iterator over (state, values of its moves) pairs
+    """
+    yield from list(self._rows.items())
+    if self._spill is not None:
+      for key, row in self._spill.execute('SELECT state, row FROM states'):
+        yield tuple(int(n) for n in key.split()), pkl.loads(row)
+
+  def stats(self) -> dict[str, float]:
+    """
+    Summarise how well the store is doing.
+
+    :return: the number of states (in memory and spilled), the lookups which were found in memory,
+             on disk, and not at all, the fraction found in memory, and the number of evictions and spills
+    """
+    lookups = self.hits + self.disk_hits + self.misses
+    return {
+      'size': len(self),
+      'in_memory': len(self._rows),
+      'spilled': self._num_spilled,
+      'hits': self.hits,
+      'disk_hits': self.disk_hits,
+      'misses': self.misses,
+      'hit_rate': self.hits / lookups if lookups else 0.,
+      'evictions': self.evictions,
+      'spills': self.spills,
+    }
+
+  def close(self) -> None:
+    """
+    Close the spill file (the states which were spilled can't be used after this).
+
+    :return:
+    """
+    if self._spill is not None:
+      self._spill.close()
+      self._spill = None
+      self._num_spilled = 0
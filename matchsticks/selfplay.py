@@ -0,0 +1,169 @@
+# (c) Nikolaus Howe 2021
+import argparse
+import json
+import numpy as np
+import os
+import random
+import time
+
+from multiprocessing import Pool
+from typing import Iterator, Optional
+
+from matchsticks.arena import Arena
+from matchsticks.game import Game, game_from_position
+from matchsticks.player import create_player
+from matchsticks.trajectories import TrajectoryWriter
+
+
+# How many shards the games are split into if not told otherwise. The games depend on the seed and the
+# number of shards (not on the number of workers), so this is fixed rather than taken from the number of CPUs
+DEFAULT_NUM_SHARDS = 16
+
+
+def shard_filename(output_dir: str, shard_i: int, num_shards: int) -> str:
+  """
+  The name of the trajectory file of a shard.
+
+  :param output_dir: where the shards are written
+  :param shard_i: which shard
+  :param num_shards: how many shards there are
+  :return: the filename
+  """
+  return os.path.join(output_dir, f'shard-{shard_i:04d}-of-{num_shards:04d}.traj')
+
+
+def selfplay_shard(shard_i: int,
+                   num_shards: int,
+                   num_games: int,
+                   output_dir: str,
+                   position: tuple[int, ...],
+                   player_types: tuple[str, str],
+                   seed: int = 0) -> dict:
+  """
+  Play games between two players, recording them to the shard's trajectory file. The players
+  take turns to go first (the trajectories say who moved first in each game, not which player it was).
+
+  :param shard_i: which shard to play
+  :param num_shards: how many shards there are
+  :param num_games: how many games to play in this shard
+  :param output_dir: where to write the shard's trajectory file
+  :param position: the position the games start from
+  :param player_types: the descriptions of the two players (see create_player)
+  :param seed: the seed for the run (each shard is seeded differently from it)
+  :return: the shard's number, number of games and records, how long it took, and its games per second
+  """
+  shard_seed = seed * num_shards + shard_i
+  random.seed(shard_seed)
+  np.random.seed(shard_seed % 2 ** 32)
+  players = [create_player(player_type, f'Player {i + 1}') for i, player_type in enumerate(player_types)]
+  game = game_from_position(position)
+
+  start_time = time.perf_counter()
+  with TrajectoryWriter(shard_filename(output_dir, shard_i, num_shards), position) as recorder:
+    for i in range(num_games):
+      game.reset(position)
+      p1, p2 = players if i % 2 == 0 else players[::-1]
+      Arena(game, p1, p2, silent=True, recorder=recorder).play()
+  seconds = time.perf_counter() - start_time
+
+  return {
+    'shard': shard_i,
+    'games': num_games,
+    'records': recorder.num_records,
+    'seconds': seconds,
+    'games_per_second': num_games / seconds if seconds else 0.,
+  }
+
+
+def _selfplay_shard(args: tuple[int, int, int, str, tuple[int, ...], tuple[str, str], int]) -> dict:
+  return selfplay_shard(*args)
+
+
+def selfplay(num_games: int,
+             output_dir: str,
+             position: tuple[int, ...] = (1, 3, 5, 7),
+             player_types: tuple[str, str] = ('random', 'random'),
+             num_workers: int = 1,
+             num_shards: int = DEFAULT_NUM_SHARDS,
+             seed: int = 0,
+             verbose: bool = False) -> dict:
+  """
+  Generate self-play data: play games between two players, split into shards which are played in
+  parallel, each of which is written to its own trajectory file (which can be read with a TrajectoryReader,
+  or used for offline training with fit_q_table).
+
+  :param num_games: how many games to play in total
+  :param output_dir: where to write the trajectory files
+  :param position: the position the games start from
+  :param player_types: the descriptions of the two players (see create_player)
+  :param num_workers: how many processes to play the shards with
+  :param num_shards: how many shards to split the games into (num_workers if not given)
+  :param seed: the seed for the run (the same seed and number of shards give the same games)
+  :param verbose: whether to print a summary of each shard as it finishes
+  :return: the number of games and records, how long it took, the games per second, and the summary of each shard
+  """
+  position = tuple(sorted(position))
+  for player_type in player_types:
+    create_player(player_type)  # Check the descriptions before starting any workers
+  os.makedirs(output_dir, exist_ok=True)
+
+  jobs = [(shard_i, num_shards, num_games // num_shards + (shard_i < num_games % num_shards), output_dir,
+           position, tuple(player_types), seed) for shard_i in range(num_shards)]
+  shards = []
+
+  def collect(results: Iterator[dict]) -> None:
+    for shard in results:
+      shards.append(shard)
+      if verbose:
+        print(f"shard {shard['shard']}: {shard['games']} games in {shard['seconds']:.1f}s "
+              f"({shard['games_per_second']:.0f} games/s)", flush=True)
+
+  start_time = time.perf_counter()
+  if num_workers > 1:
+    with Pool(min(num_workers, num_shards)) as pool:
+      collect(pool.imap_unordered(_selfplay_shard, jobs))
+  else:
+    collect(map(_selfplay_shard, jobs))
+  seconds = time.perf_counter() - start_time
+
+  shards.sort(key=lambda shard: shard['shard'])
+  return {
+    'games': sum(shard['games'] for shard in shards),
+    'records': sum(shard['records'] for shard in shards),
+    'seconds': seconds,
+    'games_per_second': num_games / seconds if seconds else 0.,
+    'shards': shards,
+  }
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+  """
+  Generate self-play data from the command line.
+
+  :param argv: the command line arguments (without the program name)
+  :return:
+  """
+  parser = argparse.ArgumentParser(prog='matchsticks selfplay',
+                                   description='Play games between two players, and write them to sharded trajectory files.')
+  parser.add_argument('--games', type=int, default=10_000, help='how many games to play')
+  parser.add_argument('--layers', type=int, default=4, help='how many layers the games start with')
+  parser.add_argument('--position', type=int, nargs='+', default=None,
+                      help='the rows the games start from (instead of a standard game)')
+  parser.add_argument('--players', nargs=2, default=['random', 'random'], metavar=('PLAYER_1', 'PLAYER_2'),
+                      help="the two players, such as 'random', 'perfect', 'mc' or 'calibrated:0.2'")
+  parser.add_argument('--output', default='selfplay_data', help='where to write the trajectory files')
+  parser.add_argument('--workers', type=int, default=os.cpu_count(), help='how many processes to use')
+  parser.add_argument('--shards', type=int, default=DEFAULT_NUM_SHARDS,
+                      help='how many shards to split the games into (the games depend on the seed and the number of '
+                           'shards, but not on the number of workers)')
+  parser.add_argument('--seed', type=int, default=0, help='the seed for the run')
+  args = parser.parse_args(argv)
+
+  position = tuple(args.position) if args.position else Game(args.layers).get_state()
+  results = selfplay(args.games, args.output, position, tuple(args.players), args.workers, args.shards, args.seed,
+                     verbose=True)
+  print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+  main()
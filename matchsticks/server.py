@@ -0,0 +1,222 @@
+# (c) Nikolaus Howe 2021
+import argparse
+import asyncio
+import json
+import math
+import time
+
+from typing import Any, Optional
+
+from matchsticks.game import MAX_ROW_LENGTH, MAX_ROWS, game_from_position
+from matchsticks.player import BookPlayer, CachedPlayer, MCPlayer, Player, create_player
+
+
+class LatencyHistogram(object):
+  def __init__(self) -> None:
+    """
+    A histogram of latencies, with buckets whose bounds go up in powers of two (in microseconds).
+    """
+    self.counts = {}
+    self.count = 0
+    self.total = 0.
+
+  def record(self, seconds: float) -> None:
+    """
+    Add a latency to the histogram.
+
+    :param seconds: the latency, in seconds
+    :return:
+    """
+    microseconds = max(seconds * 1e6, 1.)
+    bucket = math.ceil(math.log2(microseconds))
+    self.counts[bucket] = self.counts.get(bucket, 0) + 1
+    self.count += 1
+    self.total += seconds
+
+  def percentile(self, fraction: float) -> float:
+    """
+    Estimate a percentile of the latencies (by the upper bound of the bucket it falls in).
+
+    :param fraction: which percentile, as a fraction (0.99 for the 99th percentile)
+    :return: the latency, in seconds
+    """
+    if not self.count:
+      return 0.
+    seen = 0
+    for bucket in sorted(self.counts):
+      seen += self.counts[bucket]
+      if seen >= fraction * self.count:
+        return 2 ** bucket / 1e6
+    return 2 ** max(self.counts) / 1e6
+
+  def summary(self) -> dict:
+    """
+    Summarise the histogram.
+
+    :return: the count, mean and percentiles (in seconds), and the bucket counts keyed by upper bound in microseconds
+    """
+    return {
+      'count': self.count,
+      'mean': self.total / self.count if self.count else 0.,
+      'p50': self.percentile(0.5),
+      'p90': self.percentile(0.9),
+      'p99': self.percentile(0.99),
+      'buckets': {str(2 ** bucket): self.counts[bucket] for bucket in sorted(self.counts)},
+    }
+
+
+class MoveServer(object):
+  def __init__(self, host: str = '127.0.0.1', port: int = 8765, default_player: str = 'book:perfect') -> None:
+    """
+    Serves moves from players over TCP. Clients keep a connection open and send one JSON object
+    per line, and get one JSON object back per line, in order. A request looks like
+      {"id": 7, "player": "perfect", "states": [[1, 3, 5], [2, 2]]}
+    and is answered with a move for each state:
+      {"id": 7, "moves": [[3, 1, 5], [1, 1, 2]]}
+    The player can be anything create_player understands (apart from learning players, which would
+    learn from every request), and defaults to default_player. Moves are worked out in worker threads,
+    so that a slow player doesn't hold up the other connections.
+    Sending {"op": "stats"} gets the latency histogram of the requests served so far.
+
+    :param host: the address to listen on
+    :param port: the port to listen on
+    :param default_player: the player to use when a request doesn't say which one
+    """
+    self.host = host
+    self.port = port
+    self.default_player = default_player
+    self.players = {}
+    self.latencies = LatencyHistogram()
+    self.server = None
+
+  def get_player(self, player_type: str) -> Player:
+    """
+    Get the player for a description, making it if this is the first request for it.
+
+    :param player_type: the description of the player (see create_player)
+    :return: the player
+    """
+    if player_type not in self.players:
+      try:
+        player = create_player(player_type)
+      except SystemExit:  # PretrainedPlayer exits if it can't load its Q-table
+        raise ValueError(f"Couldn't load player '{player_type}'")
+      wrapped = player
+      while isinstance(wrapped, (BookPlayer, CachedPlayer)):
+        wrapped = wrapped.player
+      if isinstance(wrapped, MCPlayer):
+        raise ValueError(f"'{player_type}' is a learning player, so it can't be served")
+      self.players[player_type] = player
+    return self.players[player_type]
+
+  @staticmethod
+  def check_request(request: Any) -> None:
+    """
+    Check that a request for moves is well-formed, and that its states are ones which games can be made from.
+
+    :param request: the request
+    :return:
+    """
+    if not isinstance(request, dict):
+      raise ValueError("The request should be a JSON object")
+    if not isinstance(request.get('player', ''), str):
+      raise ValueError("The player should be a string")
+    states = request.get('states')
+    if not isinstance(states, list):
+      raise ValueError("The states should be a list of positions")
+    for state in states:
+      if not isinstance(state, list) or not state:
+        raise ValueError(f"{state} isn't a valid position (it should be a non-empty list of row lengths)")
+      if len(state) > MAX_ROWS:
+        raise ValueError(f"A position can have at most {MAX_ROWS} rows (not {len(state)})")
+      if any(type(n) is not int or not 1 <= n <= MAX_ROW_LENGTH for n in state):
+        raise ValueError(f"{state} isn't a valid position (the rows should be between 1 and {MAX_ROW_LENGTH} long)")
+
+  def handle_request(self, request: Any) -> dict:
+    """
+    Answer a single request.
+
+    :param request: the request (as decoded from JSON)
+    :return: the response
+    """
+    response = {'id': request.get('id') if isinstance(request, dict) else None}
+    try:
+      if isinstance(request, dict) and request.get('op') == 'stats':
+        response['latency'] = self.latencies.summary()
+        return response
+
+      self.check_request(request)
+      player = self.get_player(request.get('player', self.default_player))
+      response['moves'] = [list(player.move(game_from_position(state))) for state in request['states']]
+    except (KeyError, TypeError, ValueError) as e:
+      response['error'] = f"{type(e).__name__}: {e}"
+    return response
+
+  async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """
+    Answer requests on a connection until the client closes it.
+
+    :param reader: the connection's reader
+    :param writer: the connection's writer
+    :return:
+    """
+    try:
+      while True:
+        line = await reader.readline()
+        if not line:
+          break
+        start_time = time.perf_counter()
+        try:
+          response = await asyncio.to_thread(self.handle_request, json.loads(line))
+        except json.JSONDecodeError as e:
+          response = {'id': None, 'error': f"JSONDecodeError: {e}"}
+        writer.write(json.dumps(response).encode() + b'\n')
+        await writer.drain()
+        self.latencies.record(time.perf_counter() - start_time)
+    except ConnectionError:
+      pass
+    finally:
+      writer.close()
+
+  async def start(self) -> None:
+    """
+    Start listening for connections.
+
+    :return:
+    """
+    self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+    # Find out which port we got, in case we asked for any free port (port 0)
+    self.port = self.server.sockets[0].getsockname()[1]
+
+  async def serve_forever(self) -> None:
+    """
+    Start the server (if it hasn't been started yet), and answer requests until cancelled.
+
+    :return:
+    """
+    if self.server is None:
+      await self.start()
+    async with self.server:
+      await self.server.serve_forever()
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+  """
+  Run a move server from the command line.
+
+  :param argv: the command line arguments (without the program name)
+  :return:
+  """
+  parser = argparse.ArgumentParser(prog='matchsticks serve', description='Serve moves from players over TCP.')
+  parser.add_argument('--host', default='127.0.0.1', help='the address to listen on')
+  parser.add_argument('--port', type=int, default=8765, help='the port to listen on')
+  parser.add_argument('--player', default='book:perfect',
+                      help="the default player (e.g. 'book:perfect', 'perfect', 'calibrated:0.2')")
+  args = parser.parse_args(argv)
+
+  server = MoveServer(args.host, args.port, args.player)
+  print(f"Serving moves from '{args.player}' on {args.host}:{args.port}")
+  try:
+    asyncio.run(server.serve_forever())
+  except KeyboardInterrupt:
+    print("Latency:", server.latencies.summary())
@@ -0,0 +1,65 @@
+# (c) Nikolaus Howe 2021
+from typing import Iterator, Optional
+
+from matchsticks.utils import get_nim_sum
+
+
+def get_children(state: tuple[int, ...]) -> Iterator[tuple[int, ...]]:
+  """
+  Find the states which can be reached in one move. Crossing off sticks from the middle of a row
+  splits it in two, so a row of n can become any two rows a and b with a + b < n (where a row of 0
+  is no row at all). Equal rows, and mirror-image moves, give the same states, so they're only tried once.
+
+  :param state: the (sorted) state
+  :return: an iterator over the (sorted) states one move away
+  """
+  for i, layer_n in enumerate(state):
+    if i > 0 and state[i - 1] == layer_n:
+      continue
+    rest = state[:i] + state[i + 1:]
+    for left in range(layer_n // 2 + 1):
+      for right in range(left, layer_n - left):
+        yield tuple(sorted(rest + tuple(n for n in (left, right) if n > 0)))
+
+
+def predicts_win(state: tuple[int, ...], misere: bool = True) -> bool:
+  """
+  Decide whether the player to move wins with perfect play, using the nim sum rule.
+  In the normal game (whoever crosses off the last stick wins), the player to move wins when
+  the nim sum isn't zero. In the misère game (whoever crosses off the last stick loses), this is
+  the rule PerfectPlayer uses: it's the same, except when every row has a single stick,
+  where the player to move wins if there are an even number of rows.
+
+  :param state: the state
+  :param misere: whether whoever crosses off the last stick loses (otherwise, they win)
+  :return: whether the player to move wins
+  """
+  nim_sum = get_nim_sum(state)
+  if misere and all(n <= 1 for n in state):
+    return nim_sum == 0
+  return nim_sum != 0
+
+
+def solve(state: tuple[int, ...], misere: bool = True, table: Optional[dict[tuple[int, ...], bool]] = None) -> bool:
+  """
+  Decide exactly whether the player to move wins with perfect play, by searching the whole game tree
+  (remembering the result for every state it sees, so that each one is only solved once).
+
+  :param state: the state
+  :param misere: whether whoever crosses off the last stick loses (otherwise, they win)
+  :param table: the results found so far, to add to (so that it can be shared between calls)
+  :return: whether the player to move wins
+  """
+  if table is None:
+    table = {}
+  state = tuple(sorted(state))
+  if state in table:
+    return table[state]
+
+  if not state:
+    # The last stick has been crossed off, by the player who didn't move
+    result = misere
+  else:
+    result = any(not solve(child, misere, table) for child in get_children(state))
+  table[state] = result
+  return result
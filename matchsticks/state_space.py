@@ -0,0 +1,266 @@
+# (c) Nikolaus Howe 2021
+import numpy as np
+
+from functools import lru_cache
+from math import comb
+from typing import Union
+
+from matchsticks.game_types import Move
+from matchsticks.utils import generate_allowed, imagine_move
+
+
+def count_moves(state: tuple[int, ...]) -> int:
+  """
+  Count the allowed moves in a given state (a row of length n allows n * (n + 1) / 2 moves).
+
+  :param state: the state of the game
+  :return: the number of allowed moves
+  """
+  return sum(n * (n + 1) // 2 for n in state)
+
+
+def move_to_id(state: tuple[int, ...], move: Move) -> int:
+  """
+  Get the position of a move in the list of allowed moves of a state,
+  using the same ordering as Game.get_allowed.
+
+  :param state: the state of the game
+  :param move: the move, in the format (layer, low_idx, high_idx), all 1-indexed
+  :return: the move id
+  """
+  layer_i, low_idx, high_idx = move
+  return count_moves(state[:layer_i - 1]) + high_idx * (high_idx - 1) // 2 + low_idx - 1
+
+
+def id_to_move(state: tuple[int, ...], move_id: int) -> Move:
+  """
+  Get the move at a given position in the list of allowed moves of a state
+  (the inverse of move_to_id).
+
+  :param state: the state of the game
+  :param move_id: the move id
+  :return: the move, in the format (layer, low_idx, high_idx), all 1-indexed
+  """
+  move_id = int(move_id)
+  for i, n in enumerate(state):
+    num_layer_moves = n * (n + 1) // 2
+    if move_id < num_layer_moves:
+      high_idx = 1
+      while high_idx * (high_idx + 1) // 2 <= move_id:
+        high_idx += 1
+      low_idx = move_id - high_idx * (high_idx - 1) // 2 + 1
+      return i + 1, low_idx, high_idx
+    move_id -= num_layer_moves
+  raise ValueError(f"There is no move with that id in state {state}")
+
+
+# States are numbered in order of number of rows, and then by comparing the largest rows first.
+# Within the states with k rows (each at most max_row long), the state s_0 <= s_1 <= ... <= s_(k-1)
+# corresponds to the strictly increasing numbers c_i = s_i - 1 + i, and so (in the combinatorial
+# number system) to the number sum_i comb(c_i, i + 1). There are comb(max_row + k - 1, k) states with
+# k rows, so there are comb(max_row + k - 1, k - 1) states with fewer rows, which come before them.
+
+def count_bounded_states(max_row: int, max_rows: int) -> int:
+  """
+  Count the states with at most max_rows rows, each of length at most max_row (including the empty state).
+
+  :param max_row: the longest a row can be
+  :param max_rows: the most rows there can be
+  :return: the number of states
+  """
+  return comb(max_row + max_rows, max_rows)
+
+
+def rank(state: tuple[int, ...], max_row: int) -> int:
+  """
+  Number a state, among all the states whose rows are at most max_row long (in O(rows) time).
+  The numbers don't depend on how many rows are allowed, so the states with at most k rows
+  are numbered from 0 to count_bounded_states(max_row, k) - 1.
+
+  :param state: the (sorted) state
+  :param max_row: the longest a row can be
+  :return: the number of the state
+  """
+  k = len(state)
+  if k == 0:
+    return 0
+  if state[-1] > max_row:
+    raise ValueError(f"The state {state} has a row longer than {max_row}")
+  r = comb(max_row + k - 1, k - 1)
+  for i, n in enumerate(state):
+    r += comb(n - 1 + i, i + 1)
+  return r
+
+
+def unrank(r: int, max_row: int) -> tuple[int, ...]:
+  """
+  Find the state with a given number (the inverse of rank).
+
+  :param r: the number of the state
+  :param max_row: the longest a row can be
+  :return: the (sorted) state
+  """
+  if r < 0:
+    raise ValueError(f"There is no state numbered {r}")
+
+  # Find how many rows the state has
+  k = 0
+  while comb(max_row + k, k) <= r:
+    k += 1
+  if k == 0:
+    return ()
+  r -= comb(max_row + k - 1, k - 1)
+
+  # Find the rows from the largest down, each time taking the largest c_i which still fits
+  state = [0] * k
+  c = max_row + k - 1
+  for i in range(k - 1, -1, -1):
+    c -= 1
+    while comb(c, i + 1) > r:
+      c -= 1
+    r -= comb(c, i + 1)
+    state[i] = c - i + 1
+  return tuple(state)
+
+
+def enumerate_bounded_states(max_row: int, max_rows: int) -> list[tuple[int, ...]]:
+  """
+  Find all the states with at most max_rows rows, each of length at most max_row, in order of rank.
+
+  :param max_row: the longest a row can be
+  :param max_rows: the most rows there can be
+  :return: a list of the states
+  """
+  return [unrank(r, max_row) for r in range(count_bounded_states(max_row, max_rows))]
+
+
+@lru_cache(maxsize=None)
+def _row_reachable(layer_n: int) -> tuple[tuple[int, ...], ...]:
+  """
+  Find all the sets of rows which a single row can be split into. The rows which are left
+  need a crossed-off stick between each of them, so rows a_1, ..., a_k can be left from a row
+  of n exactly when (a_1 + 1) + ... + (a_k + 1) <= n + 1.
+
+  :param layer_n: the length of the row
+  :return: the (sorted) sets of rows it can become (including no rows at all)
+  """
+  reachable = []
+
+  def add_rows(rows: tuple[int, ...], largest: int, budget: int) -> None:
+    reachable.append(rows[::-1])
+    for n in range(min(largest, budget - 1), 0, -1):
+      add_rows(rows + (n,), n, budget - n - 1)
+
+  add_rows((), layer_n, layer_n + 1)
+  return tuple(reachable)
+
+
+def enumerate_states(position: Union[list[int], tuple[int, ...]]) -> list[tuple[int, ...]]:
+  """
+  Find all the states which can be reached from a given position (including the position itself,
+  and the empty end state), in order of rank. Each row is split up independently of the others,
+  so the reachable states are all the ways of combining what each of the rows can become.
+
+  :param position: the starting position
+  :return: a list of all reachable states
+  """
+  states = {()}
+  for layer_n in sorted(position, reverse=True):
+    states = {tuple(sorted(state + rows)) for state in states for rows in _row_reachable(layer_n)}
+
+  return sorted(states, key=lambda s: (len(s), s[::-1]))
+
+
+def count_states(num_layers: int) -> int:
+  """
+  Count the states which can be reached in a game with a given number of layers.
+
+  :param num_layers: the number of layers the game starts with
+  :return: the number of states
+  """
+  return len(enumerate_states([2 * i + 1 for i in range(num_layers)]))
+
+
+class StateIndex(object):
+  def __init__(self, position: Union[list[int], tuple[int, ...]], build_transitions: bool = True) -> None:
+    """
+    A dense numbering of all the states reachable from a position,
+    along with array lookup tables for playing moves by id. The states are kept in order of rank,
+    so a state's id is found by binary search on the ranks (see rank).
+
+    :param position: the starting position
+    :param build_transitions: whether or not to build the transitions table (only needed for playing moves by id)
+    """
+    self.max_row = max(position, default=1)
+    self.states = enumerate_states(position)
+    self.ranks = np.array([rank(state, self.max_row) for state in self.states], dtype=np.int64)
+    self.num_states = len(self.states)
+    self.start_id = self.get_id(tuple(sorted(position)))
+    self.end_id = self.get_id(())
+
+    # Number of allowed moves in each state
+    self.move_counts = np.array([count_moves(state) for state in self.states], dtype=np.int32)
+    self.max_moves = int(self.move_counts.max())
+
+    # transitions[s, m] is the id of the state reached by playing move m in state s (-1 if not a move)
+    self.transitions = None
+    if not build_transitions:
+      return
+    self.transitions = np.full((self.num_states, self.max_moves), -1, dtype=np.int32)
+    allowed_reference = generate_allowed(self.max_row)
+    for s, state in enumerate(self.states):
+      next_ranks = []
+      for i, layer_n in enumerate(state):
+        for low_idx, high_idx in allowed_reference[layer_n - 1]:
+          next_ranks.append(rank(tuple(sorted(imagine_move(state, (i + 1, low_idx, high_idx)))), self.max_row))
+      self.transitions[s, :len(next_ranks)] = np.searchsorted(self.ranks, next_ranks)
+
+  def __contains__(self, state: tuple[int, ...]) -> bool:
+    try:
+      self.get_id(state)
+    except KeyError:
+      return False
+    return True
+
+  def get_id(self, state: tuple[int, ...]) -> int:
+    """
+    Get the id of a state.
+
+    :param state: the (sorted) state
+    :return: the id of the state
+    """
+    if state and state[-1] > self.max_row:
+      raise KeyError(state)
+    state_rank = rank(state, self.max_row)
+    state_id = int(np.searchsorted(self.ranks, state_rank))
+    if state_id == self.num_states or self.ranks[state_id] != state_rank:
+      raise KeyError(state)
+    return state_id
+
+  def get_ids(self, ranks: np.ndarray) -> np.ndarray:
+    """
+    Get the ids of many states at once, from their ranks (which must all be of reachable states).
+
+    :param ranks: the ranks of the states (see rank)
+    :return: the ids of the states
+    """
+    return np.searchsorted(self.ranks, ranks)
+
+  def get_state(self, state_id: int) -> tuple[int, ...]:
+    """
+    Get the state with a given id.
+
+    :param state_id: the id
+    :return: the state
+    """
+    return self.states[state_id]
+
+  def get_moves(self, state_id: int) -> list[Move]:
+    """
+    Get the allowed moves for the state with a given id, in move id order.
+
+    :param state_id: the id of the state
+    :return: the allowed moves
+    """
+    state = self.states[state_id]
+    return [id_to_move(state, m) for m in range(self.move_counts[state_id])]
@@ -0,0 +1,219 @@
+# (c) Nikolaus Howe 2021
+import json
+import numpy as np
+import struct
+import zlib
+
+from typing import BinaryIO, Iterator, Optional, Union
+
+from matchsticks.game_types import Move
+from matchsticks.state_space import StateIndex, move_to_id
+
+
+# A trajectory file starts with MAGIC, a version byte, and a length-prefixed JSON header
+# (which holds the starting position, so that state ids can be turned back into states).
+# After that come chunks, each of which is a (num_records, num_bytes) pair of uint32s
+# followed by the zlib-compressed columns of the records, one column after the other.
+MAGIC = b'MSTRAJ'
+VERSION = 1
+RECORD_DTYPE = np.dtype([('game', '<u4'),     # which game (numbered from 0 in each file)
+                         ('state', '<u4'),    # id of the state in which the move was played
+                         ('move', '<u2'),     # id of the move among the allowed moves of the state
+                         ('reward', '<i1'),   # reward for the move (0 except for each player's last move)
+                         ('player', '<u1')])  # who played the move (0 for the player who went first)
+_CHUNK_HEADER = struct.Struct('<II')
+
+
+class TrajectoryWriter(object):
+  def __init__(self,
+               file: Union[str, BinaryIO],
+               position: Union[list[int], tuple[int, ...]],
+               chunk_size: int = 65_536,
+               compression_level: int = 6) -> None:
+    """
+    Streams the moves of games played from a given position to a compressed binary log.
+    Pass it to an Arena (or a Dojo) as the recorder to record the games played there.
+
+    :param file: the filename (or binary file object) to write to
+    :param position: the position all the recorded games start from
+    :param chunk_size: how many records to collect before compressing and writing them
+    :param compression_level: the zlib compression level
+    """
+    self.position = tuple(sorted(position))
+    self.index = StateIndex(self.position, build_transitions=False)
+    self._state_ids = {}  # the ids of the states seen so far (looking them up in the index is much slower)
+    self.chunk_size = chunk_size
+    self.compression_level = compression_level
+    self.num_games = 0
+    self.num_records = 0
+    self._records = []
+    self._game_start = 0
+
+    self._owns_file = isinstance(file, str)
+    self._file = open(file, 'wb') if self._owns_file else file
+    header = json.dumps({'position': list(self.position)}).encode()
+    self._file.write(MAGIC + bytes([VERSION]) + struct.pack('<I', len(header)) + header)
+
+  def start_game(self, position: Optional[tuple[int, ...]] = None) -> None:
+    """
+    Start recording a new game (throwing away the moves of any game which wasn't finished).
+
+    :param position: the position the game starts from (not needed, since it's in the file's header)
+    :return:
+    """
+    self.abort_game()
+
+  def abort_game(self) -> None:
+    """
+    Throw away the moves of the game being played, without finishing it (because it was abandoned).
+
+    :return:
+    """
+    del self._records[self._game_start:]
+
+  def record(self, state: tuple[int, ...], move: Move, player: int) -> None:
+    """
+    Record a move. Rewards are filled in once the game is over.
+
+    :param state: the state in which the move was played
+    :param move: the move
+    :param player: who played the move (0 for the player who went first, 1 for the other one)
+    :return:
+    """
+    state_id = self._state_ids.get(state)
+    if state_id is None:
+      state_id = self._state_ids[state] = self.index.get_id(state)
+    self._records.append((self.num_games, state_id, move_to_id(state, move), 0, player))
+
+  def end_game(self, last_mover_won: bool = False) -> None:
+    """
+    Finish recording a game. The player who crossed off the last stick gets a reward of -1
+    for their last move, and the other player gets a reward of 1 for their last move.
+
+    :param last_mover_won: whether the player who moved last won instead (because the other player lost on time)
+    :return:
+    """
+    records = self._records
+    last_reward = 1 if last_mover_won else -1
+    if len(records) > self._game_start:
+      records[-1] = records[-1][:3] + (last_reward,) + records[-1][4:]
+    if len(records) > self._game_start + 1:
+      records[-2] = records[-2][:3] + (-last_reward,) + records[-2][4:]
+    self.num_games += 1
+    self._game_start = len(records)
+
+    # Only write whole games, so that the rewards never need to be changed after writing
+    if self._game_start >= self.chunk_size:
+      self.flush()
+
+  def flush(self) -> None:
+    """
+    Compress and write the completed games which haven't been written yet.
+
+    :return:
+    """
+    if not self._game_start:
+      return
+    chunk = np.array(self._records[:self._game_start], dtype=RECORD_DTYPE)
+    columns = b''.join(np.ascontiguousarray(chunk[name]).tobytes() for name in RECORD_DTYPE.names)
+    compressed = zlib.compress(columns, self.compression_level)
+    self._file.write(_CHUNK_HEADER.pack(len(chunk), len(compressed)) + compressed)
+    self.num_records += len(chunk)
+    del self._records[:self._game_start]
+    self._game_start = 0
+
+  def close(self) -> None:
+    """
+    Write any remaining completed games and close the file.
+
+    :return:
+    """
+    self.flush()
+    if self._owns_file:
+      self._file.close()
+    else:
+      self._file.flush()
+
+  def __enter__(self) -> 'TrajectoryWriter':
+    return self
+
+  def __exit__(self, *args) -> None:
+    self.close()
+
+
+class TrajectoryReader(object):
+  def __init__(self, filename: str) -> None:
+    """
+    Reads a trajectory log written by a TrajectoryWriter.
+
+    :param filename: the file to read
+    """
+    self.filename = filename
+    with open(filename, 'rb') as f:
+      self._read_header(f)
+    self._index = None
+
+  def _read_header(self, f: BinaryIO) -> None:
+    """
+    Read and check the file header, leaving the file at the start of the first chunk.
+
+    :param f: the open file
+    :return:
+    """
+    magic = f.read(len(MAGIC) + 1)
+    if magic[:len(MAGIC)] != MAGIC:
+      raise ValueError(f"'{self.filename}' is not a trajectory file")
+    if magic[len(MAGIC)] != VERSION:
+      raise ValueError(f"'{self.filename}' has unsupported trajectory format version {magic[len(MAGIC)]}")
+    header_length, = struct.unpack('<I', f.read(4))
+    header = json.loads(f.read(header_length))
+    self.position = tuple(header['position'])
+
+  @property
+  def index(self) -> StateIndex:
+    """
+    The numbering of the states used in this file (built the first time it's needed).
+
+    :return: the state index
+    """
+    if self._index is None:
+      self._index = StateIndex(self.position, build_transitions=False)
+    return self._index
+
+  def __iter__(self) -> Iterator[np.ndarray]:
+    """
+    Read the file one chunk at a time. Each chunk only contains whole games.
+
+    :return: an iterator over structured arrays of records (with dtype RECORD_DTYPE)
+    """
+    with open(self.filename, 'rb') as f:
+      self._read_header(f)
+      while True:
+        chunk_header = f.read(_CHUNK_HEADER.size)
+        if len(chunk_header) < _CHUNK_HEADER.size:
+          return
+        num_records, num_bytes = _CHUNK_HEADER.unpack(chunk_header)
+        columns = zlib.decompress(f.read(num_bytes))
+        chunk = np.empty(num_records, dtype=RECORD_DTYPE)
+        offset = 0
+        for name in RECORD_DTYPE.names:
+          column_bytes = num_records * RECORD_DTYPE[name].itemsize
+          chunk[name] = np.frombuffer(columns, dtype=RECORD_DTYPE[name], count=num_records, offset=offset)
+          offset += column_bytes
+        yield chunk
+
+  def read_all(self, max_records: Optional[int] = None) -> np.ndarray:
+    """
+    Read the whole file (or its beginning) into a single array.
+
+    :param max_records: stop reading chunks once there are at least this many records
+    :return: a structured array of records (with dtype RECORD_DTYPE)
+    """
+    chunks = []
+    num_records = 0
+    for chunk in self:
+      chunks.append(chunk)
+      num_records += len(chunk)
+      if max_records is not None and num_records >= max_records:
+        break
+    return np.concatenate(chunks) if chunks else np.empty(0, dtype=RECORD_DTYPE)
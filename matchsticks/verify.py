@@ -0,0 +1,197 @@
+# (c) Nikolaus Howe 2021
+import argparse
+import json
+import os
+
+from multiprocessing import Pool
+from typing import Iterator, Optional
+
+from matchsticks.game import MAX_ROW_LENGTH, MAX_ROWS, game_from_position
+from matchsticks.player import PerfectPlayer
+from matchsticks.solver import get_children, predicts_win
+
+
+ENDINGS = {'misere': True, 'normal': False}
+
+
+def partitions(total: int, max_row: Optional[int] = None) -> Iterator[tuple[int, ...]]:
+  """
+  Find all the positions with a given number of sticks, in a fixed order.
+
+  :param total: the number of sticks
+  :param max_row: the largest row allowed (no limit if None)
+  :return: an iterator over the (sorted) positions
+  """
+  if total == 0:
+    yield ()
+    return
+  max_row = total if max_row is None else min(max_row, total)
+  for largest in range(max_row, 0, -1):
+    for rest in partitions(total - largest, largest):
+      yield rest + (largest,)
+
+
+def check_position(state: tuple[int, ...], misere: bool = True) -> list[dict]:
+  """
+  Check the nim sum rule (and PerfectPlayer's moves, for misère positions small enough to play)
+  on a position, against the result of searching one move ahead. The states one move ahead are
+  judged with the nim sum rule, so this is exact as long as the rule holds for every smaller position:
+  if every position up to some number of sticks passes, the rule holds for all of them (by induction),
+  and the smallest position which fails is a true counterexample.
+
+  :param state: the (sorted) position
+  :param misere: whether whoever crosses off the last stick loses (otherwise, they win)
+  :return: the counterexamples found (empty if the position passes)
+  """
+  ending = 'misere' if misere else 'normal'
+  counterexamples = []
+  wins = misere if not state else any(not predicts_win(child, misere) for child in get_children(state))
+  if predicts_win(state, misere) != wins:
+    counterexamples.append({'position': list(state), 'ending': ending, 'check': 'nim_rule', 'wins': wins})
+
+  if misere and state and state[-1] <= MAX_ROW_LENGTH and len(state) <= MAX_ROWS:
+    game = game_from_position(state)
+    winning_moves = PerfectPlayer().winning_moves(game)
+    if bool(winning_moves) != wins:
+      counterexamples.append({'position': list(state), 'ending': ending, 'check': 'perfect_player', 'wins': wins})
+    for move in winning_moves:
+      game.push(move)
+      if predicts_win(game.get_state(), misere):
+        counterexamples.append({'position': list(state), 'ending': ending, 'check': 'perfect_player',
+                                'wins': wins, 'move': list(move)})
+      game.pop()
+
+  return counterexamples
+
+
+def verify_shard(shard_i: int,
+                 num_shards: int,
+                 max_sticks: int,
+                 output_dir: str,
+                 endings: tuple[str, ...] = ('misere', 'normal')) -> dict:
+  """
+  Check every position in one shard, in order of number of sticks. A position belongs to shard i
+  if its place in the order of partitions (for its number of sticks) is i modulo num_shards.
+  Counterexamples are written to the shard's .jsonl file as soon as they're found, and progress is
+  saved after each number of sticks, so that a run which was stopped can carry on where it left off.
+
+  :param shard_i: which shard to check
+  :param num_shards: how many shards the positions are split into
+  :param max_sticks: check the positions with up to this many sticks
+  :param output_dir: where to write the shard's progress and counterexamples
+  :param endings: which endings to check ('misere' and/or 'normal')
+  :return: the shard's progress: the number of sticks it's done up to, and the number of positions and counterexamples
+  """
+  name = os.path.join(output_dir, f'shard-{shard_i:04d}-of-{num_shards:04d}')
+  progress_filename = name + '.json'
+  counterexamples_filename = name + '-counterexamples.jsonl'
+
+  progress = {'endings': list(endings), 'sticks_done': -1, 'positions': 0, 'counterexamples': 0,
+              'counterexamples_bytes': 0}
+  if os.path.exists(progress_filename):
+    with open(progress_filename) as f:
+      progress = json.load(f)
+    if progress['endings'] != list(endings):
+      raise ValueError(f"{output_dir} has results for the {progress['endings']} endings, not {list(endings)}")
+
+  with open(counterexamples_filename, 'a+b') as counterexamples_file:
+    # Throw away anything written after the last save (from a number of sticks which wasn't finished)
+    counterexamples_file.seek(progress['counterexamples_bytes'])
+    counterexamples_file.truncate()
+    for total in range(progress['sticks_done'] + 1, max_sticks + 1):
+      for i, state in enumerate(partitions(total)):
+        if i % num_shards != shard_i:
+          continue
+        progress['positions'] += 1
+        for ending in endings:
+          for counterexample in check_position(state, ENDINGS[ending]):
+            line = json.dumps(counterexample)
+            print(line, flush=True)
+            counterexamples_file.write(line.encode() + b'\n')
+            counterexamples_file.flush()
+            progress['counterexamples'] += 1
+
+      progress['sticks_done'] = total
+      progress['counterexamples_bytes'] = counterexamples_file.tell()
+      with open(progress_filename + '.tmp', 'w') as f:
+        json.dump(progress, f)
+      os.replace(progress_filename + '.tmp', progress_filename)
+
+  return progress
+
+
+def _verify_shard(args: tuple[int, int, int, str, tuple[str, ...]]) -> dict:
+  return verify_shard(*args)
+
+
+def verify(max_sticks: int,
+           output_dir: str,
+           num_workers: int = 1,
+           num_shards: Optional[int] = None,
+           endings: tuple[str, ...] = ('misere', 'normal')) -> dict:
+  """
+  Check the nim sum rule on every position with up to max_sticks sticks, split into shards which are
+  checked in parallel. Running it again with the same output directory and number of shards carries on
+  from where it left off (so max_sticks can also be raised, to check bigger positions later).
+
+  :param max_sticks: check the positions with up to this many sticks
+  :param output_dir: where to write the progress and counterexamples of each shard
+  :param num_workers: how many processes to check the shards with
+  :param num_shards: how many shards to split the positions into (num_workers if not given)
+  :param endings: which endings to check ('misere' and/or 'normal')
+  :return: the number of positions checked, and the counterexamples (smallest first)
+  """
+  for ending in endings:
+    if ending not in ENDINGS:
+      raise ValueError(f"Unknown ending '{ending}' (it should be one of {list(ENDINGS)})")
+  num_shards = num_workers if num_shards is None else num_shards
+  os.makedirs(output_dir, exist_ok=True)
+
+  jobs = [(shard_i, num_shards, max_sticks, output_dir, tuple(endings)) for shard_i in range(num_shards)]
+  if num_workers > 1:
+    with Pool(num_workers) as pool:
+      shards = pool.map(_verify_shard, jobs)
+  else:
+    shards = list(map(_verify_shard, jobs))
+
+  counterexamples = []
+  for shard_i in range(num_shards):
+    filename = os.path.join(output_dir, f'shard-{shard_i:04d}-of-{num_shards:04d}-counterexamples.jsonl')
+    with open(filename) as f:
+      counterexamples += [json.loads(line) for line in f]
+  counterexamples.sort(key=lambda c: (sum(c['position']), c['position']))
+
+  return {
+    'max_sticks': max_sticks,
+    'positions': sum(shard['positions'] for shard in shards),
+    'counterexamples': counterexamples,
+  }
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+  """
+  Run the verifier from the command line.
+
+  :param argv: the command line arguments (without the program name)
+  :return:
+  """
+  parser = argparse.ArgumentParser(prog='matchsticks verify',
+                                   description='Check the nim sum rule on every position up to a number of sticks.')
+  parser.add_argument('--max-sticks', type=int, default=30, help='check the positions with up to this many sticks')
+  parser.add_argument('--output', default='verify_results', help='where to write progress and counterexamples')
+  parser.add_argument('--workers', type=int, default=os.cpu_count(), help='how many processes to use')
+  parser.add_argument('--shards', type=int, default=None, help='how many shards to split the positions into')
+  parser.add_argument('--ending', choices=['misere', 'normal', 'both'], default='both', help='which endings to check')
+  args = parser.parse_args(argv)
+
+  endings = ('misere', 'normal') if args.ending == 'both' else (args.ending,)
+  results = verify(args.max_sticks, args.output, args.workers, args.shards, endings)
+  print(json.dumps({'max_sticks': results['max_sticks'],
+                    'positions': results['positions'],
+                    'num_counterexamples': len(results['counterexamples']),
+                    'smallest_counterexample': results['counterexamples'][0] if results['counterexamples'] else None},
+                   indent=2))
+
+
+if __name__ == '__main__':
+  main()
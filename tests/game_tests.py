@@ -1,12 +1,50 @@
 # (c) Nikolaus Howe 2021
+import asyncio
+import contextlib
+import io
+import json
+import os
+import queue
+import random
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
+import unittest.mock
+import numpy as np
 import PySimpleGUI as sg
 
-from matchsticks.game import Game
-from matchsticks.player import TrivialPlayer, RandomPlayer, MCPlayer, PretrainedPlayer
-from matchsticks.game_graphics.game_window import GameWindow
-from matchsticks.arena import Arena
+import matchsticks.game as game_module
+from matchsticks.game import Game, check_hash, state_hash
+from matchsticks.game_record import GameRecord, GameRecordReader, GameRecordWriter
+from matchsticks.player import AfterstateValuePlayer, AnytimePlayer, BookPlayer, CachedPlayer, CalibratedPlayer, PerfectPlayer, TrivialPlayer, RandomPlayer, MCPlayer, PretrainedPlayer, \
+  PretrainedAfterstatePlayer, create_player
+from matchsticks.game_graphics.events import RecordingEventSource, ReplayEventSource, drag_events, load_events
+from matchsticks.game_graphics.game_window import COMPUTER_MOVE_EVENT, GameWindow
+from matchsticks.game_graphics.input_stress import run_stress
+from matchsticks.game_graphics.opponent_pool import OpponentPool
+from matchsticks.game_graphics.surface import RecordingSurface
+from matchsticks.arena import Arena, VisualArena
+from matchsticks.async_arena import AsyncArena, AsyncPlayer, play_games
+from matchsticks.batch_dojo import BatchDojo, batch_ema_update, scatter_ema_update
+from matchsticks.calibration import calibrate_blunder_rate, get_win_rate
+from matchsticks.cli import main
+from matchsticks.clock import Clock
 from matchsticks.dojo import Dojo
+from matchsticks.move_cache import MoveCache
+from matchsticks.move_client import AsyncMoveClient, run_load
+from matchsticks.offline import fit_q_table, train_player
+from matchsticks.opening_book import OpeningBook, get_default_book
+from matchsticks.q_store import QStore
+from matchsticks.selfplay import selfplay, shard_filename
+from matchsticks.server import MoveServer
+from matchsticks.solver import predicts_win, solve
+from matchsticks.state_space import StateIndex, count_bounded_states, count_states, enumerate_bounded_states, \
+  enumerate_states, id_to_move, rank, unrank
+from matchsticks.trajectories import TrajectoryReader, TrajectoryWriter
+from matchsticks.verify import check_position, partitions, verify
+from matchsticks.utils import BackButtonException, ClosedWindowException, check_intersection, get_nim_sum
 
 
 class TestGameBasics(unittest.TestCase):
@@ -55,6 +93,60 @@ class TestGameBasics(unittest.TestCase):
     self.assertEqual(still_going, False)
     self.assertEqual(g5.get_state(), ())
 
+  def test_hash(self):
+    # The hash is kept up to date as moves are played, and doesn't depend on how the state was reached
+    g1 = Game()
+    g1.play_move((4, 3, 5))  # [1, 3, 5, 7] -> [1, 2, 2, 3, 5]
+    g2 = Game()
+    g2.play_move((3, 3, 3))  # [1, 3, 5, 7] -> [1, 2, 2, 3, 7]
+    g2.play_move((5, 6, 7))  # -> [1, 2, 2, 3, 5]
+    self.assertEqual(g1.get_state(), g2.get_state())
+    self.assertEqual(g1.get_hash(), g2.get_hash())
+
+    # Every reachable state has a different hash
+    states = enumerate_states([1, 3, 5, 7])
+    self.assertEqual(len({state_hash(state) for state in states}), len(states))
+
+  def test_push_pop(self):
+    g1 = Game()
+    game_module.CHECK_HASHES = True
+    try:
+      history = [(g1.get_state(), g1.get_hash(), g1.get_nim_sum())]
+      while g1.is_still_on():
+        g1.push(random.choice(g1.get_allowed()))
+        history.append((g1.get_state(), g1.get_hash(), g1.get_nim_sum()))
+        self.assertEqual(g1.get_nim_sum(), get_nim_sum(g1.get_state()))
+      self.assertEqual(g1.get_num_moves_played(), len(history) - 1)
+
+      # Taking back every move goes back through exactly the same states
+      while g1.get_num_moves_played():
+        history.pop()
+        move = g1.pop()
+        self.assertEqual((g1.get_state(), g1.get_hash(), g1.get_nim_sum()), history[-1])
+        self.assertTrue(g1.is_allowed(move))
+    finally:
+      game_module.CHECK_HASHES = False
+    self.assertEqual(g1.get_state(), (1, 3, 5, 7))
+    with self.assertRaises(Exception):
+      g1.pop()
+
+    # The move which is taken back is the one which was played
+    g2 = Game()
+    g2.push((4, 2, 3))
+    self.assertEqual(g2.get_state(), (1, 1, 3, 4, 5))
+    self.assertEqual(g2.pop(), (4, 2, 3))
+
+  def test_hash_checks(self):
+    game_module.CHECK_HASHES = True
+    try:
+      g1 = Game()
+      while g1.is_still_on():
+        g1.play_move(random.choice(g1.get_allowed()))
+      with self.assertRaises(Exception):
+        check_hash(g1.get_hash() ^ 1, g1.get_state())
+    finally:
+      game_module.CHECK_HASHES = False
+
 
 class TestPlayer(unittest.TestCase):
   def test_simple_player(self):
@@ -96,6 +188,57 @@ class TestPlayer(unittest.TestCase):
     is_best_move_2 = player_move == (1, 2, 4)
     self.assertTrue(is_best_move_1 or is_best_move_2)
 
+  def test_afterstate_agent(self):
+    p1 = AfterstateValuePlayer('Alice')
+    p2 = RandomPlayer()
+    d1 = Dojo(p1, p2)
+    d1.train_players(num_games=5_000, num_layers=2)
+
+    # There is one value per afterstate, rather than one per state and move
+    self.assertEqual(len(p1.Q), 0)
+    self.assertIn((1,), p1.V)
+
+    p1.eps = 0
+    g1 = Game(2)
+    self.assertEqual(p1.move(g1), (2, 1, 3))
+
+    # The V table can be saved, and loaded by a player which doesn't learn (but not as a Q-table)
+    filename = os.path.join(tempfile.mkdtemp(), 'afterstate.player')
+    with unittest.mock.patch('sys.stdout'):
+      p1.save_q(filename)
+      with self.assertRaises(SystemExit):
+        PretrainedPlayer(filename)
+    p2 = create_player(f'afterstate:{filename}')
+    self.assertIsInstance(p2, PretrainedAfterstatePlayer)
+    self.assertEqual(p2.move(g1), (2, 1, 3))
+
+  def test_batch_dojo(self):
+    p1 = MCPlayer('Alice')
+    p2 = RandomPlayer()
+    d1 = BatchDojo(p1, p2, seed=0)
+    d1.drill_position(num_games=50_000, position=[4])
+
+    g1 = Game()
+    g1.reset([4])
+    p1.eps = 0
+    player_move = p1.move(g1)
+    self.assertIn(player_move, [(1, 1, 3), (1, 2, 4)])
+
+    # Every Q row the batch dojo writes has a value for each allowed move
+    self.assertEqual(len(p1.Q[(4,)]), 10)
+
+    # Updating only the entries which got returns agrees with updating the whole array
+    rng = np.random.default_rng(0)
+    entries = (rng.integers(0, 2, 100), rng.integers(0, 5, 100), rng.integers(0, 3, 100))
+    returns = rng.normal(size=100)
+    q1, q2 = np.full((2, 5, 3), 0.1), np.full((2, 5, 3), 0.1)
+    sums, counts = np.zeros_like(q1), np.zeros_like(q1)
+    np.add.at(sums, entries, returns)
+    np.add.at(counts, entries, 1.)
+    batch_ema_update(q1, sums, counts)
+    scatter_ema_update(q2, entries, returns)
+    self.assertTrue(np.allclose(q1, q2))
+
   def test_save_and_load(self):
     p1 = MCPlayer('Alice')
     d1 = Dojo(p1)
@@ -104,6 +247,208 @@ class TestPlayer(unittest.TestCase):
     p2 = PretrainedPlayer(p1.name)
     self.assertEqual(p1.Q, p2.Q)
 
+  def test_perfect_player(self):
+    g1 = Game()
+    g1.reset([1, 2, 3])  # nim sum of 0, so every move loses
+    self.assertIsNone(PerfectPlayer().optimal_move(g1))
+    self.assertEqual(PerfectPlayer().best_moves(g1), g1.get_allowed())  # Every move is as bad as any other
+
+    g2 = Game()
+    g2.reset([1, 1, 2])  # the winning move leaves an odd number of single sticks
+    self.assertIn(PerfectPlayer().optimal_move(g2), [(3, 1, 1), (3, 2, 2)])
+
+    g3 = Game()
+    g3.reset([1, 1, 1])  # whoever moves here crosses off the last stick
+    self.assertIsNone(PerfectPlayer().optimal_move(g3))
+    g3.reset([1, 1])
+    self.assertIsNotNone(PerfectPlayer().optimal_move(g3))
+
+  def test_calibrated_player(self):
+    perfect_win_rate = get_win_rate(CalibratedPlayer(0.), RandomPlayer(), num_layers=3, num_games=200)
+    random_win_rate = get_win_rate(CalibratedPlayer(1.), RandomPlayer(), num_layers=3, num_games=200)
+    self.assertGreater(perfect_win_rate, random_win_rate)
+
+    blunder_rate = calibrate_blunder_rate(0.75, num_layers=3, num_games=500, tolerance=0.05)
+    self.assertTrue(0. < blunder_rate < 1.)
+
+  def test_cached_player(self):
+    cache = MoveCache(max_size=1_000)
+    cached = CachedPlayer(PerfectPlayer(), cache)
+    self.assertEqual(get_win_rate(cached, PerfectPlayer(), num_layers=3, num_games=100), 0.5)
+    self.assertGreater(get_win_rate(cached, RandomPlayer(), num_layers=3, num_games=100), 0.9)
+    self.assertGreater(cache.stats()['hit_rate'], 0.5)
+
+    # Another perfect player can share the cache, but a learning player can't use one
+    g1 = Game()
+    g1.reset([1, 1, 2])
+    hits = cache.hits
+    self.assertIn(CachedPlayer(PerfectPlayer(), cache).move(g1), [(3, 1, 1), (3, 2, 2)])
+    self.assertEqual(cache.hits, hits + 1)
+    with self.assertRaises(ValueError):
+      CachedPlayer(MCPlayer(), cache)
+
+  def test_opening_book(self):
+    book = OpeningBook.build(max_layers=4, plies=2)
+    filename = os.path.join(tempfile.mkdtemp(), 'book.json')
+    book.save(filename)
+    self.assertEqual(OpeningBook.load(filename).positions, book.positions)
+
+    # The values and best moves agree with searching the whole game tree
+    table = {}
+    for state, (value, moves) in book.positions.items():
+      self.assertEqual(value == 1, solve(state, table=table))
+      for move in moves:
+        g1 = Game()
+        g1.reset(state)
+        g1.play_move(move)
+        self.assertEqual(value == 1, not solve(g1.get_state(), table=table))
+
+    # The book which comes with the game covers the first two moves of every standard game
+    default_book = get_default_book()
+    for num_layers in range(1, 9):
+      g1 = Game(num_layers)
+      self.assertIn(g1.get_state(), default_book)
+      if g1.play_move(random.choice(g1.get_allowed())):
+        self.assertIn(g1.get_state(), default_book)
+
+    # A book player plays from the book while it can, and then plays like the player it wraps
+    player = BookPlayer(TrivialPlayer(), book)
+    g1 = Game(3)
+    self.assertIn(player.move(g1), book.lookup((1, 3, 5)))
+    g1.reset([3, 4, 5])
+    self.assertEqual(player.move(g1), (1, 1, 1))
+    self.assertIsNone(player.cache_key())
+    self.assertEqual(BookPlayer(PerfectPlayer(), book).cache_key(), 'book+perfect')
+
+    # Out of the book, a wrapped player which doesn't rank its moves counts them all as best
+    self.assertEqual(BookPlayer(RandomPlayer(), book).best_moves(g1), g1.get_allowed())
+
+  def test_q_store(self):
+    directory = tempfile.mkdtemp()
+    store = QStore(max_states=4, spill_filename=os.path.join(directory, 'spill.db'), evict_fraction=0.5)
+    for state in [(1,), (2,), (3,), (4,)]:
+      store[state] = {(1, 1, 1): 0.1}
+    for _ in range(3):
+      store[(1,)], store[(2,)]
+    store[(3,)][(1, 1, 1)] = 0.5
+    store[(5,)] = {(1, 1, 1): 0.1}  # Evicts the two states visited least often (but not the new one)
+    self.assertEqual(store.stats()['in_memory'], 3)
+    self.assertEqual(store.stats()['spilled'], 2)
+    self.assertEqual(len(store), 5)
+    self.assertIn((3,), store)
+    self.assertEqual(store[(3,)], {(1, 1, 1): 0.5})  # Brought back from disk, with its changes
+    self.assertEqual(dict(store.items()), {(n,): {(1, 1, 1): 0.5 if n == 3 else 0.1} for n in range(1, 6)})
+    self.assertEqual(store.stats()['disk_hits'], 1)
+    self.assertEqual(store.stats()['spills'], 2)
+    store.close()
+
+    # Without a spill file, evicted states are forgotten
+    store = QStore(max_states=2, evict_fraction=0.5, policy='lru')
+    for state in [(1,), (2,), (3,)]:
+      store[state] = {}
+    self.assertNotIn((1,), store)
+    self.assertIsNone(store.get((1,)))
+    self.assertEqual(store.stats()['evictions'], 1)
+    self.assertEqual(store.stats()['misses'], 1)
+
+    # A learning player can train with a bounded Q-table, and save all of it
+    p1 = MCPlayer('Alice', q_store=QStore(max_states=10, spill_filename=os.path.join(directory, 'q.db')))
+    Dojo(p1, RandomPlayer()).drill_position(500, [1, 3, 5])
+    self.assertLessEqual(p1.Q.stats()['in_memory'], 10)
+    self.assertGreater(p1.Q.stats()['spilled'], 0)
+    filename = os.path.join(directory, 'q.player')
+    stats = p1.Q.stats()
+    p1.save_q(filename)
+    self.assertEqual(p1.Q.stats(), stats)  # Saving doesn't bring the spilled states back into memory
+    self.assertEqual(PretrainedPlayer(filename).Q, dict(p1.Q.items()))
+    p1.Q.close()
+
+  def test_move_cache(self):
+    cache = MoveCache(max_size=2)
+    cache.put('a', (1,))
+    cache.put('b', (2,))
+    self.assertEqual(cache.get('a'), (1,))
+    cache.put('c', (3,))  # 'b' is the least recently used, so it's thrown away
+    self.assertIsNone(cache.get('b'))
+    self.assertEqual(cache.stats(), {'size': 2, 'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    with tempfile.TemporaryDirectory() as directory:
+      filename = os.path.join(directory, 'moves.cache')
+      cache.save(filename)
+      loaded = MoveCache(max_size=2, filename=filename)
+      self.assertEqual(loaded.get('a'), (1,))
+      self.assertEqual(loaded.get('c'), (3,))
+
+
+class TestSolver(unittest.TestCase):
+  def test_nim_rule_small_positions(self):
+    for misere in [True, False]:
+      table = {}
+      for total in range(13):
+        for position in partitions(total):
+          self.assertEqual(solve(position, misere, table), predicts_win(position, misere), (position, misere))
+
+  def test_verify_resumes(self):
+    with tempfile.TemporaryDirectory() as directory:
+      results = verify(8, directory, num_shards=3)
+      self.assertEqual(results['positions'], 1 + 1 + 2 + 3 + 5 + 7 + 11 + 15 + 22)
+      self.assertEqual(results['counterexamples'], [])
+
+      # Carrying on to bigger positions only checks the new ones
+      results = verify(10, directory, num_shards=3)
+      self.assertEqual(results['positions'], 67 + 30 + 42)
+
+      with self.assertRaises(ValueError):
+        verify(10, directory, num_shards=3, endings=('normal',))
+
+  def test_verify_finds_counterexamples(self):
+    # Check the misère rule against the normal ending, where it's wrong once the rows all have a single stick
+    def misere_rule(state, misere):
+      return predicts_win(state, True)
+
+    with unittest.mock.patch('matchsticks.verify.predicts_win', misere_rule):
+      self.assertEqual(check_position((1, 2), misere=False), [])
+      with tempfile.TemporaryDirectory() as directory:
+        counterexamples = verify(3, directory, endings=('normal',))['counterexamples']
+    self.assertEqual(counterexamples[0], {'position': [], 'ending': 'normal', 'check': 'nim_rule', 'wins': False})
+
+
+class TestOpponentPool(unittest.TestCase):
+  def test_opponents_are_made_once(self):
+    pool = OpponentPool()
+    pool.preload(background=True).join()
+    self.assertIs(pool.get('Hard'), pool.get('Hard'))
+    self.assertIsInstance(pool.get('Perfect'), BookPlayer)
+    self.assertIsInstance(pool.get('Perfect').player, PerfectPlayer)
+    with self.assertRaises(ValueError):
+      pool.get('Impossible')
+
+  def test_q_tables_are_shared(self):
+    p1 = MCPlayer('Bob')
+    Dojo(p1).train_players(num_games=100, num_layers=2)
+    p1.save_q()
+    p2 = PretrainedPlayer(p1.name)
+    p3 = PretrainedPlayer(p1.name)
+    self.assertIs(p2.Q, p3.Q)
+
+    # Playing from a position which isn't in the table doesn't change it
+    num_states = len(p2.Q)
+    g1 = Game()
+    g1.reset([2, 2, 2])
+    self.assertTrue(g1.is_allowed(p2.move(g1)))
+    self.assertEqual(len(p2.Q), num_states)
+    os.remove(p1.name)
+
+
+class SearchingPlayer(AnytimePlayer):
+  safety_margin = 0.02
+
+  def improve_move(self, game):
+    # Keep finding "better" moves (each one after a short think) until told to stop
+    while True:
+      time.sleep(0.002)
+      yield random.choice(game.get_allowed())
+
 
 class TestArena(unittest.TestCase):
   def test_trivial_game(self):
@@ -130,17 +475,447 @@ class TestArena(unittest.TestCase):
     a3.play()
     self.assertEqual(g3.get_state(), ())
 
+  def test_lost_on_time(self):
+    slow = SlowPlayer("SlowAlice")
+    fast = TrivialPlayer("TrivialBob")
+    output = io.StringIO()
+    recorder = GameRecordWriter(output, binary=False)
+    a4 = Arena(Game(), slow, fast, silent=True, clock=Clock(move_time=0.05), recorder=recorder)
+    a4.play()
+    self.assertIs(a4.lost_on_time, slow)
+    self.assertIs(a4.winner, fast)
+    self.assertEqual(Game().get_state(), a4.game.get_state())
+
+    # The game is recorded even though it ended before the first move
+    self.assertEqual(GameRecord.from_text(output.getvalue()), GameRecord([1, 3, 5, 7], [], winner=1))
+
+  def test_anytime_player(self):
+    clock = Clock(move_time=0.1)
+    searcher = SearchingPlayer("Searcher")
+    a5 = Arena(Game(), searcher, RandomPlayer("RandomBob"), silent=True, clock=clock)
+    a5.play()
+    self.assertIsNone(a5.lost_on_time)
+    self.assertEqual(a5.game.get_state(), ())
+
+    summary = clock.summary()
+    self.assertEqual(set(summary), {"Searcher", "RandomBob"})
+    self.assertLess(summary["Searcher"]["max"], 0.1)
+    self.assertGreater(summary["Searcher"]["mean"], 0.05)
+
+
+class TestStateSpace(unittest.TestCase):
+  def test_rank_unrank(self):
+    states = enumerate_bounded_states(max_row=5, max_rows=4)
+    self.assertEqual(len(states), count_bounded_states(max_row=5, max_rows=4))
+    self.assertEqual(len(set(states)), len(states))
+    for r, state in enumerate(states):
+      self.assertEqual(rank(state, max_row=5), r)
+      self.assertEqual(unrank(r, max_row=5), state)
+
+    # Ranks don't depend on the number of rows allowed, so states with fewer rows come first
+    self.assertEqual(states[:count_bounded_states(max_row=5, max_rows=2)], enumerate_bounded_states(5, 2))
+    with self.assertRaises(ValueError):
+      rank((2, 6), max_row=5)
+
+  def test_state_index(self):
+    self.assertEqual([count_states(n) for n in range(1, 5)], [2, 8, 47, 333])
+    index = StateIndex([1, 3, 5])
+    self.assertEqual(index.get_state(index.start_id), (1, 3, 5))
+    self.assertEqual(index.get_state(index.end_id), ())
+    self.assertNotIn((2, 3, 5), index)
+    for s, state in enumerate(index.states):
+      self.assertEqual(index.get_id(state), s)
+      g1 = Game(3)
+      g1.reset(state)
+      for m, move in enumerate(index.get_moves(s)):
+        g1.push(move)
+        self.assertEqual(index.transitions[s, m], index.get_id(g1.get_state()))
+        g1.pop()
+
+
+class TestTrajectories(unittest.TestCase):
+  def test_record_and_read(self):
+    filename = os.path.join(tempfile.mkdtemp(), 'games.traj')
+    with TrajectoryWriter(filename, (1, 3, 5), chunk_size=100) as recorder:
+      d1 = Dojo(RandomPlayer(), MCPlayer(), recorder=recorder)
+      d1.train_players(num_games=50, num_layers=3)
+
+    reader = TrajectoryReader(filename)
+    self.assertEqual(reader.position, (1, 3, 5))
+    records = reader.read_all()
+    self.assertEqual(len(set(records['game'])), 50)
+    self.assertGreater(len(list(reader)), 1)
+
+    # Each game has one winning and one losing move, and the first move is from the starting position
+    self.assertEqual((records['reward'] == 1).sum(), 50)
+    self.assertEqual((records['reward'] == -1).sum(), 50)
+    first_move = records[0]
+    state = reader.index.get_state(first_move['state'])
+    self.assertEqual(state, (1, 3, 5))
+    self.assertTrue(Game(3).is_allowed(id_to_move(state, first_move['move'])))
+
+  def test_offline_training(self):
+    directory = tempfile.mkdtemp()
+    filenames = [os.path.join(directory, f'shard_{i}.traj') for i in range(2)]
+    for filename in filenames:
+      with TrajectoryWriter(filename, [4], chunk_size=500) as recorder:
+        for _ in range(2_000):
+          g1 = Game(3)
+          g1.reset([4])
+          Arena(g1, RandomPlayer(), RandomPlayer(), silent=True, recorder=recorder).play()
+
+    # Reading the shards in parallel gives the same result as reading them one by one
+    p1 = MCPlayer('Alice')
+    train_player(p1, filenames)
+    self.assertEqual(p1.Q, fit_q_table(filenames, num_workers=2))
+
+    g1 = Game(3)
+    g1.reset([4])
+    p1.eps = 0
+    self.assertIn(p1.move(g1), [(1, 1, 3), (1, 2, 4)])
+
+
+class TestSelfplay(unittest.TestCase):
+  def test_selfplay(self):
+    directories = [tempfile.mkdtemp() for _ in range(2)]
+    for directory, num_workers in zip(directories, [1, 2]):
+      results = selfplay(301, directory, (1, 3, 5), ('random', 'perfect'), num_workers=num_workers, num_shards=2, seed=3)
+      self.assertEqual(results['games'], 301)
+      self.assertEqual([shard['games'] for shard in results['shards']], [151, 150])
+
+    # The shards hold all the games, and they're the same however many workers played them
+    records = [TrajectoryReader(shard_filename(directories[0], shard_i, 2)).read_all() for shard_i in range(2)]
+    self.assertEqual(sum(len(set(r['game'])) for r in records), 301)
+    self.assertEqual(sum(len(r) for r in records), results['records'])
+    for shard_i in range(2):
+      with open(shard_filename(directories[0], shard_i, 2), 'rb') as f1, \
+           open(shard_filename(directories[1], shard_i, 2), 'rb') as f2:
+        self.assertEqual(f1.read(), f2.read())
+    with self.assertRaises(ValueError):
+      selfplay(10, directories[0], player_types=('random', 'nobody'))
+
+
+class TestGameRecords(unittest.TestCase):
+  def test_formats(self):
+    record = GameRecord([7, 1, 5, 3], [(4, 2, 4), (5, 1, 5)], 1)
+    self.assertEqual(record.to_text(), '1 3 5 7 | 4:2-4 5:1-5 | 1')
+    self.assertEqual(GameRecord.from_text(record.to_text()), record)
+    self.assertEqual(GameRecord.unpack(record.pack()), (record, 12))
+    self.assertEqual(list(record.states()), [(1, 3, 5, 7), (1, 1, 3, 3, 5), (1, 1, 3, 3)])
+    with self.assertRaises(ValueError):
+      GameRecord.from_text('1 3 5 7 | 4:2')
+    with self.assertRaises(ValueError):
+      list(GameRecord([1, 3], [(2, 2, 4)]).states())
+
+  def test_record_arena_games(self):
+    directory = tempfile.mkdtemp()
+    for binary in [True, False]:
+      filename = os.path.join(directory, 'games.bin' if binary else 'games.txt')
+      with GameRecordWriter(filename, binary=binary, chunk_size=30) as recorder:
+        for _ in range(100):
+          a1 = Arena(Game(3), RandomPlayer(), PerfectPlayer(), silent=True, recorder=recorder)
+          a1.play()
+      records = list(GameRecordReader(filename))
+      self.assertEqual(len(records), 100)
+
+      # The records play back to the end of the game, and say who won
+      for record in records:
+        self.assertEqual(record.position, (1, 3, 5))
+        self.assertEqual(list(record.states())[-1], ())
+        self.assertEqual(record.winner, len(record.moves) % 2)
+      self.assertGreater(sum(record.winner for record in records), 90)
+
+  def test_abandoned_games_are_not_recorded(self):
+    directory = tempfile.mkdtemp()
+    game_records = GameRecordWriter(os.path.join(directory, 'games.txt'), binary=False)
+    trajectories = TrajectoryWriter(os.path.join(directory, 'games.traj'), (1, 3, 5))
+    for recorder in [game_records, trajectories]:
+      gw = GameWindow(game=Game(3), window=FakeWindow())
+      gw.draw()
+      a1 = VisualArena(gw.game, RandomPlayer(), RandomPlayer(), gw, recorder=recorder)
+      with unittest.mock.patch.object(gw, 'get_computer_move', side_effect=[(3, 1, 1), BackButtonException]), \
+           unittest.mock.patch('sys.stdout'):
+        with self.assertRaises(BackButtonException):
+          a1.play()
+      Arena(Game(3), TrivialPlayer(), TrivialPlayer(), silent=True, recorder=recorder).play()
+      recorder.close()
+    records = list(GameRecordReader(os.path.join(directory, 'games.txt')))
+    self.assertEqual([len(record.moves) for record in records], [9])
+    self.assertEqual(records[0].moves[0], (1, 1, 1))
+    self.assertEqual(len(TrajectoryReader(os.path.join(directory, 'games.traj')).read_all()), 9)
+
+
+class FakeCanvas(object):
+  def __init__(self):
+    self.items = {}
+
+  def itemconfig(self, figure, fill):
+    self.items[figure] = fill
+
+
+class FakeGraph(object):
+  """
+  Stands in for a PySimpleGUI graph, so that drawing logic can be tested without a display.
+  """
+  CanvasSize = (500, 500)
+
+  def __init__(self):
+    self.TKCanvas = FakeCanvas()
+
+  def draw_line(self, point_from, point_to, color, width):
+    figure = len(self.TKCanvas.items) + 1
+    self.TKCanvas.items[figure] = color
+    return figure
+
+  def delete_figure(self, figure):
+    del self.TKCanvas.items[figure]
+
+
+class FakeWindow(object):
+  """
+  Stands in for a PySimpleGUI window, so that drawing logic can be tested without a display.
+  """
+  def __init__(self):
+    self.graph = FakeGraph()
+    self.events = queue.Queue()
+
+  def __getitem__(self, key):
+    return self.graph
+
+  def refresh(self):
+    pass
+
+  def read(self, timeout=None):
+    try:
+      return self.events.get(timeout=None if timeout is None else timeout / 1000)
+    except queue.Empty:
+      return sg.TIMEOUT_KEY, {}
+
+  def write_event_value(self, key, value):
+    self.events.put((key, {key: value}))
+
+
+class TestPyramid(unittest.TestCase):
+  def test_stick_index(self):
+    gw = GameWindow(game=Game(6), window=FakeWindow())
+    gw.draw()
+    gw.draw_move((6, 3, 5))
+    gw.pyramid.adjust((6, 3, 5))
+
+    # The index finds the same sticks as checking every stick
+    all_sticks = [stick for band in gw.pyramid.index.band_sticks for stick in band]
+    random.seed(0)
+    for _ in range(2_000):
+      line = ((random.uniform(0, 500), random.uniform(0, 500)), (random.uniform(0, 500), random.uniform(0, 500)))
+      expected = [stick for stick in all_sticks if check_intersection(stick.line, line)]
+      self.assertEqual(gw.pyramid.index.query(line), expected)
+
+    # A line across part of the right-hand piece of the bottom row (which is now the fifth row)
+    bottom = gw.pyramid.index.band_v_positions[-1]
+    crossed = gw.pyramid.check_intersections(((260, bottom), (340, bottom + 5)))
+    self.assertEqual([(stick.layer, stick.idx) for stick in crossed], [(5, 2), (5, 3), (5, 4)])
+
+    # Lines which cross a crossed-off stick, or two rows, aren't allowed
+    crossed_off = gw.pyramid.inactive_sticks[0]
+    self.assertEqual(gw.pyramid.check_intersections(((crossed_off.h_pos - 5, crossed_off.v_pos),
+                                                     (crossed_off.h_pos + 5, crossed_off.v_pos))), [])
+    second_row, third_row = gw.pyramid.index.band_v_positions[1:3]
+    self.assertEqual(gw.pyramid.check_intersections(((250, second_row), (275, third_row))), [])
+
+  def test_adjust_follows_game(self):
+    g1 = Game(8)
+    gw = GameWindow(game=g1, window=FakeWindow())
+    random.seed(0)
+    while g1.is_still_on():
+      move = random.choice(g1.get_allowed())
+      gw.pyramid.adjust(move)
+      g1.play_move(move)
+      self.assertEqual(tuple(len(row) for row in gw.pyramid.rows), g1.get_state())
+      for layer, row in enumerate(gw.pyramid.rows):
+        self.assertEqual([(stick.layer, stick.idx) for stick in row.matchsticks],
+                         [(layer + 1, idx + 1) for idx in range(len(row))])
+    self.assertEqual(gw.pyramid.rows, [])
+
+    # The views don't carry their own dicts
+    self.assertFalse(hasattr(gw.pyramid.sticks[0], '__dict__'))
+
+
+class TestIncrementalDrawing(unittest.TestCase):
+  def test_sticks_are_recoloured_in_place(self):
+    window = FakeWindow()
+    gw = GameWindow(game=Game(4), window=window)
+    gw.draw()
+    self.assertEqual(len(window.graph.TKCanvas.items), 16)
+
+    # A move adds one crossing line, and recolours the crossed-off sticks
+    gw.draw_move((4, 2, 4))
+    gw.pyramid.adjust((4, 2, 4))
+    self.assertEqual(len(window.graph.TKCanvas.items), 17)
+    self.assertEqual(list(window.graph.TKCanvas.items.values()).count('red'), 4)
+
+    # Redrawing doesn't add anything to the canvas
+    gw.draw()
+    self.assertEqual(len(window.graph.TKCanvas.items), 17)
+
+    gw.clear()
+    self.assertEqual(len(window.graph.TKCanvas.items), 0)
+
+
+class SlowPlayer(TrivialPlayer):
+  def move(self, game):
+    time.sleep(0.2)
+    return super().move(game)
+
+
+class TestComputerMoves(unittest.TestCase):
+  def test_background_move(self):
+    gw = GameWindow(game=Game(4), window=FakeWindow())
+    start_time = time.monotonic()
+    self.assertEqual(gw.get_computer_move(TrivialPlayer(), min_delay=0.1), (1, 1, 1))
+    self.assertGreaterEqual(time.monotonic() - start_time, 0.1)
+
+  def test_quit_while_thinking(self):
+    window = FakeWindow()
+    gw = GameWindow(game=Game(4), window=window)
+    window.write_event_value('back', None)
+    with self.assertRaises(BackButtonException):
+      gw.get_computer_move(SlowPlayer())
+
+    # The move which arrives after quitting is thrown away
+    time.sleep(0.3)
+    self.assertTrue(window.events.empty())
+
+    # A move which was posted just before quitting isn't taken for the next turn's move
+    window.write_event_value(COMPUTER_MOVE_EVENT, (object(), (4, 1, 7)))
+    self.assertEqual(gw.get_computer_move(TrivialPlayer(), min_delay=0), (1, 1, 1))
+
+
+class TestMoveServer(unittest.TestCase):
+  def test_batched_moves(self):
+    async def run():
+      server = MoveServer(port=0)
+      await server.start()
+      client = await AsyncMoveClient.connect(port=server.port)
+      moves = await client.get_moves([(1, 2, 2), (1, 3, 5)], player='perfect')
+      with self.assertRaises(ValueError):
+        await client.get_moves([()])
+      await client.close()
+      load = await run_load(port=server.port, num_requests=20, batch_size=4, num_connections=2)
+      server.server.close()
+      return moves, load, server.latencies.count
+
+    moves, load, num_served = asyncio.run(run())
+    self.assertEqual(moves[0], (1, 1, 1))
+    self.assertEqual(load['latency']['count'], 20)
+    self.assertEqual(num_served, 22)
+
+  def test_bad_requests(self):
+    server = MoveServer()
+    for request in [5, {'player': 5, 'states': [[1, 2]]}, {'states': [[1] * 70]}, {'states': [[20]]},
+                    {'states': [[0]]}, {'states': [[1.5]]}, {'states': 3}, {'player': 'mc', 'states': [[1, 2]]},
+                    {'player': 'book:mc', 'states': [[1, 2]]}]:
+      with unittest.mock.patch('sys.stdout') as stdout:
+        response = server.handle_request(request)
+      self.assertIn('error', response)
+      self.assertTrue(response['error'].partition(': ')[2])
+      self.assertFalse(stdout.write.called)
+    self.assertEqual(server.handle_request({'id': 1, 'states': [[1, 2, 2]]}), {'id': 1, 'moves': [[1, 1, 1]]})
+
+
+class TestCommandLine(unittest.TestCase):
+  def run_command(self, *args):
+    # Run in a new interpreter, to see which modules the command imports
+    code = ('import json, sys\n'
+            'from matchsticks.cli import main\n'
+            f'main({list(args)})\n'
+            'print(json.dumps("PySimpleGUI" in sys.modules))\n')
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    output, _, gui_imported = result.stdout.rstrip().rpartition('\n')
+    return json.loads(output), json.loads(gui_imported)
+
+  def test_headless_commands(self):
+    solved, gui_imported = self.run_command('solve', '1', '3', '5')
+    self.assertTrue(solved['wins'])
+    self.assertEqual(sorted(solved['winning_moves']), [[3, 1, 3], [3, 2, 2], [3, 3, 5], [3, 4, 4]])
+    self.assertFalse(gui_imported)
+
+    evaluated, gui_imported = self.run_command('eval', 'perfect', 'trivial', '--games', '20', '--seed', '0')
+    self.assertEqual(evaluated['win_rates']['perfect']['trivial'], 1.)
+    self.assertFalse(gui_imported)
+
+    benchmarked, gui_imported = self.run_command('bench', 'random', '--moves', '50', '--layers', '3')
+    self.assertEqual(benchmarked['players']['random']['latency']['count'], 50)
+    self.assertFalse(gui_imported)
+
+  def test_bad_arguments(self):
+    for argv, message in [(['solve', '0'], "isn't a valid position"),
+                          (['solve', '20'], 'is too big'),
+                          (['train', '--layers', '9'], 'between 1 and 8'),
+                          (['eval', 'nobody', 'random'], "'nobody' isn't a player"),
+                          (['eval', 'random', 'random'], 'only be given once'),
+                          (['train', '--learner', 'afterstate', '--max-states', '10'], 'only apply to the mc learner'),
+                          (['train', '--spill', 'spill.db'], '--spill needs --max-states'),
+                          (['bench', 'perfect', '--position', '20'], 'is too big'),
+                          (['eval', 'pretrained:no/such.player'], "couldn't load the player")]:
+      with unittest.mock.patch('sys.stderr') as stderr, unittest.mock.patch('sys.stdout'), \
+           self.assertRaises(SystemExit) as raised:
+        main(argv)
+      self.assertEqual(raised.exception.code, 2)
+      self.assertIn(message, ''.join(call.args[0] for call in stderr.write.call_args_list))
+
+  def test_train(self):
+    filename = os.path.join(tempfile.mkdtemp(), 'trained.player')
+    with unittest.mock.patch('sys.stdout'):
+      main(['train', '--games', '200', '--position', '1', '2', '2', '--output', filename])
+    player = PretrainedPlayer(filename)
+    g1 = Game()
+    g1.reset([1, 2, 2])
+    self.assertIn(player.move(g1), g1.get_allowed())
+
+    # Both learners keep to the memory limit
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+      main(['train', '--games', '300', '--position', '1', '3', '5', '7', '--max-states', '20', '--seed', '0',
+            '--output', filename, '--spill', os.path.join(os.path.dirname(filename), 'spill.db')])
+    results = json.loads(output.getvalue().splitlines()[-1])
+    for key in ['q_store', 'opponent_q_store']:
+      self.assertLessEqual(results[key]['in_memory'], 20)
+      self.assertGreater(results[key]['spilled'], 0)
+
+
+class SleepyPlayer(AsyncPlayer):
+  def __init__(self, delay, name='Sleepy'):
+    super().__init__(name)
+    self.delay = delay
+
+  async def move(self, game):
+    await asyncio.sleep(self.delay)
+    return 1, 1, 1
+
+
+class TestAsyncArena(unittest.TestCase):
+  def test_concurrent_games(self):
+    arenas = [AsyncArena(Game(2), SleepyPlayer(0.01), RandomPlayer()) for _ in range(500)]
+    start_time = time.monotonic()
+    winners = asyncio.run(play_games(arenas, max_concurrent=250))
+    # Played one after another, the sleeping alone would take at least 500 * 0.01 seconds
+    self.assertLess(time.monotonic() - start_time, 2.5)
+    self.assertEqual(len(winners), 500)
+    self.assertTrue(all(arena.forfeit_reason is None and not arena.game.is_still_on() for arena in arenas))
+
+  def test_timeout_forfeits(self):
+    slow = SleepyPlayer(1.)
+    arena = AsyncArena(Game(4), slow, PerfectPlayer(), move_timeout=0.05)
+    winner = asyncio.run(arena.play())
+    self.assertIsNot(winner, slow)
+    self.assertIn('ran out of time', arena.forfeit_reason)
+
 
 class TestGameWindow(unittest.TestCase):
   def test_computer_move_drawing(self):
     g1 = Game()
-    graph = sg.Graph(canvas_size=(500, 500), key='graph',
-                     graph_bottom_left=(0, 500), graph_top_right=(500, 0),
-                     enable_events=True,  # mouse click events
-                     background_color='lightblue',
-                     drag_submits=True)
-    window = sg.Window('Matchsticks', [[graph]], finalize=True)
-    gw = GameWindow(game=g1, window=window)
+    gw = GameWindow(game=g1, surface=RecordingSurface())
     gw.draw()
 
     layer = 4
@@ -161,13 +936,7 @@ class TestGameWindow(unittest.TestCase):
 
   def test_pyramid_update(self):
     g1 = Game()
-    graph = sg.Graph(canvas_size=(500, 500), key='graph',
-                     graph_bottom_left=(0, 500), graph_top_right=(500, 0),
-                     enable_events=True,  # mouse click events
-                     background_color='lightblue',
-                     drag_submits=True)
-    window = sg.Window('Matchsticks', [[graph]], finalize=True)
-    gw = GameWindow(game=g1, window=window)
+    gw = GameWindow(game=g1, surface=RecordingSurface())
 
     layer = 4
     left_idx = 5
@@ -187,9 +956,80 @@ class TestGameWindow(unittest.TestCase):
     self.assertEqual(gw.pyramid.rows[1].matchsticks[0].layer, 2)
     self.assertEqual(gw.pyramid.rows[1].matchsticks[0].idx, 1)
 
-  # At this point, I don't think there is a way to automatically get a move from the human
+  def test_headless_drawing(self):
+    surface = RecordingSurface()
+    gw = GameWindow(game=Game(), surface=surface)
+    gw.draw()
+    gw.draw_move((4, 5, 6))
+    self.assertEqual(len(surface.figures), 17)
+    self.assertEqual([call[0] for call in surface.calls[-4:]], ['draw_line', 'recolour_figure', 'recolour_figure', 'refresh'])
+
+    # The crossing line and the crossed-off sticks show up in red
+    image = surface.rasterise()
+    self.assertEqual(image.shape, (500, 500, 3))
+    (x1, y1), (x2, y2), colour, _ = surface.figures[17]
+    self.assertEqual(colour, 'red')
+    self.assertEqual(tuple(image[int(y1), int((x1 + x2) / 2)]), (255, 0, 0))
+
+    filename = os.path.join(tempfile.mkdtemp(), 'game.png')
+    surface.save_png(filename)
+    with open(filename, 'rb') as f:
+      self.assertEqual(f.read(8), b'\x89PNG\r\n\x1a\n')
+
+    gw.clear()
+    self.assertEqual(surface.figures, {})
+
+  def test_replay(self):
+    record = GameRecord([1, 3, 5, 7], [(4, 2, 4), (5, 1, 5), (1, 1, 1)])
+    surface = RecordingSurface()
+    gw = GameWindow(game=Game(3), surface=surface)
+    gw.draw()
+    gw.replay(record, move_delay=0)
+    self.assertEqual(gw.game.get_state(), (1, 3, 3))
+    self.assertEqual(len(surface.figures), 16 + 3)
+    self.assertEqual(sum(colour == 'red' for _, _, colour, _ in surface.figures.values()), 3 + 9)
+
+    # Closing the window stops the replay
+    gw.events = ReplayEventSource([(sg.WIN_CLOSED, None)])
+    with self.assertRaises(ClosedWindowException):
+      gw.replay(record, move_delay=1)
+    self.assertEqual(gw.game.get_state(), (1, 3, 5, 7))
+
   def test_human_move_recording(self):
-    pass
+    gw = GameWindow(game=Game(), surface=RecordingSurface())
+    gw.draw()
+    row = gw.pyramid.rows[3].matchsticks
+    row_above = gw.pyramid.rows[2].matchsticks
+
+    # A stroke which misses, one which reaches into another row, and then a move across sticks 2 to 4 of the last row
+    stroke = drag_events((row[1].h_pos - 5, row[1].v_pos), (row[3].h_pos + 5, row[3].v_pos))
+    events = RecordingEventSource(ReplayEventSource(
+      drag_events((10, 10), (30, 10))
+      + drag_events((row[3].h_pos - 5, row[3].v_pos), (row_above[3].h_pos + 5, row_above[3].v_pos))
+      + stroke, exhausted_wait=0))
+    gw.events = events
+    self.assertEqual(gw.get_and_play_human_move(), (4, 2, 4))
+    self.assertEqual([stick.is_active for stick in row], [True, False, False, False, True, True, True])
+    self.assertEqual(len(gw.crossing_lines), 1)
+    self.assertEqual(len(gw.surface.figures), 17)  # The lines of the rejected strokes were removed
+
+    # The recorded events play the same move back
+    filename = os.path.join(tempfile.mkdtemp(), 'events.jsonl')
+    events.save(filename)
+    self.assertEqual(load_events(filename)[-len(stroke):], stroke)
+    gw = GameWindow(game=Game(), surface=RecordingSurface(), events=ReplayEventSource(load_events(filename), exhausted_wait=0))
+    gw.draw()
+    self.assertEqual(gw.get_and_play_human_move(), (4, 2, 4))
+
+    # Once the events run out, the window counts as closed
+    with self.assertRaises(ClosedWindowException):
+      gw.get_and_play_human_move()
+
+  def test_input_stress(self):
+    results = run_stress(num_strokes=500, num_layers=4)
+    self.assertEqual(results['stroke_latency']['count'], 500)
+    self.assertEqual(results['drag_latency']['count'], 500 * 5)
+    self.assertGreater(results['moves'], 0)
 
 
 if __name__ == '__main__':